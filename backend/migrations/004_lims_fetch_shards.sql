@@ -0,0 +1,54 @@
+-- ============================================================================
+-- Migration 004: Work queue for sharded LIMS fetches
+-- ============================================================================
+-- Purpose: Let several fetch_lims_data.py worker processes (on one host or
+-- many) share a comprehensive pass or a backfill.
+--
+-- A run is split into shards of consecutive days (--enqueue-shards). Workers
+-- (--shard-worker) claim pending shards with FOR UPDATE SKIP LOCKED, stage
+-- the records they fetch in lims_fetch_shard_records and mark the shard done.
+-- The merge step (--merge-shards) then applies done shards in shard order to
+-- the record store, so the result does not depend on which worker finished
+-- first.
+-- ============================================================================
+
+CREATE TABLE IF NOT EXISTS lims_fetch_shards (
+  id SERIAL PRIMARY KEY,
+  run_id VARCHAR(40) NOT NULL,
+  shard_no INTEGER NOT NULL,
+  days DATE[] NOT NULL,
+  -- pending | running | done | failed | merged
+  status VARCHAR(10) NOT NULL DEFAULT 'pending',
+  attempts INTEGER NOT NULL DEFAULT 0,
+  claimed_by VARCHAR(100),
+  claimed_at TIMESTAMP,
+  heartbeat_at TIMESTAMP,
+  finished_at TIMESTAMP,
+  records INTEGER,
+  day_patients JSONB,
+  last_error TEXT,
+  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+  UNIQUE (run_id, shard_no)
+);
+
+CREATE INDEX IF NOT EXISTS idx_lims_fetch_shards_claim ON lims_fetch_shards(status, run_id, shard_no);
+
+-- Records fetched for a shard, in fetch order, until the shard is merged
+CREATE TABLE IF NOT EXISTS lims_fetch_shard_records (
+  shard_id INTEGER NOT NULL REFERENCES lims_fetch_shards(id) ON DELETE CASCADE,
+  ord INTEGER NOT NULL,
+  encounter_date DATE NOT NULL,
+  invoice_no VARCHAR(50) NOT NULL,
+  lab_no VARCHAR(50) NOT NULL,
+  source VARCHAR(100) NOT NULL,
+  test_name VARCHAR(255) NOT NULL,
+  PRIMARY KEY (shard_id, ord)
+);
+
+-- ============================================================================
+-- ROLLBACK SCRIPT (if needed)
+-- ============================================================================
+
+-- To rollback this migration:
+-- 1. DROP TABLE lims_fetch_shard_records;
+-- 2. DROP TABLE lims_fetch_shards;
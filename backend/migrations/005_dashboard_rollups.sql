@@ -0,0 +1,100 @@
+-- ============================================================================
+-- Migration 005: Daily rollups of test_records for the dashboard
+-- ============================================================================
+-- Purpose: Precomputed per-day aggregates, so dashboard reads are small
+-- indexed range scans instead of GROUP BYs over the whole of test_records.
+--
+-- The rollups are maintained by scripts/common/rollups.py. Only dates that
+-- changed are recomputed: the Python writers (fetch sink, timeout scan) pass
+-- the dates they touched, and every refresh also picks up dates of rows whose
+-- updated_at moved since the last refresh (ingest.ts, transform.ts, the
+-- reception UI). A date is recomputed as a whole - its rows are deleted and
+-- re-aggregated in one transaction - so the rollups never drift.
+--
+-- All rollups leave out cancelled tests, as the dashboard queries do.
+-- TAT percentiles are per rollup row; they cannot be summed across rows.
+-- ============================================================================
+
+-- Dates waiting to be recomputed
+CREATE TABLE IF NOT EXISTS rollup_dirty_dates (
+  encounter_date DATE PRIMARY KEY,
+  marked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Single row: updated_at of test_records up to which changes were picked up
+CREATE TABLE IF NOT EXISTS rollup_state (
+  id BOOLEAN PRIMARY KEY DEFAULT true CHECK (id),
+  changes_seen_until TIMESTAMP,
+  refreshed_at TIMESTAMP
+);
+
+-- Per day, laboratory and shift
+CREATE TABLE IF NOT EXISTS rollup_daily (
+  encounter_date DATE NOT NULL,
+  laboratory VARCHAR(50) NOT NULL,
+  shift VARCHAR(20) NOT NULL,
+  requests INTEGER NOT NULL,
+  revenue DECIMAL(14,2) NOT NULL,
+  delayed INTEGER NOT NULL,
+  on_time INTEGER NOT NULL,
+  not_uploaded INTEGER NOT NULL,
+  -- actual_tat percentiles (minutes) of tests with a time-out
+  tat_p50 DECIMAL(10,1),
+  tat_p90 DECIMAL(10,1),
+  tat_p95 DECIMAL(10,1),
+  PRIMARY KEY (encounter_date, laboratory, shift)
+);
+
+-- Per day and hour of time-in
+CREATE TABLE IF NOT EXISTS rollup_hourly (
+  encounter_date DATE NOT NULL,
+  hour SMALLINT NOT NULL,
+  laboratory VARCHAR(50) NOT NULL,
+  shift VARCHAR(20) NOT NULL,
+  requests INTEGER NOT NULL,
+  revenue DECIMAL(14,2) NOT NULL,
+  delayed INTEGER NOT NULL,
+  on_time INTEGER NOT NULL,
+  PRIMARY KEY (encounter_date, hour, laboratory, shift)
+);
+
+-- Per day and test
+CREATE TABLE IF NOT EXISTS rollup_tests (
+  encounter_date DATE NOT NULL,
+  test_name VARCHAR(255) NOT NULL,
+  lab_section VARCHAR(100) NOT NULL,
+  laboratory VARCHAR(50) NOT NULL,
+  shift VARCHAR(20) NOT NULL,
+  requests INTEGER NOT NULL,
+  revenue DECIMAL(14,2) NOT NULL,
+  delayed INTEGER NOT NULL,
+  on_time INTEGER NOT NULL,
+  not_uploaded INTEGER NOT NULL,
+  tat_p50 DECIMAL(10,1),
+  tat_p90 DECIMAL(10,1),
+  PRIMARY KEY (encounter_date, test_name, lab_section, laboratory, shift)
+);
+
+CREATE INDEX IF NOT EXISTS idx_rollup_tests_test_name ON rollup_tests(test_name, encounter_date);
+CREATE INDEX IF NOT EXISTS idx_rollup_tests_lab_section ON rollup_tests(lab_section, encounter_date);
+
+-- Change detection scans test_records by updated_at
+CREATE INDEX IF NOT EXISTS idx_test_records_updated_at ON test_records(updated_at);
+
+-- Build the rollups of everything already loaded
+INSERT INTO rollup_dirty_dates (encounter_date)
+SELECT DISTINCT encounter_date FROM test_records
+ON CONFLICT DO NOTHING;
+
+INSERT INTO rollup_state (id, changes_seen_until)
+SELECT true, MAX(updated_at) FROM test_records
+ON CONFLICT DO NOTHING;
+
+-- ============================================================================
+-- ROLLBACK SCRIPT (if needed)
+-- ============================================================================
+
+-- To rollback this migration:
+-- 1. DROP TABLE rollup_tests, rollup_hourly, rollup_daily;
+-- 2. DROP TABLE rollup_state, rollup_dirty_dates;
+-- 3. DROP INDEX idx_test_records_updated_at;
@@ -0,0 +1,44 @@
+-- ============================================================================
+-- Migration 006: Join index from time-out files to encounters
+-- ============================================================================
+-- Purpose: Match scanned result files (timeout_records.file_name) to
+-- encounters in one set-based statement instead of one query per test.
+--
+-- timeout.py normalizes every file name into a few candidate keys (the
+-- literal name first, then without copy suffixes, INV/LAB prefixes,
+-- revision suffixes, ...) and stores them in timeout_file_keys. Matching
+-- joins the keys to encounters.invoice_no and encounters.lab_no, preferring
+-- the most literal key, stamps time_out / actual_tat on the tests still
+-- waiting for one, and records which encounter each file matched. Files that
+-- stay unmatched are reported by timeout.py.
+-- ============================================================================
+
+CREATE TABLE IF NOT EXISTS timeout_file_keys (
+  file_name VARCHAR(100) NOT NULL REFERENCES timeout_records(file_name) ON DELETE CASCADE,
+  -- 0 = the literal file name; higher ranks are looser normalizations
+  rank SMALLINT NOT NULL,
+  match_key VARCHAR(100) NOT NULL,
+  PRIMARY KEY (file_name, rank)
+);
+
+CREATE INDEX IF NOT EXISTS idx_timeout_file_keys_match_key ON timeout_file_keys(match_key);
+
+ALTER TABLE timeout_records
+  ADD COLUMN IF NOT EXISTS matched_lab_no VARCHAR(50),
+  ADD COLUMN IF NOT EXISTS matched_at TIMESTAMP;
+
+CREATE INDEX IF NOT EXISTS idx_timeout_records_unmatched
+  ON timeout_records(imported_at) WHERE matched_lab_no IS NULL;
+
+-- Tests still waiting for a time-out, the driving set of every match
+CREATE INDEX IF NOT EXISTS idx_test_records_awaiting_time_out
+  ON test_records(encounter_id) WHERE time_out IS NULL;
+
+-- ============================================================================
+-- ROLLBACK SCRIPT (if needed)
+-- ============================================================================
+
+-- To rollback this migration:
+-- 1. DROP TABLE timeout_file_keys;
+-- 2. ALTER TABLE timeout_records DROP COLUMN matched_lab_no, DROP COLUMN matched_at;
+-- 3. DROP INDEX idx_test_records_awaiting_time_out;
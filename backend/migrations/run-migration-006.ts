@@ -0,0 +1,52 @@
+import db from '../src/config/database';
+import fs from 'fs';
+import path from 'path';
+
+async function runMigration006() {
+  console.log('🔄 Running Migration 006: Timeout Join Index...');
+
+  const client = await db.pool.connect();
+
+  try {
+    // Check if migration has already been run
+    const migrationName = '006_timeout_join_index';
+    const checkResult = await client.query(
+      'SELECT id FROM migration_history WHERE migration_name = $1',
+      [migrationName]
+    );
+
+    if (checkResult.rows.length > 0) {
+      console.log(`✅ Migration ${migrationName} already applied, skipping`);
+      return; // client released in finally
+    }
+
+    // Read and execute the migration
+    const migrationPath = path.join(__dirname, '006_timeout_join_index.sql');
+    const migrationSQL = fs.readFileSync(migrationPath, 'utf-8');
+
+    await client.query('BEGIN');
+    await client.query(migrationSQL);
+
+    // Record that we ran this migration
+    await client.query(
+      'INSERT INTO migration_history (migration_name) VALUES ($1)',
+      [migrationName]
+    );
+
+    await client.query('COMMIT');
+
+    console.log('✅ Migration 006 completed successfully');
+  } catch (error) {
+    await client.query('ROLLBACK');
+    console.error('❌ Migration 006 failed:', error);
+    throw error;
+  } finally {
+    client.release();
+    await db.pool.end();
+  }
+}
+
+runMigration006().catch(error => {
+  console.error('Migration failed:', error);
+  process.exit(1);
+});
@@ -0,0 +1,190 @@
+"""
+Offline benchmark of the LIMS fetch pipeline against the stand-in server.
+
+Usage:
+    py -3.11 scripts/benchmarks/bench_fetch.py                        # 1k, 10k, 100k patients
+    py -3.11 scripts/benchmarks/bench_fetch.py --scales 1000 --latency-ms 20 --json out.json
+
+For every scale a comprehensive pass over ``--days`` days is streamed
+through iter_record_batches (cold: no detail cache, no page hashes) with
+each batch written by save_data and data.json exported at the end, as
+run_pass does; then the fetched search pages are parsed again with each
+available parser backend. The stand-in server runs in its own process and every scale in
+another, so peak RSS belongs to the fetcher alone. All state files of the
+fetcher are redirected to a temporary directory; only its debug log in
+backend/logs is reset on import, as on any run.
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import queue as queue_module
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCH_DIR))
+sys.path.insert(0, str(BENCH_DIR.parent / 'data-fetching'))
+
+import lims_parsers  # noqa: E402
+from lims_standin import StandinLims, start_server  # noqa: E402
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Module constants of fetch_lims_data pointing at files the benchmark must not touch
+STATE_PATHS = ('LAST_RUN_FILE', 'COMPREHENSIVE_RUN_FILE', 'LOCK_FILE', 'STATE_DB_FILE', 'RECORDS_DB_FILE')
+
+
+def peak_rss_mb():
+    # ru_maxrss is KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 if resource else None
+
+
+def serve(patients_per_day, latency_ms, recordings, queue):
+    server = start_server(StandinLims(patients_per_day, latency_ms, recordings))
+    queue.put(server.server_port)
+    threading.Event().wait()  # until terminated
+
+
+def run_scale(scale, days, port, workers, queue):
+    os.environ.update({
+        'LIMS_URL': f"http://127.0.0.1:{port}",
+        'LIMS_USERNAME': 'bench',
+        'LIMS_PASSWORD': 'bench',
+        'LIMS_MAX_REQUESTS_PER_SECOND': '0',
+        'LIMS_DETAIL_WORKERS': str(workers),
+    })
+    import fetch_lims_data as f
+
+    tmp = Path(tempfile.mkdtemp(prefix='lims-bench-'))
+    for name in STATE_PATHS:
+        setattr(f, name, str(tmp / os.path.basename(getattr(f, name))))
+    f.DATA_FILE = str(tmp / 'data.json')
+    f.LOGS_DIR = tmp
+    f.CHANGED_DAYS_REPORT = tmp / 'lims_changed_days.json'
+    f.console_handler.setLevel(logging.WARNING)
+    logging.getLogger().removeHandler(f.file_handler)
+
+    rss_start = peak_rss_mb()
+    f.fetch_metrics.reset()
+    session = f.create_session()
+    session.login()
+
+    today = date.today()
+    day_list = [today - timedelta(days=n) for n in range(days - 1, -1, -1)]
+    records = 0
+    save_seconds = 0.0
+    started = time.perf_counter()
+    for batch in f.iter_record_batches(session, day_list[0], True, days=day_list):
+        records += len(batch)
+        save_started = time.perf_counter()
+        f.save_data(batch, export=False)
+        save_seconds += time.perf_counter() - save_started
+    save_started = time.perf_counter()
+    f.export_data_json()
+    save_seconds += time.perf_counter() - save_started
+    fetch_seconds = time.perf_counter() - started - save_seconds
+    counters = f.fetch_metrics.report()['counters']
+    rss_pipeline = peak_rss_mb()
+
+    pages = [f.lims_get(session, f.SEARCH_URL, params={'searchtype': 'date', 'datepicker': day.isoformat(),
+                                                       'Get': 'Get'}).text
+             for day in day_list]
+    parse_seconds = {}
+    for backend in lims_parsers.BACKENDS:
+        if backend == 'lxml' and lims_parsers.etree is None:
+            continue
+        f.HTML_PARSER = backend
+        started = time.perf_counter()
+        for html in pages:
+            f.parse_patient_table(html, 'bench')
+        parse_seconds[backend] = time.perf_counter() - started
+
+    queue.put({
+        'patients': scale,
+        'days': days,
+        'records': records,
+        'requests': counters.get('http_requests', 0),
+        'bytes': counters.get('http_bytes', 0),
+        'fetch_seconds': round(fetch_seconds, 3),
+        'requests_per_second': round(counters.get('http_requests', 0) / fetch_seconds, 1) if fetch_seconds else None,
+        'save_seconds': round(save_seconds, 3),
+        'parse_seconds': {k: round(v, 3) for k, v in parse_seconds.items()},
+        'rss_start_mb': rss_start,
+        # Peak of the fetch/save pipeline, before the parser runs load every page at once
+        'peak_rss_mb': rss_pipeline,
+    })
+
+
+def receive(queue, proc, what, timeout):
+    """Next item ``proc`` puts on ``queue``; exits non-zero if it dies or ``timeout`` seconds pass first"""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return queue.get(timeout=1)
+        except queue_module.Empty:
+            pass
+        if not proc.is_alive():
+            try:
+                return queue.get_nowait()  # put just before exiting
+            except queue_module.Empty:
+                raise SystemExit(f"{what} exited with code {proc.exitcode} without a result")
+        if time.monotonic() >= deadline:
+            proc.terminate()
+            raise SystemExit(f"{what} produced no result within {timeout:g}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the LIMS fetcher against a local stand-in server")
+    parser.add_argument('--scales', default='1000,10000,100000', help="comma-separated patient counts")
+    parser.add_argument('--days', type=int, default=30, help="days the patients are spread over")
+    parser.add_argument('--latency-ms', type=float, default=0.0, help="stand-in latency per GET")
+    parser.add_argument('--workers', type=int, default=8, help="LIMS_DETAIL_WORKERS for the fetcher")
+    parser.add_argument('--recordings', help="directory of saved LIMS pages for the stand-in to replay")
+    parser.add_argument('--json', help="also write the results to this JSON file")
+    parser.add_argument('--timeout', type=float, default=3600, help="seconds allowed per scale")
+    args = parser.parse_args()
+
+    ctx = multiprocessing.get_context('spawn')
+    results = []
+    print(f"{'patients':>9} {'records':>9} {'requests':>9} {'fetch s':>9} {'req/s':>8} "
+          f"{'save s':>8} {'parse s':>24} {'peak RSS MB':>12}")
+    for scale in (int(s) for s in args.scales.split(',')):
+        server_queue = ctx.Queue()
+        server = ctx.Process(target=serve, daemon=True,
+                             args=(max(1, scale // args.days), args.latency_ms, args.recordings, server_queue))
+        server.start()
+        try:
+            port = receive(server_queue, server, "stand-in server", 60)
+
+            queue = ctx.Queue()
+            proc = ctx.Process(target=run_scale, args=(scale, args.days, port, args.workers, queue))
+            proc.start()
+            result = receive(queue, proc, f"{scale} patient run", args.timeout)
+            proc.join()
+        finally:
+            server.terminate()
+            server.join()
+
+        results.append(result)
+        parse = ' '.join(f"{k}={v:.2f}" for k, v in result['parse_seconds'].items())
+        rss = f"{result['peak_rss_mb']:.0f}" if result['peak_rss_mb'] is not None else 'n/a'
+        print(f"{result['patients']:>9} {result['records']:>9} {result['requests']:>9} "
+              f"{result['fetch_seconds']:>9.2f} {result['requests_per_second'] or 0:>8.0f} "
+              f"{result['save_seconds']:>8.2f} {parse:>24} {rss:>12}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
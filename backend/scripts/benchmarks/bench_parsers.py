@@ -0,0 +1,124 @@
+"""
+Benchmark the LIMS HTML parser backends (lims_parsers.py).
+
+Usage:
+    py -3.11 scripts/benchmarks/bench_parsers.py                  # synthetic pages
+    py -3.11 scripts/benchmarks/bench_parsers.py --pages samples/ # saved LIMS pages
+
+Saved pages are any *.html files: search result pages (table#list) and
+hoverrequest_b.php detail pages (table.table-bordered) are told apart
+automatically. Each backend runs in its own process so its peak memory is
+measured in isolation; rows/sec covers extraction only, not HTTP.
+"""
+import argparse
+import multiprocessing
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'data-fetching'))
+
+import lims_parsers  # noqa: E402
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def synthetic_search_page(rows):
+    body = ''.join(
+        f"<tr><td>{(i % 28) + 1:02d}-04-2025</td><td>{i:010d}001</td><td>PATIENT {i}</td>"
+        f"<td>{500000 + i}</td><td>F</td><td>34</td><td>DR X</td><td>OPD</td></tr>"
+        for i in range(rows)
+    )
+    return (f"<html><head><title>Search</title></head><body><div class='menu'>menu</div>"
+            f"<table id='list'><tr><th>Date</th><th>Lab No</th><th>Name</th><th>Invoice</th>"
+            f"<th>Sex</th><th>Age</th><th>Doctor</th><th>Source</th></tr>{body}</table></body></html>")
+
+
+def synthetic_detail_page(tests):
+    body = ''.join(f"<tr><td>{i}</td><td>CODE{i}</td><td>TEST NUMBER {i}</td></tr>" for i in range(tests))
+    return (f"<div><table class='table table-bordered'><tr><th>#</th><th>Code</th><th>Test</th></tr>"
+            f"{body}</table></div>")
+
+
+def load_pages(pages_dir, rows):
+    if not pages_dir:
+        return [('list', None, synthetic_search_page(rows))] + \
+               [(None, 'table-bordered', synthetic_detail_page(5)) for _ in range(200)]
+    pages = []
+    for path in sorted(Path(pages_dir).glob('*.html')):
+        html = path.read_text(encoding='utf-8', errors='replace')
+        if lims_parsers.bs4_table_rows(html, table_id='list') is not None:
+            pages.append(('list', None, html))
+        else:
+            pages.append((None, 'table-bordered', html))
+    return pages
+
+
+def parse_all(parse, pages):
+    rows = 0
+    for table_id, table_class, html in pages:
+        rows += len(parse(html, table_id=table_id, table_class=table_class) or [])
+    return rows
+
+
+def measure(backend, pages, repeat, queue):
+    parse = lims_parsers.BACKENDS[backend]
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource else 0
+
+    rows = 0
+    started = time.perf_counter()
+    for _ in range(repeat):
+        rows += parse_all(parse, pages)
+    elapsed = time.perf_counter() - started
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource else 0
+
+    # Separate traced pass: tracemalloc slows parsing down too much to time it
+    tracemalloc.start()
+    parse_all(parse, pages)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    queue.put({
+        'backend': backend,
+        'rows': rows,
+        'seconds': elapsed,
+        'py_peak_mb': peak / 1024 / 1024,
+        # ru_maxrss is KiB on Linux
+        'rss_growth_mb': (rss_after - rss_before) / 1024 if resource else None,
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark LIMS HTML parser backends")
+    parser.add_argument('--pages', help="directory of saved LIMS pages (*.html)")
+    parser.add_argument('--rows', type=int, default=5000, help="rows in the synthetic search page")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--backends', default=','.join(lims_parsers.BACKENDS))
+    args = parser.parse_args()
+
+    pages = load_pages(args.pages, args.rows)
+    print(f"Benchmarking {len(pages)} pages x {args.repeat} repeats")
+    print(f"{'backend':<8} {'rows':>10} {'seconds':>9} {'rows/sec':>12} {'py peak MB':>11} {'RSS growth MB':>14}")
+
+    ctx = multiprocessing.get_context('spawn')
+    for backend in args.backends.split(','):
+        if backend == 'lxml' and lims_parsers.etree is None:
+            print(f"{backend:<8} skipped (lxml not installed)")
+            continue
+        queue = ctx.Queue()
+        proc = ctx.Process(target=measure, args=(backend, pages, args.repeat, queue))
+        proc.start()
+        result = queue.get()
+        proc.join()
+        rate = result['rows'] / result['seconds'] if result['seconds'] else 0
+        rss = f"{result['rss_growth_mb']:.1f}" if result['rss_growth_mb'] is not None else 'n/a'
+        print(f"{backend:<8} {result['rows']:>10} {result['seconds']:>9.2f} {rate:>12.0f} "
+              f"{result['py_peak_mb']:>11.1f} {rss:>14}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,189 @@
+"""
+Memory / time benchmark of the record representations on a large history.
+
+Usage:
+    py -3.11 scripts/benchmarks/bench_records.py                   # 1M records
+    py -3.11 scripts/benchmarks/bench_records.py --records 200000 --json out.json
+
+A synthetic data.json and record store of ``--records`` records (LIMS-like
+LabNos, ~60 test names, a handful of sources) are built once in a temporary
+directory, then every scenario runs in its own process:
+  * json-dicts      json.load + dedup on (LabNo, TestName) tuples, the old path
+  * json-compact    json.load + conversion to Records deduplicated on record_key
+  * store-dicts     RecordStore.iter_records into a list of dicts
+  * store-compact   RecordStore.iter_compact into a list of Records
+Time is measured on a plain run; retained and peak memory come from a
+second run under tracemalloc, which would otherwise slow the first.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, timedelta
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCH_DIR.parent / 'data-fetching'))
+
+from record_store import RECORD_FIELDS, Record, RecordStore  # noqa: E402
+
+SOURCES = ('OPD', 'ANNEX', 'WARD A', 'DOCTORS PLAZA ANNEX', 'CASUALTY')
+TESTS = tuple(f"TEST {n}" for n in range(60))
+
+
+def synthetic_records(count):
+    """LIMS-shaped records, 1-4 tests per patient, ~300 patients per day"""
+    day = date.today() - timedelta(days=count // 750)
+    made = patient = 0
+    while made < count:
+        if patient and patient % 300 == 0:
+            day += timedelta(days=1)
+        minute = (patient * 7) % 1440
+        lab_no = f"{day:%d%m%y}{minute // 60:02d}{minute % 60:02d}{patient % 100000:05d}"
+        for k in range(min(patient % 4 + 1, count - made)):
+            yield {
+                "EncounterDate": day.isoformat(),
+                "InvoiceNo": f"{day.toordinal()}{patient % 100000:05d}",
+                "LabNo": lab_no,
+                "Src": SOURCES[patient % len(SOURCES)],
+                "TestName": TESTS[(patient * 7 + k) % len(TESTS)],
+            }
+            made += 1
+        patient += 1
+
+
+def build_fixtures(directory, count):
+    json_path = os.path.join(directory, 'data.json')
+    store_path = os.path.join(directory, 'records.sqlite3')
+    store = RecordStore(store_path)
+    with open(json_path, 'w', encoding='utf-8') as f:
+        f.write('[')
+        batch = []
+        for n, record in enumerate(synthetic_records(count)):
+            f.write(',\n  ' if n else '\n  ')
+            f.write(json.dumps(record))
+            batch.append(record)
+            if len(batch) >= 50000:
+                store.append(batch)
+                batch = []
+        store.append(batch)
+        f.write('\n]\n')
+    store.close()
+    return json_path, store_path
+
+
+def load_json_dicts(json_path, store_path):
+    with open(json_path, 'r', encoding='utf-8') as f:
+        records = json.load(f)
+    seen, kept = set(), []
+    for record in records:
+        if not all(record.get(field) for field in RECORD_FIELDS):
+            continue
+        key = (record['LabNo'], record['TestName'])
+        if key not in seen:
+            seen.add(key)
+            kept.append(record)
+    return kept, seen
+
+
+def load_json_compact(json_path, store_path):
+    with open(json_path, 'r', encoding='utf-8') as f:
+        records = json.load(f)
+    records.reverse()
+    seen, kept = set(), []
+    while records:
+        record = records.pop()
+        if not all(record.get(field) for field in RECORD_FIELDS):
+            continue
+        record = Record.from_dict(record)
+        key = record.key
+        if key not in seen:
+            seen.add(key)
+            kept.append(record)
+    return kept, seen
+
+
+def load_store_dicts(json_path, store_path):
+    store = RecordStore(store_path)
+    try:
+        return list(store.iter_records()), None
+    finally:
+        store.close()
+
+
+def load_store_compact(json_path, store_path):
+    store = RecordStore(store_path)
+    try:
+        return list(store.iter_compact()), None
+    finally:
+        store.close()
+
+
+SCENARIOS = {
+    'json-dicts': load_json_dicts,
+    'json-compact': load_json_compact,
+    'store-dicts': load_store_dicts,
+    'store-compact': load_store_compact,
+}
+
+
+def run_scenario(name, json_path, store_path, queue):
+    load = SCENARIOS[name]
+    started = time.perf_counter()
+    records, _ = load(json_path, store_path)
+    seconds = time.perf_counter() - started
+    count = len(records)
+    del records, _
+
+    tracemalloc.start()
+    result = load(json_path, store_path)
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+
+    queue.put({
+        'scenario': name,
+        'records': count,
+        'seconds': round(seconds, 3),
+        'retained_mb': round(retained / 2 ** 20, 1),
+        'peak_mb': round(peak / 2 ** 20, 1),
+        'bytes_per_record': round(retained / count) if count else None,
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark dict vs compact record representations")
+    parser.add_argument('--records', type=int, default=1_000_000, help="synthetic history size")
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help="comma-separated scenarios to run")
+    parser.add_argument('--json', help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    ctx = multiprocessing.get_context('spawn')
+    results = []
+    with tempfile.TemporaryDirectory(prefix='lims-records-bench-') as tmp:
+        started = time.perf_counter()
+        json_path, store_path = build_fixtures(tmp, args.records)
+        print(f"Built {args.records} records in {time.perf_counter() - started:.1f}s "
+              f"(data.json {os.path.getsize(json_path) / 2 ** 20:.0f} MB)")
+        print(f"{'scenario':>14} {'records':>9} {'seconds':>8} {'retained MB':>12} {'peak MB':>9} {'B/record':>9}")
+        for name in args.scenarios.split(','):
+            queue = ctx.Queue()
+            proc = ctx.Process(target=run_scenario, args=(name, json_path, store_path, queue))
+            proc.start()
+            result = queue.get()
+            proc.join()
+            results.append(result)
+            print(f"{result['scenario']:>14} {result['records']:>9} {result['seconds']:>8.2f} "
+                  f"{result['retained_mb']:>12.1f} {result['peak_mb']:>9.1f} {result['bytes_per_record'] or 0:>9}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+"""
+Local stand-in for the LIMS web app, for offline benchmarks and testing.
+
+Serves the pages fetch_lims_data.py talks to:
+  * index.php?m=        login form with the hidden rdm token
+  * auth.php            login POST, redirects to home.php
+  * home.php
+  * search.php          searchtype=date | daterange | period
+  * hoverrequest_b.php  patient detail (test list)
+
+Pages are synthetic by default: every day has ``patients_per_day``
+patients with 1-4 tests each, generated deterministically from the date,
+so repeated runs see identical data. With ``--recordings DIR`` saved pages
+are replayed instead where present (synthetic pages fill the gaps):
+    search_date_<YYYY-MM-DD>.html, search_daterange.html,
+    search_period.html, detail_<InvoiceNo>_<LabNo>.html, detail.html
+
+Usage:
+    py -3.11 scripts/benchmarks/lims_standin.py --port 8090 --patients-per-day 300 --latency-ms 20
+    (then point LIMS_URL at http://127.0.0.1:8090)
+"""
+import argparse
+import threading
+import time
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+SOURCES = ('OPD', 'ANNEX', 'WARD A', 'DOCTORS PLAZA ANNEX', 'CASUALTY')
+
+
+class StandinLims:
+    """Page generator / replayer behind the stand-in server"""
+
+    def __init__(self, patients_per_day=100, latency_ms=0.0, recordings=None):
+        self.patients_per_day = patients_per_day
+        self.latency = latency_ms / 1000.0
+        self.recordings = Path(recordings) if recordings else None
+
+    def recorded(self, name):
+        if self.recordings is None:
+            return None
+        path = self.recordings / name
+        return path.read_text(encoding='utf-8', errors='replace') if path.exists() else None
+
+    def patients_for(self, day):
+        for i in range(self.patients_per_day):
+            minute = (i * 7) % 1440
+            lab_no = f"{day:%d%m%y}{minute // 60:02d}{minute % 60:02d}{i:05d}"
+            yield day, lab_no, f"{day.toordinal()}{i:05d}", SOURCES[i % len(SOURCES)]
+
+    @staticmethod
+    def search_page(patients):
+        rows = ''.join(
+            f"<tr><td>{day:%d-%m-%Y}</td><td>{lab_no}</td><td>PATIENT {lab_no[-5:]}</td>"
+            f"<td>{invoice_no}</td><td>F</td><td>34</td><td>DR X</td><td>{source}</td></tr>"
+            for day, lab_no, invoice_no, source in patients
+        )
+        return (f"<html><head><title>Search</title></head><body><div class='menu'>menu</div>"
+                f"<table id='list'><tr><th>Date</th><th>Lab No</th><th>Name</th><th>Invoice</th>"
+                f"<th>Sex</th><th>Age</th><th>Doctor</th><th>Source</th></tr>{rows}</table></body></html>")
+
+    @staticmethod
+    def detail_page(lab_no):
+        seed = int(lab_no[-5:]) if lab_no[-5:].isdigit() else len(lab_no)
+        rows = ''.join(
+            f"<tr><td>{k + 1}</td><td>CODE{(seed * 7 + k) % 60}</td><td>TEST {(seed * 7 + k) % 60}</td></tr>"
+            for k in range(seed % 4 + 1)
+        )
+        return (f"<div><table class='table table-bordered'><tr><th>#</th><th>Code</th><th>Test</th></tr>"
+                f"{rows}</table></div>")
+
+    def search(self, query):
+        searchtype = query.get('searchtype')
+        if searchtype == 'date':
+            day = date.fromisoformat(query['datepicker'])
+            return self.recorded(f"search_date_{day.isoformat()}.html") or \
+                self.search_page(self.patients_for(day))
+        if searchtype == 'daterange':
+            start = date.fromisoformat(query['datepicker'])
+            end = date.fromisoformat(query['datepicker2'])
+            days = [start + timedelta(days=n) for n in range((end - start).days + 1)]
+            return self.recorded('search_daterange.html') or \
+                self.search_page(p for day in days for p in self.patients_for(day))
+        if searchtype == 'period':
+            today = date.today()
+            days = [today - timedelta(days=n) for n in range(3)]
+            return self.recorded('search_period.html') or \
+                self.search_page(p for day in days for p in self.patients_for(day))
+        return None
+
+    def detail(self, query):
+        invoice_no, lab_no = query.get('iid', ''), query.get('encounterno', '')
+        return self.recorded(f"detail_{invoice_no}_{lab_no}.html") or self.recorded('detail.html') or \
+            self.detail_page(lab_no)
+
+
+def make_handler(lims):
+    class StandinHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        # Headers and body go out as separate writes; without TCP_NODELAY every
+        # keep-alive request stalls on delayed ACKs
+        disable_nagle_algorithm = True
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, body, status=200, location=None):
+            payload = body.encode('utf-8')
+            self.send_response(status)
+            if location:
+                self.send_header('Location', location)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            if urlparse(self.path).path == '/auth.php':
+                self._send('', 302, '/home.php')
+            else:
+                self._send('not found', 404)
+
+        def do_GET(self):
+            if lims.latency:
+                time.sleep(lims.latency)
+            url = urlparse(self.path)
+            query = {k: v[0] for k, v in parse_qs(url.query).items()}
+            if url.path == '/index.php':
+                self._send('<form><input name="rdm" type="hidden" value="standin" /></form>')
+            elif url.path == '/home.php':
+                self._send('<html><body>home</body></html>')
+            elif url.path == '/search.php':
+                page = lims.search(query)
+                if page is None:
+                    self._send('bad searchtype', 400)
+                else:
+                    self._send(page)
+            elif url.path == '/hoverrequest_b.php':
+                self._send(lims.detail(query))
+            else:
+                self._send('not found', 404)
+
+    return StandinHandler
+
+
+def start_server(lims, host='127.0.0.1', port=0):
+    """Serve ``lims`` on a background thread; returns the server (``server_port`` is the bound port)"""
+    server = ThreadingHTTPServer((host, port), make_handler(lims))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='lims-standin', daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stand-in LIMS server for offline benchmarks")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--patients-per-day', type=int, default=100)
+    parser.add_argument('--latency-ms', type=float, default=0.0, help="added to every GET")
+    parser.add_argument('--recordings', help="directory of saved LIMS pages to replay")
+    args = parser.parse_args()
+
+    lims = StandinLims(args.patients_per_day, args.latency_ms, args.recordings)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(lims))
+    server.daemon_threads = True
+    print(f"Stand-in LIMS on http://{args.host}:{server.server_port} "
+          f"({args.patients_per_day} patients/day, {args.latency_ms:g} ms latency)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
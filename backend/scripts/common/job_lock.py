@@ -0,0 +1,255 @@
+"""
+Single-instance locks for the scheduled Python jobs (LIMS fetch, timeout scan).
+
+Each job holds an OS file lock (fcntl.flock, or msvcrt.locking on
+Windows) or, with ``backend='postgres'``, a PostgreSQL session advisory
+lock, so jobs on separate hosts sharing the database exclude each other.
+Both are released by the OS / the server when the holder dies, so there
+is no staleness window to guess: a lock that is held belongs to a live
+process.
+
+Overlapping triggers are coalesced. Next to the run lock sits a queue
+lock: a second process takes the queue lock and waits for the run lock,
+any further process finds the queue taken and exits, knowing the queued
+run will pick up its work. At most one run and one follow-up exist per
+job at any time.
+
+While the lock is held a heartbeat thread records pid, host and the time
+of the last beat in ``<lock>.json`` (shown when another process finds the
+job busy) and, for advisory locks, keeps the session alive; if the
+session is lost and the lock cannot be taken back, ``lost`` is set.
+"""
+import hashlib
+import json
+import os
+import socket
+import threading
+import time
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+try:
+    import psycopg2
+except ImportError:  # only needed for the postgres backend
+    psycopg2 = None
+
+HEARTBEAT_SECONDS = 30
+
+
+class _FileLock:
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+
+    def try_acquire(self):
+        f = open(self.path, 'a+')
+        try:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        except OSError:
+            f.close()
+            return False
+        self.file = f
+        return True
+
+    def release(self):
+        if self.file is None:
+            return
+        try:
+            if fcntl is not None:
+                fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+            else:
+                self.file.seek(0)
+                msvcrt.locking(self.file.fileno(), msvcrt.LK_UNLCK, 1)
+        finally:
+            self.file.close()
+            self.file = None
+
+    def keepalive(self):
+        return True
+
+
+class _AdvisoryLock:
+    def __init__(self, database_url, name):
+        self.database_url = database_url
+        # Advisory lock keys are signed 64-bit integers
+        self.key = int.from_bytes(hashlib.sha1(name.encode('utf-8')).digest()[:8], 'big', signed=True)
+        self.conn = None
+
+    def try_acquire(self):
+        if self.conn is None:
+            self.conn = psycopg2.connect(self.database_url)
+            self.conn.autocommit = True
+        with self.conn.cursor() as cur:
+            cur.execute("SELECT pg_try_advisory_lock(%s)", (self.key,))
+            acquired = cur.fetchone()[0]
+        if not acquired:
+            self.conn.close()
+            self.conn = None
+        return acquired
+
+    def release(self):
+        if self.conn is None:
+            return
+        try:
+            with self.conn.cursor() as cur:
+                cur.execute("SELECT pg_advisory_unlock(%s)", (self.key,))
+        except psycopg2.Error:
+            pass  # session already gone, and the lock with it
+        finally:
+            self.conn.close()
+            self.conn = None
+
+    def keepalive(self):
+        """True while the session (and with it the lock) is alive; else try to take the lock back"""
+        try:
+            with self.conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            return True
+        except psycopg2.Error:
+            try:
+                self.conn.close()
+            except psycopg2.Error:
+                pass
+            self.conn = None
+            try:
+                return self.try_acquire()
+            except psycopg2.Error:
+                return False
+
+
+class JobLock:
+    """Run lock for one job; see the module docstring.
+
+    ``path`` is the lock file (the queue lock and heartbeat file are
+    derived from it); it also names the advisory locks. ``backend`` is
+    ``'file'`` or ``'postgres'`` (needs ``database_url``).
+    """
+
+    def __init__(self, path, backend='file', database_url=None, heartbeat_seconds=HEARTBEAT_SECONDS,
+                 logger=None):
+        self.path = str(path)
+        self.info_path = f"{self.path}.json"
+        self.heartbeat_seconds = heartbeat_seconds
+        self.log = logger.info if logger else print
+        self.warn = logger.warning if logger else print
+        if backend == 'postgres':
+            if psycopg2 is None:
+                raise RuntimeError("psycopg2 is required for postgres job locks (pip install psycopg2-binary)")
+            if not database_url:
+                raise RuntimeError("DATABASE_URL is required for postgres job locks")
+            name = os.path.basename(self.path)
+            self._run = _AdvisoryLock(database_url, name)
+            self._queue = _AdvisoryLock(database_url, f"{name}:queue")
+        elif backend == 'file':
+            self._run = _FileLock(self.path)
+            self._queue = _FileLock(f"{self.path}.queue")
+        else:
+            raise ValueError(f"Unknown job lock backend: {backend!r}")
+        self.held = False
+        self.lost = threading.Event()
+        self._stop = threading.Event()
+        self._heartbeat = None
+
+    def holder(self):
+        """What the current holder last wrote to the heartbeat file, with ``age_seconds``"""
+        try:
+            with open(self.info_path, 'r', encoding='utf-8') as f:
+                info = json.load(f)
+        except (OSError, ValueError):
+            return None
+        info['age_seconds'] = round(time.time() - info.get('heartbeat_at', 0), 1)
+        return info
+
+    def _describe_holder(self):
+        info = self.holder()
+        if not info:
+            return "another process"
+        return (f"pid {info.get('pid')} on {info.get('host')} since {info.get('started')}, "
+                f"last heartbeat {info['age_seconds']:.0f}s ago")
+
+    def acquire(self, coalesce=False, wait_seconds=None, poll_seconds=1.0):
+        """Take the run lock; returns True if this process may run the job.
+
+        If the job is busy and ``coalesce`` is set, become its queued
+        follow-up: wait (up to ``wait_seconds``, or indefinitely) for the
+        run lock, unless a follow-up is already queued, in which case
+        return False straight away.
+        """
+        if self._run.try_acquire():
+            self._start()
+            return True
+        if not coalesce:
+            self.log(f"Job is already running ({self._describe_holder()}). Exiting.")
+            return False
+        if not self._queue.try_acquire():
+            self.log(f"Job is already running ({self._describe_holder()}) and a follow-up run is queued. Exiting.")
+            return False
+        try:
+            self.log(f"Job is already running ({self._describe_holder()}); queued to run when it finishes.")
+            deadline = None if wait_seconds is None else time.monotonic() + wait_seconds
+            while not self._run.try_acquire():
+                if deadline is not None and time.monotonic() >= deadline:
+                    self.warn(f"Gave up waiting for the running job after {wait_seconds:.0f}s.")
+                    return False
+                time.sleep(poll_seconds)
+        finally:
+            # Free the queue slot: the next overlapping trigger may queue behind this run
+            self._queue.release()
+        self._start()
+        return True
+
+    def _start(self):
+        self.held = True
+        self.lost.clear()
+        self._stop.clear()
+        self._info = {'pid': os.getpid(), 'host': socket.gethostname(),
+                      'started': datetime.now().isoformat(timespec='seconds')}
+        self._beat()
+        self._heartbeat = threading.Thread(target=self._heartbeat_loop, name='job-lock-heartbeat', daemon=True)
+        self._heartbeat.start()
+
+    def _beat(self):
+        tmp_path = f"{self.info_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({**self._info, 'heartbeat_at': time.time()}, f)
+            os.replace(tmp_path, self.info_path)
+        except OSError as e:
+            self.warn(f"Could not write lock heartbeat: {e}")
+
+    def _heartbeat_loop(self):
+        while not self._stop.wait(self.heartbeat_seconds):
+            if not self._run.keepalive():
+                self.warn("Job lock was lost (database session gone and the lock is taken).")
+                self.lost.set()
+                return
+            self._beat()
+
+    def release(self):
+        if not self.held:
+            return
+        self._stop.set()
+        if self._heartbeat is not None:
+            self._heartbeat.join()
+            self._heartbeat = None
+        try:
+            os.remove(self.info_path)
+        except OSError:
+            pass
+        self._run.release()
+        self.held = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
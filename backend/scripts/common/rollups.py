@@ -0,0 +1,207 @@
+"""
+Incremental maintenance of the dashboard rollup tables (migration 005).
+
+Writers hand over the encounter dates they touched; on top of those, every
+refresh marks the dates of test_records rows whose ``updated_at`` moved
+since the previous refresh, which covers the TypeScript writers (ingest,
+transform, reception updates) without them knowing about rollups. Each
+dirty date is then recomputed as a whole from test_records: its rollup
+rows are deleted and re-aggregated in the same transaction, so a refresh
+costs a few indexed day scans however large the history is.
+
+Usage (a full rebuild, e.g. after bulk deletes):
+    py -3.11 scripts/common/rollups.py --rebuild [--from 2025-01-01] [--to 2025-03-31]
+"""
+import argparse
+import os
+from datetime import date, timedelta
+
+try:
+    import psycopg2
+except ImportError:  # only needed when rollups are enabled
+    psycopg2 = None
+
+# Dates recomputed per transaction
+BATCH_DAYS = 31
+# updated_at is the writing transaction's start time, so a transaction still
+# open at the last refresh can commit rows older than the watermark; look
+# back this far (the sink's batch transactions take seconds)
+CHANGE_OVERLAP = timedelta(minutes=5)
+
+ROLLUP_TABLES = ('rollup_daily', 'rollup_hourly', 'rollup_tests')
+
+MARK_DATES = """
+    INSERT INTO rollup_dirty_dates (encounter_date)
+    SELECT DISTINCT unnest(%s::date[])
+    ON CONFLICT DO NOTHING
+"""
+
+MARK_CHANGED = """
+    WITH changed AS (
+      SELECT encounter_date, updated_at
+      FROM test_records
+      WHERE %(since)s::timestamp IS NULL OR updated_at > %(since)s::timestamp - %(overlap)s::interval
+    ), marked AS (
+      INSERT INTO rollup_dirty_dates (encounter_date)
+      SELECT DISTINCT encounter_date FROM changed
+      ON CONFLICT DO NOTHING
+    )
+    SELECT MAX(updated_at) FROM changed
+"""
+
+MARK_RANGE = """
+    INSERT INTO rollup_dirty_dates (encounter_date)
+    SELECT encounter_date FROM test_records
+    WHERE encounter_date BETWEEN %(first)s AND %(last)s
+    UNION
+    SELECT encounter_date FROM rollup_daily
+    WHERE encounter_date BETWEEN %(first)s AND %(last)s
+    ON CONFLICT DO NOTHING
+"""
+
+# Concurrent refreshes (fetch sink, timeout scan, scheduler) split the work
+CLAIM_DIRTY = """
+    SELECT encounter_date FROM rollup_dirty_dates
+    ORDER BY encounter_date
+    LIMIT %s
+    FOR UPDATE SKIP LOCKED
+"""
+
+ROLLUP_DAILY = """
+    INSERT INTO rollup_daily
+      (encounter_date, laboratory, shift, requests, revenue, delayed, on_time, not_uploaded,
+       tat_p50, tat_p90, tat_p95)
+    SELECT
+      encounter_date, COALESCE(laboratory, ''), COALESCE(shift, ''),
+      COUNT(*),
+      COALESCE(SUM(price_at_test), 0),
+      COUNT(*) FILTER (WHERE time_out IS NOT NULL AND actual_tat > tat_at_test),
+      COUNT(*) FILTER (WHERE time_out IS NOT NULL AND actual_tat <= tat_at_test),
+      COUNT(*) FILTER (WHERE time_out IS NULL),
+      percentile_cont(0.5) WITHIN GROUP (ORDER BY actual_tat) FILTER (WHERE time_out IS NOT NULL),
+      percentile_cont(0.9) WITHIN GROUP (ORDER BY actual_tat) FILTER (WHERE time_out IS NOT NULL),
+      percentile_cont(0.95) WITHIN GROUP (ORDER BY actual_tat) FILTER (WHERE time_out IS NOT NULL)
+    FROM test_records
+    WHERE encounter_date = ANY(%(dates)s::date[]) AND is_cancelled = false
+    GROUP BY 1, 2, 3
+"""
+
+ROLLUP_HOURLY = """
+    INSERT INTO rollup_hourly
+      (encounter_date, hour, laboratory, shift, requests, revenue, delayed, on_time)
+    SELECT
+      encounter_date, EXTRACT(HOUR FROM time_in)::smallint, COALESCE(laboratory, ''), COALESCE(shift, ''),
+      COUNT(*),
+      COALESCE(SUM(price_at_test), 0),
+      COUNT(*) FILTER (WHERE time_out IS NOT NULL AND actual_tat > tat_at_test),
+      COUNT(*) FILTER (WHERE time_out IS NOT NULL AND actual_tat <= tat_at_test)
+    FROM test_records
+    WHERE encounter_date = ANY(%(dates)s::date[]) AND is_cancelled = false AND time_in IS NOT NULL
+    GROUP BY 1, 2, 3, 4
+"""
+
+ROLLUP_TESTS = """
+    INSERT INTO rollup_tests
+      (encounter_date, test_name, lab_section, laboratory, shift, requests, revenue, delayed, on_time,
+       not_uploaded, tat_p50, tat_p90)
+    SELECT
+      encounter_date, test_name, COALESCE(lab_section_at_test, ''), COALESCE(laboratory, ''),
+      COALESCE(shift, ''),
+      COUNT(*),
+      COALESCE(SUM(price_at_test), 0),
+      COUNT(*) FILTER (WHERE time_out IS NOT NULL AND actual_tat > tat_at_test),
+      COUNT(*) FILTER (WHERE time_out IS NOT NULL AND actual_tat <= tat_at_test),
+      COUNT(*) FILTER (WHERE time_out IS NULL),
+      percentile_cont(0.5) WITHIN GROUP (ORDER BY actual_tat) FILTER (WHERE time_out IS NOT NULL),
+      percentile_cont(0.9) WITHIN GROUP (ORDER BY actual_tat) FILTER (WHERE time_out IS NOT NULL)
+    FROM test_records
+    WHERE encounter_date = ANY(%(dates)s::date[]) AND is_cancelled = false
+    GROUP BY 1, 2, 3, 4, 5
+"""
+
+ROLLUP_INSERTS = (ROLLUP_DAILY, ROLLUP_HOURLY, ROLLUP_TESTS)
+
+
+def mark_dates(cur, dates):
+    """Queue ``dates`` (dates or ISO strings) for recomputation, in the caller's transaction"""
+    dates = sorted({str(d) for d in dates})
+    if dates:
+        cur.execute(MARK_DATES, (dates,))
+
+
+def mark_changed(cur, overlap=CHANGE_OVERLAP):
+    """Queue the dates of rows updated since the last call; advances the watermark"""
+    cur.execute("INSERT INTO rollup_state (id) VALUES (true) ON CONFLICT DO NOTHING")
+    cur.execute("SELECT changes_seen_until FROM rollup_state FOR UPDATE")
+    since = cur.fetchone()[0]
+    cur.execute(MARK_CHANGED, {'since': since, 'overlap': overlap})
+    seen_until = cur.fetchone()[0]
+    cur.execute(
+        "UPDATE rollup_state SET changes_seen_until = GREATEST(changes_seen_until, %s), "
+        "refreshed_at = NOW()",
+        (seen_until,)
+    )
+
+
+def refresh_rollups(conn, dates=(), batch_days=BATCH_DAYS, overlap=CHANGE_OVERLAP):
+    """Recompute the rollups of ``dates``, of changed rows and of earlier dirty dates.
+
+    Returns the number of dates recomputed. Dates another refresh is
+    working on are left to it.
+    """
+    with conn, conn.cursor() as cur:
+        mark_dates(cur, dates)
+        mark_changed(cur, overlap)
+
+    refreshed = 0
+    while True:
+        with conn, conn.cursor() as cur:
+            cur.execute(CLAIM_DIRTY, (batch_days,))
+            claimed = [row[0] for row in cur.fetchall()]
+            if not claimed:
+                break
+            for table in ROLLUP_TABLES:
+                cur.execute(f"DELETE FROM {table} WHERE encounter_date = ANY(%s::date[])", (claimed,))
+            for statement in ROLLUP_INSERTS:
+                cur.execute(statement, {'dates': claimed})
+            cur.execute("DELETE FROM rollup_dirty_dates WHERE encounter_date = ANY(%s::date[])", (claimed,))
+        refreshed += len(claimed)
+    return refreshed
+
+
+def rebuild_rollups(conn, first_day=None, last_day=None, batch_days=BATCH_DAYS):
+    """Recompute every date between ``first_day`` and ``last_day`` (default: all)"""
+    with conn, conn.cursor() as cur:
+        cur.execute(MARK_RANGE, {'first': first_day or date.min, 'last': last_day or date.max})
+    return refresh_rollups(conn, batch_days=batch_days)
+
+
+def main():
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Refresh the dashboard rollup tables")
+    parser.add_argument('--rebuild', action='store_true',
+                        help="recompute every date (within --from/--to), not just changed ones")
+    parser.add_argument('--from', dest='first_day', type=date.fromisoformat, help="first day to rebuild")
+    parser.add_argument('--to', dest='last_day', type=date.fromisoformat, help="last day to rebuild")
+    args = parser.parse_args()
+
+    if psycopg2 is None:
+        raise SystemExit("psycopg2 is required for rollups (pip install psycopg2-binary)")
+    database_url = os.getenv('DATABASE_URL')
+    if not database_url:
+        raise SystemExit("DATABASE_URL is not set")
+    conn = psycopg2.connect(database_url)
+    try:
+        if args.rebuild:
+            refreshed = rebuild_rollups(conn, args.first_day, args.last_day)
+        else:
+            refreshed = refresh_rollups(conn)
+    finally:
+        conn.close()
+    print(f"✅ Rollups: {refreshed} dates recomputed")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,168 @@
+"""
+Columnar snapshots of the fetched records and the timeout files.
+
+Each dataset is a directory of Arrow IPC files, one per month
+(``<root>/<dataset>/month=YYYY-MM/data.arrow``, hive-style, so
+pyarrow.dataset, pandas, polars or DuckDB read it directly). Columns are
+typed - dates as date32, time-outs as timestamps - and the few distinct
+``Src`` / ``TestName`` values are dictionary-encoded. Files are written
+uncompressed so readers can memory-map them: loading a month maps the
+file instead of parsing text.
+
+Writers replace whole months, atomically, and only the months their
+latest delta touched; the other partitions are left alone. A month that
+cannot be replaced (on Windows, while a reader has it mapped) is kept in
+``pending.json`` and rewritten on the next update.
+
+Loading two months of records for analysis:
+    from snapshots import MonthlySnapshots, RECORDS_SCHEMA
+    table = MonthlySnapshots('snapshots/records', RECORDS_SCHEMA).read('2025-02', '2025-03')
+"""
+import json
+import os
+import shutil
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+except ImportError:  # optional: snapshots are skipped without it
+    pa = None
+
+if pa is not None:
+    RECORDS_SCHEMA = pa.schema([
+        ('EncounterDate', pa.date32()),
+        ('InvoiceNo', pa.string()),
+        ('LabNo', pa.string()),
+        ('Src', pa.dictionary(pa.int32(), pa.string())),
+        ('TestName', pa.dictionary(pa.int32(), pa.string())),
+    ])
+    TIMEOUTS_SCHEMA = pa.schema([
+        ('FileName', pa.string()),
+        ('CreationTime', pa.timestamp('s')),
+    ])
+else:
+    RECORDS_SCHEMA = TIMEOUTS_SCHEMA = None
+
+PARTITION_PREFIX = 'month='
+FILE_NAME = 'data.arrow'
+PENDING_FILE = 'pending.json'
+
+
+def pyarrow_available():
+    return pa is not None
+
+
+def month_of(value):
+    """'YYYY-MM' of an ISO date string, date or datetime"""
+    return value[:7] if isinstance(value, str) else f"{value.year:04d}-{value.month:02d}"
+
+
+class MonthlySnapshots:
+    """Month-partitioned Arrow IPC files of one dataset under ``root``"""
+
+    def __init__(self, root, schema):
+        if pa is None:
+            raise RuntimeError("pyarrow is required for snapshots (pip install pyarrow)")
+        self.root = str(root)
+        self.schema = schema
+
+    def path(self, month):
+        return os.path.join(self.root, f"{PARTITION_PREFIX}{month}", FILE_NAME)
+
+    def months(self):
+        """Months that have a partition, in order"""
+        try:
+            names = os.listdir(self.root)
+        except FileNotFoundError:
+            return []
+        return sorted(
+            name[len(PARTITION_PREFIX):] for name in names
+            if name.startswith(PARTITION_PREFIX) and os.path.exists(os.path.join(self.root, name, FILE_NAME))
+        )
+
+    def write(self, month, columns):
+        """Replace the partition of ``month`` with ``columns`` (field name -> list of values).
+
+        String values are cast to the schema's date/timestamp types.
+        Returns the number of rows written; an empty month is removed.
+        """
+        rows = len(next(iter(columns.values()), ()))
+        if not rows:
+            self.delete(month)
+            return 0
+        arrays = []
+        for field in self.schema:
+            values = columns[field.name]
+            if pa.types.is_temporal(field.type) and isinstance(values[0], str):
+                arrays.append(pc.cast(pa.array(values, pa.string()), field.type))
+            else:
+                arrays.append(pa.array(values, field.type))
+        table = pa.Table.from_arrays(arrays, schema=self.schema)
+
+        path = self.path(month)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with pa.OSFile(tmp_path, 'wb') as sink:
+            with pa.ipc.new_file(sink, self.schema) as writer:
+                writer.write_table(table)
+        os.replace(tmp_path, path)
+        return rows
+
+    def pending_months(self):
+        try:
+            with open(os.path.join(self.root, PENDING_FILE), 'r', encoding='utf-8') as f:
+                return set(json.load(f))
+        except (OSError, ValueError):
+            return set()
+
+    def _set_pending(self, months):
+        path = os.path.join(self.root, PENDING_FILE)
+        if months:
+            os.makedirs(self.root, exist_ok=True)
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(sorted(months), f)
+        elif os.path.exists(path):
+            os.remove(path)
+
+    def update(self, months, load):
+        """Rewrite ``months`` and any months left pending by an earlier update.
+
+        ``load`` gets the sorted months and yields (month, columns) pairs.
+        Returns (rows written, months that could not be replaced).
+        """
+        months = sorted(set(months) | self.pending_months())
+        rows, failed = 0, set()
+        if not months:
+            return rows, failed
+        for month, columns in load(months):
+            try:
+                rows += self.write(month, columns)
+            except OSError:
+                failed.add(month)
+        self._set_pending(failed)
+        return rows, failed
+
+    def delete(self, month):
+        shutil.rmtree(os.path.dirname(self.path(month)), ignore_errors=True)
+
+    def prune(self, keep):
+        """Remove partitions of months not in ``keep``"""
+        for month in set(self.months()) - set(keep):
+            self.delete(month)
+
+    def read_month(self, month, columns=None):
+        """One month as a Table backed by the memory-mapped file"""
+        with pa.memory_map(self.path(month), 'r') as source:
+            table = pa.ipc.open_file(source).read_all()
+        return table.select(columns) if columns else table
+
+    def read(self, first_month=None, last_month=None, columns=None):
+        """Months from ``first_month`` to ``last_month`` ('YYYY-MM', inclusive) as one Table"""
+        tables = [
+            self.read_month(month, columns) for month in self.months()
+            if (first_month is None or month >= first_month) and (last_month is None or month <= last_month)
+        ]
+        if not tables:
+            schema = pa.schema([self.schema.field(c) for c in columns]) if columns else self.schema
+            return schema.empty_table()
+        return pa.concat_tables(tables)
@@ -0,0 +1,163 @@
+"""
+Direct PostgreSQL sink for fetched records.
+
+Does in one transaction what `npm run ingest` does row by row: upsert
+encounters, make sure every test name has (default) metadata, and upsert
+test_records with the price/TAT/section in force on the encounter date.
+Records are COPYed into a temp table first, so each step is a single
+set-based statement regardless of batch size.
+"""
+import csv
+import io
+from datetime import datetime
+
+try:
+    import psycopg2
+except ImportError:  # only needed when the sink is enabled
+    psycopg2 = None
+
+
+# --- Ports of src/utils/dateUtils.ts ---
+def extract_time_from_lab_no(lab_no):
+    """LabNo format DDMMYYHHMM + sequence, e.g. 2708251322... -> 27/08/25 13:22"""
+    if len(lab_no) < 10:
+        return None
+    try:
+        return datetime.strptime(lab_no[:10], '%d%m%y%H%M')
+    except ValueError:
+        return None
+
+
+def determine_shift(time_in):
+    # Day shift: 8 AM - 5 PM, Night shift: 5 PM - 8 AM
+    return 'day shift' if 8 <= time_in.hour < 17 else 'night shift'
+
+
+def determine_laboratory(source):
+    annex_sources = ['ANNEX', 'DOCTORS PLAZA ANNEX']
+    return 'annex' if any(s in source.upper() for s in annex_sources) else 'mainLab'
+
+
+STAGING_DDL = """
+    CREATE TEMP TABLE lims_staging (
+        ord INTEGER NOT NULL,
+        encounter_date DATE NOT NULL,
+        invoice_no VARCHAR(50) NOT NULL,
+        lab_no VARCHAR(50) NOT NULL,
+        source VARCHAR(100),
+        test_name VARCHAR(255) NOT NULL,
+        time_in TIMESTAMP,
+        shift VARCHAR(20),
+        laboratory VARCHAR(50)
+    ) ON COMMIT DROP
+"""
+
+UPSERT_ENCOUNTERS = """
+    INSERT INTO encounters (lab_no, invoice_no, encounter_date, source, time_in, shift, laboratory)
+    SELECT DISTINCT ON (lab_no) lab_no, invoice_no, encounter_date, source, time_in, shift, laboratory
+    FROM lims_staging
+    WHERE time_in IS NOT NULL
+    ORDER BY lab_no, ord
+    ON CONFLICT (lab_no)
+    DO UPDATE SET
+      invoice_no = EXCLUDED.invoice_no,
+      encounter_date = EXCLUDED.encounter_date,
+      source = EXCLUDED.source,
+      time_in = EXCLUDED.time_in,
+      shift = EXCLUDED.shift,
+      laboratory = EXCLUDED.laboratory,
+      updated_at = CURRENT_TIMESTAMP
+"""
+
+ENSURE_METADATA = """
+    INSERT INTO test_metadata (test_name, current_price, current_tat, current_lab_section, is_default)
+    SELECT DISTINCT test_name, 0, 1440, 'PENDING', true
+    FROM lims_staging
+    ON CONFLICT (test_name) DO NOTHING
+"""
+
+UPSERT_TEST_RECORDS = """
+    INSERT INTO test_records
+      (encounter_id, test_name, test_metadata_id,
+       price_at_test, tat_at_test, lab_section_at_test,
+       encounter_date, invoice_no, lab_no, source, time_in, shift, laboratory)
+    SELECT DISTINCT ON (s.lab_no, s.test_name)
+      s.lab_no, s.test_name, m.id,
+      COALESCE(h.price, m.current_price),
+      COALESCE(h.tat, m.current_tat),
+      COALESCE(h.lab_section, m.current_lab_section),
+      s.encounter_date, s.invoice_no, s.lab_no, s.source, s.time_in, s.shift, s.laboratory
+    FROM lims_staging s
+    JOIN encounters e ON e.lab_no = s.lab_no
+    JOIN test_metadata m ON m.test_name = s.test_name
+    LEFT JOIN LATERAL (
+      SELECT price, tat, lab_section
+      FROM test_metadata_history
+      WHERE test_metadata_id = m.id
+        AND effective_from <= s.encounter_date
+        AND (effective_to IS NULL OR effective_to > s.encounter_date)
+      ORDER BY effective_from DESC
+      LIMIT 1
+    ) h ON true
+    WHERE s.time_in IS NOT NULL
+    ORDER BY s.lab_no, s.test_name, s.ord
+    ON CONFLICT (encounter_id, test_name)
+    DO UPDATE SET
+      price_at_test = EXCLUDED.price_at_test,
+      tat_at_test = EXCLUDED.tat_at_test,
+      lab_section_at_test = EXCLUDED.lab_section_at_test,
+      updated_at = CURRENT_TIMESTAMP
+"""
+
+
+class PostgresSink:
+    def __init__(self, database_url):
+        if psycopg2 is None:
+            raise RuntimeError("psycopg2 is required for the database sink (pip install psycopg2-binary)")
+        if not database_url:
+            raise RuntimeError("DATABASE_URL is not set")
+        self.database_url = database_url
+
+    def connect(self):
+        return psycopg2.connect(self.database_url)
+
+    def write(self, records):
+        """Upsert records in a single transaction.
+
+        Returns (encounters, test_records, skipped): rows upserted per table
+        and records skipped because their LabNo carries no valid time-in,
+        which ingest.ts skips as well.
+        """
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        skipped = 0
+        for ord_, r in enumerate(records):
+            time_in = extract_time_from_lab_no(r['LabNo'])
+            if time_in is None:
+                skipped += 1
+            writer.writerow((
+                ord_, r['EncounterDate'], r['InvoiceNo'], r['LabNo'], r['Src'], r['TestName'],
+                time_in.isoformat(sep=' ') if time_in else '',
+                determine_shift(time_in) if time_in else '',
+                determine_laboratory(r['Src']) if time_in else '',
+            ))
+        buf.seek(0)
+
+        conn = self.connect()
+        try:
+            with conn:
+                with conn.cursor() as cur:
+                    cur.execute(STAGING_DDL)
+                    cur.copy_expert(
+                        "COPY lims_staging (ord, encounter_date, invoice_no, lab_no, source, test_name, "
+                        "time_in, shift, laboratory) FROM STDIN WITH (FORMAT csv)",
+                        buf
+                    )
+                    cur.execute(UPSERT_ENCOUNTERS)
+                    encounters = cur.rowcount
+                    cur.execute(ENSURE_METADATA)
+                    cur.execute(UPSERT_TEST_RECORDS)
+                    test_records = cur.rowcount
+        finally:
+            conn.close()
+        return encounters, test_records, skipped
@@ -1,15 +1,36 @@
 import os
 import sys
+import argparse
+import signal
 import re
 import json
 import logging
+import subprocess
+import threading
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from dotenv import load_dotenv
 from pathlib import Path
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'common'))
+
+from db_sink import PostgresSink
+from fetch_metrics import Metrics, load_report, to_prometheus, write_report
+from fetch_state import DeadLetters, DetailCache, PageHashes, ReconcileState, RunCheckpoint
+from job_lock import JobLock
+from lims_parsers import extract_table_rows, resolve_backend
+from record_store import RecordStore
+from rollups import refresh_rollups
+from shard_queue import ShardLostError, ShardQueue, split_days
+from snapshots import RECORDS_SCHEMA, MonthlySnapshots, month_of, pyarrow_available
+
 
 # --- Base Paths ---
 def get_application_base_dir():
@@ -33,17 +54,100 @@ os.makedirs(LOGS_DIR, exist_ok=True)
 load_dotenv(os.path.join(APPLICATION_BASE_DIR, '.env'))
 LIMS_URL = os.getenv('LIMS_URL', 'http://192.168.10.84:8080')
 LOGIN_URL = f"{LIMS_URL}/index.php?m=login"
+LOGIN_PAGE_URL = f"{LIMS_URL}/index.php"
+AUTH_URL = f"{LIMS_URL}/auth.php"
 HOME_URL = f"{LIMS_URL}/home.php"
 SEARCH_URL = f"{LIMS_URL}/search.php"
 
 LIMS_USER = os.getenv('LIMS_USERNAME')
 LIMS_PASSWORD = os.getenv('LIMS_PASSWORD')
 
+# HTML parser backend: auto, lxml, stream or bs4
+HTML_PARSER = resolve_backend(os.getenv('LIMS_HTML_PARSER', 'auto'))
+
+# Records flow from search to save in batches of this size
+PIPELINE_BATCH_SIZE = max(1, int(os.getenv('LIMS_PIPELINE_BATCH_SIZE', '5000')))
+
+# Concurrency / politeness towards the LIMS host
+DETAIL_WORKERS = max(1, int(os.getenv('LIMS_DETAIL_WORKERS', '8')))
+SEARCH_WORKERS = max(1, int(os.getenv('LIMS_SEARCH_WORKERS', '4')))
+MAX_REQUESTS_PER_SECOND = float(os.getenv('LIMS_MAX_REQUESTS_PER_SECOND', '10'))
+
+# HTTP resilience: (connect, read) timeouts, retries with exponential backoff
+# on transient errors, and a circuit breaker that pauses fetching while the
+# LIMS keeps failing
+CONNECT_TIMEOUT = float(os.getenv('LIMS_CONNECT_TIMEOUT', '10'))
+SEARCH_TIMEOUT = (CONNECT_TIMEOUT, float(os.getenv('LIMS_SEARCH_READ_TIMEOUT', '120')))
+DETAIL_TIMEOUT = (CONNECT_TIMEOUT, float(os.getenv('LIMS_DETAIL_READ_TIMEOUT', '30')))
+LOGIN_TIMEOUT = (CONNECT_TIMEOUT, 30)
+HTTP_RETRIES = int(os.getenv('LIMS_HTTP_RETRIES', '3'))
+HTTP_BACKOFF_FACTOR = float(os.getenv('LIMS_HTTP_BACKOFF_FACTOR', '1.0'))
+BREAKER_FAILURE_THRESHOLD = max(1, int(os.getenv('LIMS_BREAKER_FAILURE_THRESHOLD', '5')))
+BREAKER_COOLDOWN_SECONDS = float(os.getenv('LIMS_BREAKER_COOLDOWN_SECONDS', '60'))
+BREAKER_MAX_TRIPS = max(1, int(os.getenv('LIMS_BREAKER_MAX_TRIPS', '3')))
+DEAD_LETTER_MAX_ATTEMPTS = max(1, int(os.getenv('LIMS_DEAD_LETTER_MAX_ATTEMPTS', '10')))
+
 # File Paths
 DATA_FILE = str(DATA_JSON_PATH)
 LAST_RUN_FILE = os.path.join(APPLICATION_BASE_DIR, '.last_run')
 COMPREHENSIVE_RUN_FILE = os.path.join(APPLICATION_BASE_DIR, '.last_comprehensive_run')
 LOCK_FILE = os.path.join(APPLICATION_BASE_DIR, '.lims_fetch.lock')
+STATE_DB_FILE = os.path.join(APPLICATION_BASE_DIR, '.lims_fetch_state.sqlite3')
+RECORDS_DB_FILE = os.path.join(APPLICATION_BASE_DIR, '.lims_records.sqlite3')
+
+# Month-partitioned Arrow snapshot of the record store for analytical loads (needs pyarrow)
+SNAPSHOT_ENABLED = os.getenv('LIMS_SNAPSHOT', 'true').lower() == 'true'
+SNAPSHOT_DIR = os.getenv('SNAPSHOT_DIR', os.path.join(APPLICATION_BASE_DIR, 'snapshots'))
+
+# Optional direct PostgreSQL sink (replaces `npm run ingest` in the cycle)
+DB_SINK_ENABLED = os.getenv('LIMS_DB_SINK', 'false').lower() == 'true'
+DB_SINK_BATCH_SIZE = max(1, int(os.getenv('LIMS_DB_SINK_BATCH_SIZE', '50000')))
+# data.json is exported from the record store for ingest.ts. A full rewrite
+# per run that adds records, so off by default when the sink replaces ingest
+EXPORT_DATA_JSON = os.getenv('LIMS_EXPORT_DATA_JSON', str(not DB_SINK_ENABLED)).lower() == 'true'
+DATABASE_URL = os.getenv('DATABASE_URL')
+# Recompute the dashboard rollups (migration 005) of the synced dates after each sink run
+ROLLUPS_ENABLED = os.getenv('LIMS_ROLLUPS', 'true').lower() == 'true'
+
+# Single-instance lock: 'file' (flock on LOCK_FILE) or 'postgres' (advisory lock, works across hosts).
+# A run started while another is in progress waits as its one queued follow-up, up to this long.
+JOB_LOCK_BACKEND = os.getenv('JOB_LOCK_BACKEND', 'file')
+LOCK_WAIT_SECONDS = float(os.getenv('LIMS_LOCK_WAIT_SECONDS', '3600'))
+
+# Sharded fetch: runs split into shards of this many days, queued in PostgreSQL (migration 004).
+# A running shard whose heartbeat is older than SHARD_STALE_SECONDS is handed to another worker.
+SHARD_DAYS = max(1, int(os.getenv('LIMS_SHARD_DAYS', '7')))
+SHARD_STALE_SECONDS = float(os.getenv('LIMS_SHARD_STALE_SECONDS', '600'))
+SHARD_MAX_ATTEMPTS = max(1, int(os.getenv('LIMS_SHARD_MAX_ATTEMPTS', '3')))
+
+# Daemon mode: keep a logged-in session and run passes on a timer, with a
+# local HTTP trigger for the Node scheduler
+DAEMON_HOST = os.getenv('LIMS_DAEMON_HOST', '127.0.0.1')
+DAEMON_PORT = int(os.getenv('LIMS_DAEMON_PORT', '8765'))
+DAEMON_INTERVAL_SECONDS = int(os.getenv('LIMS_DAEMON_INTERVAL_SECONDS', '300'))
+
+# Patient detail cache policy
+DETAIL_CACHE_TTL_DAYS = int(os.getenv('LIMS_DETAIL_CACHE_TTL_DAYS', '30'))
+DETAIL_CACHE_RECHECK_DAYS = int(os.getenv('LIMS_DETAIL_CACHE_RECHECK_DAYS', '3'))
+DETAIL_CACHE_MAX_AGE_DAYS = int(os.getenv('LIMS_DETAIL_CACHE_MAX_AGE_DAYS', '90'))
+
+# Tiered reconciliation: recent days on every run, the nightly window in full
+# every comprehensive pass, and older history in a rotating slice per night
+HISTORY_START = datetime.strptime(os.getenv('LIMS_HISTORY_START', '2025-04-01'), '%Y-%m-%d').date()
+RECONCILE_RECENT_DAYS = max(1, int(os.getenv('LIMS_RECONCILE_RECENT_DAYS', '7')))
+RECONCILE_NIGHTLY_DAYS = max(1, int(os.getenv('LIMS_RECONCILE_NIGHTLY_DAYS', '90')))
+RECONCILE_CYCLE_NIGHTS = max(1, int(os.getenv('LIMS_RECONCILE_CYCLE_NIGHTS', '30')))
+
+# Interrupted comprehensive passes resume from their last checkpoint unless it is older than this
+CHECKPOINT_MAX_AGE_HOURS = float(os.getenv('LIMS_CHECKPOINT_MAX_AGE_HOURS', '48'))
+
+# Run reports: JSON per pass mode in the logs dir, plus an optional Prometheus
+# text file (e.g. for node_exporter's textfile collector)
+METRICS_PROMETHEUS_FILE = os.getenv('LIMS_METRICS_PROMETHEUS_FILE')
+
+# Change detection: hash search/detail pages and skip the ones that did not change
+SKIP_UNCHANGED_PAGES = os.getenv('LIMS_SKIP_UNCHANGED_PAGES', 'true').lower() == 'true'
+CHANGED_DAYS_REPORT = LOGS_DIR / 'lims_changed_days.json'
 
 # --- Logging ---
 console_handler = logging.StreamHandler(sys.stdout)
@@ -61,6 +165,210 @@ logging.basicConfig(
 logger = logging.getLogger('fetch_lims_data')
 
 
+# --- Rate Limiting ---
+class RateLimiter:
+    """Spaces out requests to one host across all worker threads"""
+
+    def __init__(self, max_per_second):
+        self.interval = 1.0 / max_per_second if max_per_second > 0 else 0.0
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        delay = slot - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+
+lims_rate_limiter = RateLimiter(MAX_REQUESTS_PER_SECOND)
+fetch_metrics = Metrics()
+
+
+# --- Circuit Breaker ---
+class CircuitOpenError(requests.RequestException):
+    """The LIMS kept failing; no more requests are sent during this pass"""
+
+
+class CircuitBreaker:
+    """Pauses all workers while the LIMS is struggling.
+
+    After ``failure_threshold`` consecutive failures the circuit opens and
+    every request waits ``cooldown`` seconds. Then a single trial request
+    goes out: success closes the circuit, failure opens it again. Once it
+    has tripped ``max_trips`` times without a success in between, requests
+    fail fast with CircuitOpenError until ``reset()`` (called per pass).
+    """
+
+    def __init__(self, failure_threshold, cooldown, max_trips):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.max_trips = max_trips
+        self._cond = threading.Condition()
+        self.reset()
+
+    def reset(self):
+        with self._cond:
+            self.failures = 0
+            self.trips = 0
+            self.open_until = None
+            self.trial_owner = None
+            self._cond.notify_all()
+
+    def before_request(self):
+        with self._cond:
+            while True:
+                if self.trips >= self.max_trips:
+                    raise CircuitOpenError(f"LIMS circuit open after {self.trips} trips")
+                if self.open_until is None or self.trial_owner == threading.get_ident():
+                    return
+                now = time.monotonic()
+                if now < self.open_until:
+                    self._cond.wait(self.open_until - now)
+                elif self.trial_owner is None:
+                    self.trial_owner = threading.get_ident()
+                    return
+                else:
+                    self._cond.wait()
+
+    def record_success(self):
+        with self._cond:
+            if self.open_until is not None:
+                logger.info("LIMS is responding again; circuit closed.")
+            self.failures = 0
+            self.trips = 0
+            self.open_until = None
+            self.trial_owner = None
+            self._cond.notify_all()
+
+    def record_failure(self):
+        with self._cond:
+            if self.open_until is not None and self.trial_owner != threading.get_ident():
+                return  # already in flight when the circuit opened
+            self.failures += 1
+            if self.trial_owner is not None or self.failures >= self.failure_threshold:
+                self.trips += 1
+                self.failures = 0
+                self.trial_owner = None
+                self.open_until = time.monotonic() + self.cooldown
+                fetch_metrics.incr('breaker_trips')
+                logger.warning(f"LIMS failing; circuit open, pausing requests for {self.cooldown:.0f}s "
+                               f"(trip {self.trips} of {self.max_trips})")
+                self._cond.notify_all()
+
+    def release_trial(self):
+        """Give up the trial if this thread still holds it, i.e. it ended without a verdict"""
+        with self._cond:
+            if self.trial_owner == threading.get_ident():
+                self.trial_owner = None
+                self._cond.notify_all()
+
+
+lims_circuit_breaker = CircuitBreaker(BREAKER_FAILURE_THRESHOLD, BREAKER_COOLDOWN_SECONDS, BREAKER_MAX_TRIPS)
+
+
+def lims_get(session, url, **kwargs):
+    """GET against the LIMS host, honouring the shared rate limit and circuit breaker"""
+    lims_circuit_breaker.before_request()
+    try:
+        lims_rate_limiter.wait()
+        fetch_metrics.incr('http_requests')
+        try:
+            response = session.get(url, **kwargs)
+        except requests.RequestException:
+            fetch_metrics.incr('http_errors')
+            lims_circuit_breaker.record_failure()
+            raise
+        retries = getattr(response.raw, 'retries', None)
+        if retries is not None and retries.history:
+            fetch_metrics.incr('http_retries', len(retries.history))
+        fetch_metrics.incr('http_bytes', len(response.content))
+        if response.status_code == 304:
+            fetch_metrics.incr('http_not_modified')
+        if response.status_code >= 500 or response.status_code == 429:
+            fetch_metrics.incr('http_errors')
+            lims_circuit_breaker.record_failure()
+        else:
+            lims_circuit_breaker.record_success()
+        return response
+    finally:
+        # A trial that raised anything but a RequestException must not leave the other workers waiting
+        lims_circuit_breaker.release_trial()
+
+
+def is_login_page(response):
+    """True when the LIMS answered with its login form, i.e. the session has expired"""
+    if urlparse(response.url).path.endswith('/index.php'):
+        return True
+    return 'name="rdm"' in response.text or "name='rdm'" in response.text
+
+
+class LimsSession(requests.Session):
+    """Session that logs in again by itself when the LIMS reports it has expired.
+
+    Its connection pool can serve every search and detail worker at once,
+    and idempotent requests are retried with exponential backoff on
+    connection errors and transient HTTP statuses.
+    """
+
+    def __init__(self):
+        super().__init__()
+        retry = Retry(
+            total=HTTP_RETRIES,
+            backoff_factor=HTTP_BACKOFF_FACTOR,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset({'GET', 'HEAD'}),
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        # Searches and detail fetches overlap in the streaming pipeline
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=DETAIL_WORKERS + SEARCH_WORKERS,
+                              max_retries=retry)
+        self.mount('http://', adapter)
+        self.mount('https://', adapter)
+        self.logged_in = False
+        self.logins = 0
+        self._login_lock = threading.Lock()
+
+    def login(self):
+        with self._login_lock:
+            with fetch_metrics.time('login'):
+                self.logged_in = lims_login(self)
+            if self.logged_in:
+                self.logins += 1
+            return self.logged_in
+
+    def _relogin_after(self, logins_seen):
+        with self._login_lock:
+            # Another worker may already have logged in again
+            if self.logins != logins_seen:
+                return True
+            logger.warning("LIMS session expired; logging in again.")
+            fetch_metrics.incr('relogins')
+            with fetch_metrics.time('login'):
+                self.logged_in = lims_login(self)
+            if self.logged_in:
+                self.logins += 1
+            return self.logged_in
+
+    def request(self, method, url, *args, **kwargs):
+        logins_seen = self.logins
+        response = super().request(method, url, *args, **kwargs)
+        if (self.logged_in and not url.startswith((LOGIN_PAGE_URL, AUTH_URL))
+                and is_login_page(response) and self._relogin_after(logins_seen)):
+            response = super().request(method, url, *args, **kwargs)
+        return response
+
+
+def create_session():
+    return LimsSession()
+
+
 # --- Login ---
 def lims_login(session: requests.Session) -> bool:
     logger.info("Attempting LIMS login...")
@@ -69,7 +377,7 @@ def lims_login(session: requests.Session) -> bool:
         return False
     try:
         login_page_url = f"{LIMS_URL}/index.php?m="
-        r1 = session.get(login_page_url)
+        r1 = lims_get(session, login_page_url, timeout=LOGIN_TIMEOUT)
         logger.debug(f"GET {login_page_url} Status: {r1.status_code}")
 
         pattern = r'<input\s+name=["\']rdm["\']\s+type=["\']hidden["\']\s+value=["\']([^"\']+)["\']\s*/?>'
@@ -80,7 +388,7 @@ def lims_login(session: requests.Session) -> bool:
         rdm_token = match.group(1)
         logger.debug(f"Found rdm token: {rdm_token}")
 
-        login_post_url = f"{LIMS_URL}/auth.php"
+        login_post_url = AUTH_URL
         payload = {
             "username": LIMS_USER,
             "password": LIMS_PASSWORD,
@@ -92,7 +400,8 @@ def lims_login(session: requests.Session) -> bool:
             "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/138.0.0.0 Safari/537.36",
             "Content-Type": "application/x-www-form-urlencoded",
         }
-        r2 = session.post(login_post_url, data=payload, headers=headers, allow_redirects=True)
+        r2 = session.post(login_post_url, data=payload, headers=headers, allow_redirects=True,
+                          timeout=LOGIN_TIMEOUT)
 
         if r2.url.endswith("home.php"):
             logger.info("LIMS login successful.")
@@ -125,28 +434,20 @@ def get_start_date() -> datetime.date:
         except Exception as e:
             logger.warning(f"Failed reading {LAST_RUN_FILE}: {e}. Falling back to 1 day ago.")
 
-    if os.path.exists(DATA_FILE):
+    try:
+        store = open_record_store()
         try:
-            with open(DATA_FILE, 'r', encoding='utf-8') as f:
-                records = json.load(f)
-            if records:
-                latest_date = None
-                for record in records:
-                    try:
-                        record_date = datetime.fromisoformat(record['EncounterDate']).date()
-                        if latest_date is None or record_date > latest_date:
-                            latest_date = record_date
-                    except (KeyError, ValueError):
-                        continue
-                if latest_date:
-                    logger.info(f"Latest date in existing records: {latest_date}. Fetching from {latest_date}.")
-                    return latest_date
-        except Exception as e:
-            logger.warning(f"Failed reading {DATA_FILE}: {e}. Falling back to default start date.")
+            latest_date = store.latest_encounter_date()
+        finally:
+            store.close()
+        if latest_date:
+            logger.info(f"Latest date in existing records: {latest_date}. Fetching from {latest_date}.")
+            return latest_date
+    except Exception as e:
+        logger.warning(f"Failed reading record store: {e}. Falling back to default start date.")
 
-    default_start = datetime(2025, 4, 1).date()
-    logger.info(f"Using fallback start date: {default_start}")
-    return default_start
+    logger.info(f"Using fallback start date: {HISTORY_START}")
+    return HISTORY_START
 
 
 def should_run_comprehensive():
@@ -179,70 +480,41 @@ def save_last_run_timestamp(timestamp):
 
 
 # --- Lock ---
-def acquire_lock():
-    if os.path.exists(LOCK_FILE):
-        try:
-            lock_age = time.time() - os.path.getmtime(LOCK_FILE)
-            if lock_age > 7200:
-                logger.warning(f"Found stale lock file ({lock_age/60:.1f} minutes old). Removing it.")
-                os.remove(LOCK_FILE)
-            else:
-                logger.info("Another instance is already running. Exiting.")
-                return False
-        except Exception as e:
-            logger.warning(f"Error checking lock file: {e}")
-    try:
-        with open(LOCK_FILE, 'w') as f:
-            f.write(f"{os.getpid()}\n{datetime.now().isoformat()}")
-        logger.debug("Lock acquired successfully")
-        return True
-    except Exception as e:
-        logger.error(f"Failed to acquire lock: {e}")
-        return False
-
-
-def release_lock():
-    try:
-        if os.path.exists(LOCK_FILE):
-            os.remove(LOCK_FILE)
-            logger.debug("Lock released")
-    except Exception as e:
-        logger.error(f"Failed to release lock: {e}")
+def open_job_lock():
+    return JobLock(LOCK_FILE, JOB_LOCK_BACKEND, DATABASE_URL, logger=logger)
 
 
 # --- Parse Patient Table ---
 def parse_patient_table(html_content, search_method=""):
     patients = []
     try:
-        soup = BeautifulSoup(html_content, 'html.parser')
-        table = soup.find('table', id='list')
+        rows = extract_table_rows(html_content, HTML_PARSER, table_id='list')
 
-        if not table:
+        if rows is None:
             logger.warning(f"No patient table found using {search_method} search.")
             return patients
 
-        rows = table.find_all('tr')[1:]
+        rows = rows[1:]
         logger.info(f"Found {len(rows)} patients using {search_method} search.")
 
-        for row in rows:
-            cells = row.find_all('td')
+        for cells in rows:
             if len(cells) < 8:
                 logger.warning(f"Skipping malformed patient row with {len(cells)} cells.")
                 continue
 
             try:
                 # Parse encounter date (from DD-MM-YYYY to YYYY-MM-DD)
-                date_str = cells[0].text.strip()
+                date_str = cells[0]
                 encounter_date = datetime.strptime(date_str, '%d-%m-%Y').date().isoformat()
             except ValueError:
-                logger.warning(f"Skipping patient with bad date format: {cells[0].text.strip()}")
+                logger.warning(f"Skipping patient with bad date format: {cells[0]}")
                 continue
 
             patient = {
                 "EncounterDate": encounter_date,
-                "InvoiceNo": cells[3].text.strip(),
-                "LabNo": cells[1].text.strip(),
-                "Src": cells[7].text.strip(),
+                "InvoiceNo": cells[3],
+                "LabNo": cells[1],
+                "Src": cells[7],
             }
 
             if all(patient.values()):
@@ -255,7 +527,7 @@ def parse_patient_table(html_content, search_method=""):
 
 
 # --- Search Methods ---
-def search_by_date_range(session, start_date, end_date):
+def search_by_date_range(session, start_date, end_date, raise_errors=False):
     logger.info(f"Searching by date range: {start_date} to {end_date}")
     search_params = {
         'searchtype': 'daterange',
@@ -264,27 +536,68 @@ def search_by_date_range(session, start_date, end_date):
         'Get': 'Get'
     }
     try:
-        r = session.get(SEARCH_URL, params=search_params, timeout=300)
+        with fetch_metrics.time('search'):
+            r = lims_get(session, SEARCH_URL, params=search_params, timeout=SEARCH_TIMEOUT)
         r.raise_for_status()
-        return parse_patient_table(r.text, "daterange")
+        with fetch_metrics.time('parse'):
+            return parse_patient_table(r.text, "daterange")
     except Exception as e:
         logger.error(f"Date range search failed: {e}")
+        if raise_errors:
+            raise
         return []
 
 
-def search_by_specific_date(session, date):
+SEARCH_TABLE_START = re.compile(r'<table[^>]*\bid=["\']?list\b', re.IGNORECASE)
+DETAIL_TABLE_START = re.compile(r'<table[^>]*\btable-bordered\b', re.IGNORECASE)
+
+
+def table_fragment(html, table_start):
+    """The data table of a page (from the ``table_start`` match to its end), for hashing.
+
+    Hashing only the data table keeps volatile page chrome (clocks, session
+    widgets) from making every page look changed. Falls back to the whole page.
+    """
+    match = table_start.search(html)
+    if not match:
+        return html
+    start = match.start()
+    end = html.find('</table>', start)
+    return html[start:end] if end >= 0 else html[start:]
+
+
+def search_by_specific_date(session, date, page_hashes=None, skip_unchanged=False, raise_errors=False):
+    """Patients listed for one day.
+
+    With ``page_hashes`` the result page is hashed; when ``skip_unchanged``
+    is set and it matches the page seen on an earlier run, it is not parsed
+    and no patients are returned for the day. Failures are logged and give
+    an empty list unless ``raise_errors`` is set.
+    """
     logger.info(f"Searching by specific date: {date}")
     search_params = {
         'searchtype': 'date',
         'datepicker': date.strftime('%Y-%m-%d'),
         'Get': 'Get'
     }
+    key = f"search:date:{date.isoformat()}"
+    headers = page_hashes.conditional_headers(key) if page_hashes and skip_unchanged else {}
     try:
-        r = session.get(SEARCH_URL, params=search_params, timeout=300)
+        with fetch_metrics.time('search'):
+            r = lims_get(session, SEARCH_URL, params=search_params, headers=headers, timeout=SEARCH_TIMEOUT)
         r.raise_for_status()
-        return parse_patient_table(r.text, "date")
+        if page_hashes is not None:
+            unchanged = page_hashes.observe(key, r, table_fragment(r.text, SEARCH_TABLE_START))
+            if unchanged and skip_unchanged:
+                logger.info(f"Search page for {date} unchanged since last run; skipping")
+                fetch_metrics.incr('search_pages_unchanged')
+                return []
+        with fetch_metrics.time('parse'):
+            return parse_patient_table(r.text, "date")
     except Exception as e:
         logger.error(f"Specific date search failed for {date}: {e}")
+        if raise_errors:
+            raise
         return []
 
 
@@ -296,14 +609,53 @@ def search_by_period(session, period):
         'Get': 'Get'
     }
     try:
-        r = session.get(SEARCH_URL, params=search_params, timeout=300)
+        with fetch_metrics.time('search'):
+            r = lims_get(session, SEARCH_URL, params=search_params, timeout=SEARCH_TIMEOUT)
         r.raise_for_status()
-        return parse_patient_table(r.text, f"period_{period}")
+        with fetch_metrics.time('parse'):
+            return parse_patient_table(r.text, f"period_{period}")
     except Exception as e:
         logger.error(f"Period search failed for {period}: {e}")
         return []
 
 
+def bounded_map(executor, fn, items, max_in_flight):
+    """Like ``executor.map`` but lazy: at most ``max_in_flight`` calls run ahead of the consumer.
+
+    ``items`` is consumed on the caller's thread, results come back in order.
+    """
+    in_flight = deque()
+    for item in items:
+        in_flight.append(executor.submit(fn, item))
+        if len(in_flight) >= max_in_flight:
+            yield in_flight.popleft().result()
+    while in_flight:
+        yield in_flight.popleft().result()
+
+
+def search_days_concurrently(session, days, page_hashes=None, settled_before=None):
+    """Run per-day searches on a bounded pool.
+
+    Yields ``(day, patients)`` pairs in the order of ``days``, keeping only
+    a few days' results ahead of the consumer. A day whose search fails
+    yields ``None`` instead of aborting the others. Days before
+    ``settled_before`` whose page is unchanged are skipped.
+    """
+    if page_hashes is not None:
+        page_hashes.load([f"search:date:{day.isoformat()}" for day in days])
+
+    def search_day(day):
+        skip = settled_before is not None and day < settled_before
+        try:
+            return search_by_specific_date(session, day, page_hashes, skip, raise_errors=True)
+        except Exception:
+            logger.exception(f"Search for {day} failed; continuing with remaining days")
+            return None
+
+    with ThreadPoolExecutor(max_workers=SEARCH_WORKERS, thread_name_prefix='lims-search') as executor:
+        yield from zip(days, bounded_map(executor, search_day, days, SEARCH_WORKERS * 2))
+
+
 # --- Date Range Generator ---
 def date_range(start_date, end_date):
     for n in range(int((end_date - start_date).days) + 1):
@@ -311,38 +663,123 @@ def date_range(start_date, end_date):
 
 
 # --- Fetch Patient Details ---
-def fetch_patient_details(session, patient):
+def detail_page_key(patient):
+    return f"detail:{patient['InvoiceNo']}:{patient['LabNo']}"
+
+
+def fetch_patient_details(session, patient, page_hashes=None, cached=None, raise_errors=False):
+    """Tests on a patient's detail page.
+
+    With ``page_hashes`` the page is hashed; if it matches the stored hash
+    and ``cached`` tests are at hand, those are returned without parsing.
+    Failures are logged and give an empty list unless ``raise_errors`` is set.
+    """
     url = f"{LIMS_URL}/hoverrequest_b.php?iid={patient['InvoiceNo']}&encounterno={patient['LabNo']}"
     details = []
+    key = detail_page_key(patient)
+    headers = page_hashes.conditional_headers(key) if page_hashes and cached is not None else {}
     try:
-        r = session.get(url, timeout=30)
+        with fetch_metrics.time('detail_fetch'):
+            r = lims_get(session, url, headers=headers, timeout=DETAIL_TIMEOUT)
+        if r.status_code == 304 and cached is not None:
+            page_hashes.observe(key, r)
+            return cached
         if r.status_code != 200:
             logger.warning(f"Failed to fetch details for patient {patient['LabNo']}: HTTP {r.status_code}")
+            if raise_errors:
+                raise requests.HTTPError(f"HTTP {r.status_code}", response=r)
             return details
 
-        soup = BeautifulSoup(r.text, 'html.parser')
-        table = soup.find('table', class_='table-bordered')
-        if not table:
-            return details
+        if page_hashes is not None:
+            unchanged = page_hashes.observe(key, r, table_fragment(r.text, DETAIL_TABLE_START))
+            if unchanged and cached is not None:
+                fetch_metrics.incr('detail_pages_unchanged')
+                return cached
 
-        rows = table.find_all('tr')
-        if len(rows) <= 1:
+        with fetch_metrics.time('detail_parse'):
+            rows = extract_table_rows(r.text, HTML_PARSER, table_class='table-bordered')
+        if not rows or len(rows) <= 1:
             return details
 
-        for row in rows[1:]:
-            cells = row.find_all('td')
+        for cells in rows[1:]:
             if len(cells) < 3:
                 continue
-            test_name = cells[2].text.strip()
+            test_name = cells[2]
             if test_name:
                 details.append({"TestName": test_name})
 
     except Exception as e:
         logger.error(f"Error fetching details for {patient['LabNo']}: {e}")
+        if raise_errors:
+            raise
 
     return details
 
 
+def patient_dead_letter_key(patient):
+    return f"{patient['InvoiceNo']}:{patient['LabNo']}"
+
+
+def open_detail_cache():
+    return DetailCache(STATE_DB_FILE, DETAIL_CACHE_TTL_DAYS, DETAIL_CACHE_RECHECK_DAYS)
+
+
+def stream_patient_details(session, patients, detail_cache=None, page_hashes=None, dead_letters=None):
+    """Fetch test details for a stream of patients on a bounded worker pool.
+
+    Yields ``(patient, tests, from_lims)`` in the order of ``patients``;
+    ``tests`` is None when the page could not be fetched (the patient is
+    handed to ``dead_letters``). With a ``detail_cache`` only cache misses
+    go over the network, and with ``page_hashes`` as well, re-fetched pages
+    that did not change are answered from the cache instead of being
+    parsed again. Cache lookups run on the caller's thread.
+    """
+    def lookup():
+        for patient in patients:
+            tests = detail_cache.get(patient) if detail_cache is not None else None
+            if tests is not None:
+                if dead_letters is not None:
+                    dead_letters.resolve('patient', patient_dead_letter_key(patient))
+                yield patient, tests, None
+                continue
+            cached = None
+            if page_hashes is not None and detail_cache is not None:
+                page_hashes.load([detail_page_key(patient)])
+                if page_hashes.is_known(detail_page_key(patient)):
+                    cached = detail_cache.peek(patient)
+            yield patient, None, cached
+
+    def fetch_one(item):
+        patient, tests, cached = item
+        if tests is not None:
+            return patient, tests, False
+        try:
+            tests = fetch_patient_details(session, patient, page_hashes, cached,
+                                          raise_errors=dead_letters is not None)
+        except Exception as e:
+            if dead_letters is not None:
+                dead_letters.fail('patient', patient_dead_letter_key(patient), patient, str(e))
+            else:
+                logger.warning(f"Failed to fetch details for patient {patient['LabNo']}: {e}")
+            return patient, None, True
+        if dead_letters is not None:
+            dead_letters.resolve('patient', patient_dead_letter_key(patient))
+        return patient, tests, True
+
+    with ThreadPoolExecutor(max_workers=DETAIL_WORKERS, thread_name_prefix='lims-detail') as executor:
+        yield from bounded_map(executor, fetch_one, lookup(), DETAIL_WORKERS * 4)
+
+
+def compact_detail_cache(max_age_days=None):
+    max_age_days = DETAIL_CACHE_MAX_AGE_DAYS if max_age_days is None else max_age_days
+    cache = open_detail_cache()
+    try:
+        removed = cache.compact(max_age_days)
+        logger.info(f"Detail cache compacted: removed {removed} entries older than {max_age_days} days.")
+    finally:
+        cache.close()
+
+
 # --- Validate Record ---
 def validate_record_format(record):
     try:
@@ -356,141 +793,966 @@ def validate_record_format(record):
 
 
 # --- Save Data ---
-def save_data(new_records):
+def open_record_store():
+    """Open the record store, seeding it from a legacy data.json on first use"""
+    store = RecordStore(RECORDS_DB_FILE)
+    if store.is_empty() and os.path.exists(DATA_FILE):
+        try:
+            imported = store.import_json(DATA_FILE)
+            logger.info(f"Imported {imported} existing records from {DATA_FILE} into the record store.")
+        except (json.JSONDecodeError, FileNotFoundError):
+            logger.warning("Existing data.json is empty or corrupted. Starting fresh.")
+    return store
+
+
+def export_data_json(store=None):
+    own_store = store is None
+    store = store or open_record_store()
+    try:
+        total = store.export_json(DATA_FILE)
+        logger.info(f"Exported {total} records to {DATA_FILE}")
+    finally:
+        if own_store:
+            store.close()
+
+
+_snapshot_warned = False
+
+
+def export_snapshot(months=None, store=None):
+    """Rewrite the snapshot partitions of ``months`` (default: all of them) from the record store"""
+    global _snapshot_warned
+    if not SNAPSHOT_ENABLED:
+        return
+    if not pyarrow_available():
+        if not _snapshot_warned:
+            logger.warning("pyarrow is not installed; skipping the columnar snapshot (pip install pyarrow).")
+            _snapshot_warned = True
+        return
+    snapshot = MonthlySnapshots(os.path.join(SNAPSHOT_DIR, 'records'), RECORDS_SCHEMA)
+    own_store = store is None
+    store = store or open_record_store()
+    try:
+        if months is None or not snapshot.months():
+            months = store.months()
+            snapshot.prune(months)
+        if not months and not snapshot.pending_months():
+            return
+        with fetch_metrics.time('export_snapshot'):
+            rows, failed = snapshot.update(months, lambda ms: ((m, store.month_columns(m)) for m in ms))
+        logger.info(f"Snapshot: rewrote {rows} records of {len(months)} months in {snapshot.root}")
+        if failed:
+            logger.warning(f"Snapshot months in use, rewritten next time: {', '.join(sorted(failed))}")
+    finally:
+        if own_store:
+            store.close()
+
+
+def save_data(new_records, export=True):
+    """Append unseen records to the store; returns the records that were added.
+
+    With ``export`` data.json and the snapshot are refreshed when anything
+    was added; batch callers pass False and export once at the end.
+    """
     if not new_records:
         logger.info("No new records to save.")
-        return
+        return []
+
+    store = open_record_store()
+    try:
+        with fetch_metrics.time('save'):
+            added = store.append(new_records)
+        fetch_metrics.incr('records_added', len(added))
+        logger.info(f"Saved {len(added)} new records. Total: {store.count()}")
+        if export and EXPORT_DATA_JSON and (added or not os.path.exists(DATA_FILE)):
+            with fetch_metrics.time('export_json'):
+                export_data_json(store)
+        if export:
+            export_snapshot({month_of(r['EncounterDate']) for r in added}, store)
+    finally:
+        store.close()
+    return added
+
+
+# --- Database Sink ---
+def sync_to_database():
+    """Upsert records added to the store since the last successful sync into PostgreSQL"""
+    sink = PostgresSink(DATABASE_URL)
+    store = open_record_store()
+    try:
+        watermark = store.sync_watermark('postgres')
+        total = 0
+        touched = set()
+        while True:
+            last_rowid, batch = store.records_after(watermark, DB_SINK_BATCH_SIZE)
+            if not batch:
+                break
+            with fetch_metrics.time('db_sink'):
+                encounters, test_records, skipped = sink.write(batch)
+            store.set_sync_watermark('postgres', last_rowid)
+            watermark = last_rowid
+            total += len(batch)
+            touched.update(r['EncounterDate'] for r in batch)
+            logger.info(f"Database sink: {len(batch)} records -> {encounters} encounters, "
+                        f"{test_records} test records upserted ({skipped} skipped: no time-in in LabNo)")
+        if not total:
+            logger.info("Database sink: nothing new to send.")
+        if ROLLUPS_ENABLED:
+            update_rollups(sink, touched)
+    finally:
+        store.close()
+
 
-    existing_data = []
-    if os.path.exists(DATA_FILE):
+def sync_to_database_logged():
+    """sync_to_database() for fetch passes: a failure is logged, not raised.
+
+    The records are in the store and the sink resumes from its watermark,
+    so they are sent on the next run.
+    """
+    try:
+        sync_to_database()
+    except Exception:
+        logger.exception("Database sink failed; unsent records will be retried on the next run")
+
+
+def update_rollups(sink, dates):
+    """Recompute the dashboard rollups of ``dates`` and of anything else changed since the last refresh.
+
+    A failure is only logged: the synced rows carry a fresh updated_at, so
+    the next refresh picks their dates up anyway.
+    """
+    try:
+        conn = sink.connect()
         try:
-            with open(DATA_FILE, 'r') as f:
-                existing_data = json.load(f)
-            logger.info(f"Loaded {len(existing_data)} existing records.")
-        except (json.JSONDecodeError, FileNotFoundError):
-            logger.warning("Existing data.json is empty or corrupted. Starting fresh.")
+            with fetch_metrics.time('rollups'):
+                refreshed = refresh_rollups(conn, dates)
+        finally:
+            conn.close()
+        logger.info(f"Rollups: {refreshed} dates recomputed")
+    except Exception as e:
+        logger.warning(f"Rollup refresh failed, will be retried on the next sync: {e}")
+
 
-    # Deduplicate by LabNo + TestName
-    existing_keys = set()
-    for r in existing_data:
-        existing_keys.add((r.get('LabNo'), r.get('TestName')))
+# --- Reconciliation Planning ---
+def open_reconcile_state():
+    return ReconcileState(STATE_DB_FILE)
 
-    added = 0
-    for record in new_records:
-        key = (record.get('LabNo'), record.get('TestName'))
-        if key not in existing_keys:
-            existing_data.append(record)
-            existing_keys.add(key)
-            added += 1
 
-    with open(DATA_FILE, 'w', encoding='utf-8') as f:
-        json.dump(existing_data, f, indent=2, ensure_ascii=False)
+def plan_reconcile_days(today, gap_start, reconcile_state):
+    """Days to search in a comprehensive pass.
 
-    logger.info(f"Saved {added} new records. Total: {len(existing_data)}")
+    Every day of the nightly window (extended back to ``gap_start`` when
+    the store is further behind than that, e.g. on a first run), plus the
+    least recently checked slice of the history before the window, so all
+    of it is verified once every RECONCILE_CYCLE_NIGHTS nights.
+    """
+    window_start = min(today - timedelta(days=RECONCILE_NIGHTLY_DAYS - 1), gap_start)
+    window_start = max(window_start, HISTORY_START)
+    older = reconcile_state.rotation(HISTORY_START, window_start - timedelta(days=1), RECONCILE_CYCLE_NIGHTS)
+    if older:
+        logger.info(f"Reconciling {len(older)} older days ({older[0]} .. {older[-1]}) "
+                    f"in addition to {window_start} .. {today}")
+    return older + list(date_range(window_start, today))
 
 
 # --- Optimized Fetch ---
-def fetch_lims_data_optimized(session, start_date, is_comprehensive=False):
+def open_dead_letters():
+    return DeadLetters(STATE_DB_FILE, DEAD_LETTER_MAX_ATTEMPTS)
+
+
+def open_page_hashes(ignore_stored=False):
+    return PageHashes(STATE_DB_FILE, ignore_stored)
+
+
+def open_checkpoint():
+    return RunCheckpoint(STATE_DB_FILE, 'comprehensive', CHECKPOINT_MAX_AGE_HOURS)
+
+
+def write_change_report(page_hashes, is_comprehensive):
+    """Write which day pages changed this pass to the logs directory"""
+    prefix = 'search:date:'
+    changed, unchanged = page_hashes.changes(prefix)
+    detail_changed, detail_unchanged = page_hashes.changes('detail:')
+    report = {
+        'run_at': datetime.now().isoformat(timespec='seconds'),
+        'mode': 'comprehensive' if is_comprehensive else 'incremental',
+        'days_checked': len(changed) + len(unchanged),
+        'days_changed': [k[len(prefix):] for k in changed],
+        'days_unchanged': [k[len(prefix):] for k in unchanged],
+        'detail_pages_changed': len(detail_changed),
+        'detail_pages_unchanged': len(detail_unchanged),
+    }
+    with open(CHANGED_DAYS_REPORT, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    logger.info(f"Changed days: {len(changed)} of {report['days_checked']} checked "
+                f"(report: {CHANGED_DAYS_REPORT})")
+
+
+def iter_record_batches(session, start_date, is_comprehensive=False, detail_cache=None, page_hashes=None,
+                        days=None, reconcile_state=None, dead_letters=None, batch_size=None, checkpoint=None,
+                        period_backup=True):
+    """Search the LIMS and fetch details, yielding test records in batches.
+
+    Patients stream from the searches through the detail workers into
+    batches of ``batch_size`` records (default PIPELINE_BATCH_SIZE), so
+    memory is bounded by the batch size rather than by the date range and
+    the caller can save each batch before the next one is fetched.
+
+    A comprehensive pass searches each of ``days`` (default: every day from
+    ``start_date`` to today) and records the days it managed to check in
+    ``reconcile_state``; an incremental pass runs one date-range search.
+    ``period_backup`` adds the "Last 3 Days" search to a comprehensive pass.
+    Days and patients left in ``dead_letters`` by earlier passes are
+    retried, and this pass's failures are added to it.
+
+    With a ``checkpoint`` the days and patients whose records have been
+    handed out are marked as each batch comes back (i.e. once the caller
+    has saved it), with ``dead_letters`` written alongside; settled days
+    and patients already in a resumed checkpoint are not fetched again.
+    """
+    batch_size = batch_size or PIPELINE_BATCH_SIZE
     end_date = datetime.now().date()
-    all_patients = {}
 
     logger.info(f"Starting {'COMPREHENSIVE' if is_comprehensive else 'OPTIMIZED'} data fetch from {start_date} to {end_date}")
 
-    if is_comprehensive:
-        days_to_fetch = (end_date - start_date).days + 1
-        logger.info(f"=== COMPREHENSIVE MODE: Daily searches for all {days_to_fetch} days ===")
+    retry_days, retry_patients = [], []
+    if dead_letters is not None:
+        retry_days = [datetime.fromisoformat(key).date() for key, _ in dead_letters.pending('day')]
+        retry_patients = [patient for _, patient in dead_letters.pending('patient')]
+        if retry_days or retry_patients:
+            logger.info(f"Retrying {len(retry_days)} days and {len(retry_patients)} patients "
+                        f"that failed on earlier runs")
+
+    # Per-day pages are disjoint, so only the recent days that the period and
+    # today searches overlap can list a patient twice; only those LabNos are
+    # remembered. The record store's primary key catches anything else.
+    overlap_start = (end_date - timedelta(days=2)).isoformat()
+    seen = set()
+
+    # Days past the recheck window are settled: an unchanged page means nothing to do,
+    # and a checkpoint may skip them entirely
+    settled_before = end_date - timedelta(days=DETAIL_CACHE_RECHECK_DAYS)
+    settled_iso = settled_before.isoformat()
+
+    def is_new(patient):
+        if patient['EncounterDate'] < overlap_start:
+            return True
+        if patient['LabNo'] in seen:
+            return False
+        seen.add(patient['LabNo'])
+        return True
 
-        for single_date in date_range(start_date, end_date):
-            patients = search_by_specific_date(session, single_date)
-            logger.info(f"Date {single_date}: Found {len(patients)} patients (Total unique so far: {len(all_patients)})")
-            for patient in patients:
-                all_patients[patient['LabNo']] = patient
+    def is_resumed(patient):
+        return (checkpoint is not None and patient['EncounterDate'] < settled_iso
+                and patient_dead_letter_key(patient) in checkpoint.patients_done)
+
+    # (day, patients admitted up to and including that day): a day is complete
+    # once that many patients have come back from the detail workers
+    admitted = 0
+    day_marks = deque()
+
+    def collect_days(days, settled_before=None):
+        for single_date, patients in search_days_concurrently(session, days, page_hashes, settled_before):
+            if patients is None:
+                logger.warning(f"Date {single_date}: search failed; queued for retry next run")
+                fetch_metrics.incr('days_failed')
+                if dead_letters is not None:
+                    dead_letters.fail('day', single_date.isoformat(), error='search failed')
+                continue
+            if dead_letters is not None:
+                dead_letters.resolve('day', single_date.isoformat())
+            fetch_metrics.incr('days_searched')
+            if reconcile_state is not None:
+                reconcile_state.observe(single_date, len(patients))
+            logger.info(f"Date {single_date}: Found {len(patients)} patients")
+            yield from patients
+            day_marks.append((single_date, len(patients), admitted))
+
+    def search_patients():
+        if is_comprehensive:
+            search_days = list(days) if days is not None else list(date_range(start_date, end_date))
+            search_days = sorted(set(search_days).union(retry_days))
+            if checkpoint is not None and checkpoint.days_done:
+                resumed = [day for day in search_days if day < settled_before and day in checkpoint.days_done]
+                for day in resumed:
+                    if reconcile_state is not None:
+                        reconcile_state.observe(day, checkpoint.days_done[day])
+                fetch_metrics.incr('days_resumed', len(resumed))
+                search_days = [day for day in search_days if day not in set(resumed)]
+                logger.info(f"Resuming from checkpoint: {len(resumed)} days already saved")
+            logger.info(f"=== COMPREHENSIVE MODE: Daily searches for {len(search_days)} days ===")
+
+            yield from collect_days(search_days, settled_before=settled_before)
+
+            if period_backup:
+                logger.info("Adding period search as backup for recent data...")
+                yield from search_by_period(session, 'Last 3 Days')
 
-        logger.info("Adding period search as backup for recent data...")
-        for patient in search_by_period(session, 'Last 3 Days'):
-            all_patients[patient['LabNo']] = patient
+        else:
+            logger.info("=== OPTIMIZED MODE: Fast incremental update ===")
+            yield from collect_days([day for day in retry_days if day < start_date])
 
-    else:
-        logger.info("=== OPTIMIZED MODE: Fast incremental update ===")
-        for patient in search_by_date_range(session, start_date, end_date):
-            all_patients[patient['LabNo']] = patient
-
-        if end_date >= start_date:
-            for patient in search_by_specific_date(session, end_date):
-                all_patients[patient['LabNo']] = patient
-
-    logger.info(f"Total unique patients found: {len(all_patients)}")
-    logger.info("Fetching test details for all patients...")
-
-    final_records = []
-    for idx, (lab_no, patient_data) in enumerate(all_patients.items(), 1):
-        if idx % 20 == 0:
-            logger.info(f"Processing details for patient {idx} of {len(all_patients)}...")
-        for test in fetch_patient_details(session, patient_data):
-            final_records.append({
-                "EncounterDate": patient_data["EncounterDate"],
-                "InvoiceNo": patient_data["InvoiceNo"],
-                "LabNo": patient_data["LabNo"],
-                "Src": patient_data["Src"],
+            try:
+                patients = search_by_date_range(session, start_date, end_date, raise_errors=dead_letters is not None)
+            except Exception as e:
+                patients = []
+                for day in date_range(start_date, end_date):
+                    dead_letters.fail('day', day.isoformat(), error=str(e))
+            else:
+                if dead_letters is not None:
+                    for day in date_range(start_date, end_date):
+                        dead_letters.resolve('day', day.isoformat())
+            yield from patients
+
+            if end_date >= start_date:
+                yield from search_by_specific_date(session, end_date, page_hashes)
+
+        yield from retry_patients
+
+    def admit():
+        nonlocal admitted
+        for patient in search_patients():
+            if is_resumed(patient):
+                fetch_metrics.incr('patients_resumed')
+                continue
+            if is_new(patient):
+                admitted += 1
+                yield patient
+
+    def save_checkpoint():
+        if checkpoint is None:
+            return
+        if dead_letters is not None:
+            dead_letters.commit()
+        checkpoint.save()
+
+    started = time.monotonic()
+    total = from_lims = failed = records = 0
+    batch, fetched = [], []
+    for patient, tests, was_fetched in stream_patient_details(session, admit(), detail_cache, page_hashes,
+                                                              dead_letters):
+        total += 1
+        if checkpoint is not None:
+            while day_marks and day_marks[0][2] <= total:
+                day, day_patients, _ = day_marks.popleft()
+                checkpoint.day_done(day, day_patients)
+            # Failed patients are left to the dead-letter retry instead
+            if tests is not None and patient['EncounterDate'] < settled_iso:
+                checkpoint.patient_done(patient_dead_letter_key(patient))
+        if was_fetched:
+            from_lims += 1
+            fetched.append((patient, tests))
+            if from_lims % 20 == 0:
+                logger.info(f"Processing details for patient {from_lims}...")
+        if tests is None:
+            failed += 1
+            continue
+        for test in tests:
+            batch.append({
+                "EncounterDate": patient["EncounterDate"],
+                "InvoiceNo": patient["InvoiceNo"],
+                "LabNo": patient["LabNo"],
+                "Src": patient["Src"],
                 "TestName": test["TestName"]
             })
-
-    logger.info(f"Fetched {len(final_records)} test records.")
-    return final_records
+        if len(batch) >= batch_size:
+            if detail_cache is not None:
+                detail_cache.put_many(fetched)
+            records += len(batch)
+            yield batch
+            save_checkpoint()
+            batch, fetched = [], []
+
+    if detail_cache is not None:
+        detail_cache.put_many(fetched)
+    if checkpoint is not None:
+        for day, day_patients, _ in day_marks:
+            checkpoint.day_done(day, day_patients)
+    if batch:
+        records += len(batch)
+        yield batch
+    save_checkpoint()
+
+    logger.info(f"Total unique patients found: {total}")
+    if detail_cache is not None:
+        logger.info(f"Detail cache: {detail_cache.hits} hits, {detail_cache.misses} misses")
+    if page_hashes is not None:
+        changed, unchanged = page_hashes.changes('detail:')
+        logger.info(f"Detail pages: {len(unchanged)} unchanged, {len(changed)} new or changed")
+    if failed:
+        logger.warning(f"Details for {failed} patients could not be fetched; queued for retry next run")
+    fetch_metrics.incr('patients', total)
+    fetch_metrics.incr('patients_from_cache', total - from_lims)
+    fetch_metrics.incr('patients_failed', failed)
+    fetch_metrics.incr('records_fetched', records)
+
+    elapsed = time.monotonic() - started
+    rate = total / elapsed if elapsed > 0 else float(total)
+    logger.info(f"Fetched {records} test records for {total} patients in {elapsed:.1f}s "
+                f"({rate:.2f} patients/sec, {from_lims} from LIMS, {DETAIL_WORKERS} workers)")
+
+
+def fetch_lims_data_optimized(session, start_date, is_comprehensive=False, detail_cache=None, page_hashes=None,
+                              days=None, reconcile_state=None, dead_letters=None):
+    """All records of iter_record_batches() as one list, for callers that want them at once"""
+    return [record
+            for batch in iter_record_batches(session, start_date, is_comprehensive, detail_cache, page_hashes,
+                                             days, reconcile_state, dead_letters)
+            for record in batch]
+
+
+# --- Run Reports ---
+def metrics_report_path(mode):
+    return LOGS_DIR / f'lims_fetch_metrics_{mode}.json'
+
+
+def estimate_pass_seconds(mode, days):
+    """Expected duration of a pass over ``days`` days, from the last pass of the same mode"""
+    report = load_report(metrics_report_path(mode))
+    days_searched = report['counters'].get('days_searched') if report else None
+    if days_searched:
+        return report['wall_seconds'] / days_searched * days
+    return days * 6.0  # no measurement yet: the old rule of thumb of 0.1 min per day
+
+
+def write_pass_report(mode, ok):
+    """Write the metrics of the pass that just finished; returns the report"""
+    fetch_metrics.set_info(mode=mode, ok=ok)
+    report = fetch_metrics.report()
+    try:
+        write_report(report, metrics_report_path(mode), METRICS_PROMETHEUS_FILE)
+    except OSError as e:
+        logger.warning(f"Could not write run report: {e}")
+    stages = ', '.join(f"{name} p50={st['p50_seconds']}s p95={st['p95_seconds']}s ({st['count']})"
+                       for name, st in report['stages'].items())
+    logger.info(f"Pass metrics: {report['wall_seconds']}s wall; {stages}; "
+                f"{report['counters'].get('http_requests', 0)} requests, "
+                f"{report['counters'].get('http_bytes', 0)} bytes, "
+                f"{report['counters'].get('http_retries', 0)} retries")
+    return report
 
 
 # --- Main ---
+def run_pass(s):
+    """One fetch pass over a logged-in session: search, fetch details, save.
+
+    Metrics are collected into ``fetch_metrics`` (reset by the caller, so
+    the login can be included) and the pass report is returned.
+    """
+    current_run_timestamp = datetime.now()
+
+    need_comprehensive = should_run_comprehensive()
+    is_first_run = not os.path.exists(LAST_RUN_FILE) and not os.path.exists(DATA_FILE)
+    is_comprehensive = need_comprehensive or is_first_run
+
+    today = datetime.now().date()
+    reconcile_state = open_reconcile_state()
+    days = None
+    checkpoint = None
+
+    if is_comprehensive:
+        days = plan_reconcile_days(today, get_start_date(), reconcile_state)
+        checkpoint = open_checkpoint()
+        if checkpoint.resume():
+            # Keep the interrupted plan (its rotation slice has not been committed yet)
+            days = sorted(set(days).union(checkpoint.plan))
+            logger.warning(f"Resuming comprehensive pass started "
+                           f"{datetime.fromtimestamp(checkpoint.started_at):%Y-%m-%d %H:%M}: "
+                           f"{len(checkpoint.days_done)} days and {len(checkpoint.patients_done)} "
+                           f"patients already saved.")
+        checkpoint.begin(days)
+        start_date_for_fetch = days[0]
+        days_to_fetch = len(days)
+        estimated_minutes = estimate_pass_seconds('comprehensive', days_to_fetch) / 60
+        logger.warning(f"COMPREHENSIVE RUN: Fetching {days_to_fetch} days of data.")
+        logger.warning(f"Estimated time: {estimated_minutes:.1f} minutes. This is normal for daily comprehensive runs.")
+    else:
+        # The recent window is re-checked on every run, not just the days since the last one
+        start_date_for_fetch = min(get_start_date(), today - timedelta(days=RECONCILE_RECENT_DAYS - 1))
+
+    lims_circuit_breaker.reset()
+    detail_cache = open_detail_cache()
+    dead_letters = open_dead_letters()
+    # On a first run nothing has been saved yet, so stored hashes must not cause skips
+    page_hashes = open_page_hashes(ignore_stored=is_first_run) if SKIP_UNCHANGED_PAGES else None
+    ok = False
+
+    try:
+        # Each batch is saved as soon as it is complete, so a crash keeps what was flushed
+        fetched = added = 0
+        months = set()
+        for batch in iter_record_batches(s, start_date_for_fetch, is_comprehensive, detail_cache, page_hashes,
+                                         days, reconcile_state, dead_letters, checkpoint=checkpoint):
+            fetched += len(batch)
+            saved = save_data(batch, export=False)
+            added += len(saved)
+            months.update(month_of(r['EncounterDate']) for r in saved)
+
+        if not fetched:
+            logger.info("No new records found.")
+        if EXPORT_DATA_JSON and (added or not os.path.exists(DATA_FILE)):
+            with fetch_metrics.time('export_json'):
+                export_data_json()
+        export_snapshot(months)
+
+        if page_hashes is not None:
+            write_change_report(page_hashes, is_comprehensive)
+            page_hashes.commit()
+        reconcile_state.commit()
+        dead_letters.commit()
+        if dead_letters.total_failed or dead_letters.total_resolved:
+            logger.info(f"Dead letters: {dead_letters.total_failed} failed this run, "
+                        f"{dead_letters.total_resolved} recovered")
+
+        if is_comprehensive:
+            checkpoint.clear()
+            save_comprehensive_run_timestamp()
+            logger.info("Comprehensive run completed.")
+        elif is_first_run:
+            logger.info("First run completed successfully.")
+        # The watermark only moves once everything up to it has been saved
+        save_last_run_timestamp(current_run_timestamp)
+        ok = True
+
+        # After the fetch state is committed, so a database outage does not make
+        # the next runs refetch the same window
+        if DB_SINK_ENABLED:
+            sync_to_database_logged()
+
+    except Exception as e:
+        logger.exception("Unexpected error during data fetch")
+    finally:
+        detail_cache.close()
+        reconcile_state.close()
+        dead_letters.close()
+        if page_hashes is not None:
+            page_hashes.close()
+        if checkpoint is not None:
+            checkpoint.close()
+        report = write_pass_report('comprehensive' if is_comprehensive else 'incremental', ok)
+        logger.info("LIMS fetch complete.")
+    return report
+
+
 def run():
-    if not acquire_lock():
+    lock = open_job_lock()
+    # An overlapping trigger queues one follow-up run; any further ones exit
+    if not lock.acquire(coalesce=True, wait_seconds=LOCK_WAIT_SECONDS):
         return
 
     try:
         logger.info("Starting LIMS data fetch...")
+        fetch_metrics.reset()
 
-        s = requests.Session()
+        s = create_session()
 
-        if not lims_login(s):
+        if not s.login():
             logger.error("Failed to login to LIMS. Exiting.")
             return
 
-        current_run_timestamp = datetime.now()
+        run_pass(s)
 
-        need_comprehensive = should_run_comprehensive()
-        is_first_run = not os.path.exists(LAST_RUN_FILE) and not os.path.exists(DATA_FILE)
-        is_comprehensive = need_comprehensive or is_first_run
+    finally:
+        lock.release()
+
+
+# --- Sharded Fetch ---
+class ShardProgress:
+    """Takes the place of ReconcileState in a shard worker.
+
+    Collects the patient count of every day the shard searched (the merge
+    step records them as reconciled) and keeps the shard's heartbeat fresh
+    from a timer thread, on its own connection: a day's detail fetches and
+    breaker cooldowns can outlast LIMS_SHARD_STALE_SECONDS. ``lost`` is set
+    once a beat finds the shard claimed by another worker.
+    """
+
+    def __init__(self, shard, beat_seconds=None):
+        self.shard = shard
+        self.beat_seconds = beat_seconds or max(1.0, min(30.0, SHARD_STALE_SECONDS / 4))
+        self.day_patients = {}
+        self.lost = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._beat, name=f"shard-{shard.id}-heartbeat", daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def _beat(self):
+        queue = None
+        while not self._stop.wait(self.beat_seconds):
+            try:
+                if queue is None:
+                    queue = ShardQueue(DATABASE_URL)
+                if not queue.heartbeat(self.shard):
+                    self.lost.set()
+                    break
+            except Exception as e:
+                logger.warning(f"Shard {self.shard.id} heartbeat failed: {e}")
+                if queue is not None:
+                    queue.close()
+                    queue = None
+        if queue is not None:
+            queue.close()
+
+    def check(self):
+        if self.lost.is_set():
+            raise ShardLostError(f"shard {self.shard.id} was claimed by another worker")
+
+    def observe(self, day, patients):
+        self.day_patients[day] = patients
+
+
+def enqueue_shards(first_day=None, last_day=None):
+    """Queue a run's days as shards; returns the run id.
+
+    Without dates the run covers what a comprehensive pass would search
+    tonight, otherwise every day from ``first_day`` to ``last_day``.
+    """
+    today = datetime.now().date()
+    if first_day is not None:
+        days = list(date_range(first_day, last_day or today))
+    else:
+        reconcile_state = open_reconcile_state()
+        try:
+            days = plan_reconcile_days(today, get_start_date(), reconcile_state)
+        finally:
+            reconcile_state.close()
+    run_id = datetime.now().strftime('%Y%m%d-%H%M%S')
+    queue = ShardQueue(DATABASE_URL)
+    try:
+        shards = split_days(days, SHARD_DAYS)
+        queue.enqueue(run_id, shards)
+    finally:
+        queue.close()
+    logger.info(f"Queued run {run_id}: {len(days)} days ({days[0]} .. {days[-1]}) in {len(shards)} shards")
+    return run_id
+
+
+def run_shard_worker(run_id=None):
+    """Claim and fetch shards until the queue (of ``run_id``, or of any run) is empty.
+
+    Records are staged in PostgreSQL rather than saved locally, so workers
+    can run on any host; a shard with failed days or patients is put back
+    in the queue as a whole.
+    """
+    queue = ShardQueue(DATABASE_URL)
+    s = create_session()
+    if not s.login():
+        logger.error("Failed to login to LIMS. Exiting.")
+        queue.close()
+        return 0
+    detail_cache = open_detail_cache()
+    done = 0
+    try:
+        while True:
+            shard = queue.claim(run_id, SHARD_STALE_SECONDS)
+            if shard is None:
+                break
+            days = shard.days
+            logger.info(f"Shard {shard.id} of run {shard.run_id}: {len(days)} days ({days[0]} .. {days[-1]})")
+            fetch_metrics.reset()
+            lims_circuit_breaker.reset()
+            # In-memory dead letters: nothing to retry, failures only make the shard fail
+            failures = DeadLetters(':memory:')
+            staged = 0
+            try:
+                with ShardProgress(shard) as progress:
+                    for batch in iter_record_batches(s, days[0], True, detail_cache, None, days, progress, failures,
+                                                     period_backup=False):
+                        progress.check()
+                        queue.stage(shard, batch, staged)
+                        staged += len(batch)
+                    failed, _ = failures.counts()
+                    if failed:
+                        raise RuntimeError(f"{failed} days or patients could not be fetched")
+                    queue.complete(shard, staged, progress.day_patients)
+                done += 1
+                logger.info(f"Shard {shard.id} done: {staged} records")
+            except ShardLostError:
+                logger.warning(f"Shard {shard.id} went stale and was claimed by another worker; abandoning it")
+            except Exception as e:
+                logger.exception(f"Shard {shard.id} failed")
+                if not queue.fail(shard, e, SHARD_MAX_ATTEMPTS):
+                    logger.warning(f"Shard {shard.id} was claimed by another worker; left to it")
+            finally:
+                failures.close()
+    finally:
+        detail_cache.close()
+        queue.close()
+    logger.info(f"Shard worker finished: {done} shards fetched")
+    return done
 
-        if is_comprehensive:
-            start_date_for_fetch = get_start_date()
-            days_to_fetch = (datetime.now().date() - start_date_for_fetch).days
-            estimated_minutes = days_to_fetch * 0.1
-            logger.warning(f"COMPREHENSIVE RUN: Fetching {days_to_fetch} days of data.")
-            logger.warning(f"Estimated time: {estimated_minutes:.1f} minutes. This is normal for daily comprehensive runs.")
 
-        start_date_for_fetch = get_start_date()
+def merge_shards(run_id=None):
+    """Save the records of a run's done shards, in shard order; returns True if the whole run is merged"""
+    queue = ShardQueue(DATABASE_URL)
+    reconcile_state = open_reconcile_state()
+    try:
+        run_id = run_id or queue.latest_run()
+        if run_id is None:
+            logger.info("No sharded runs queued.")
+            return False
+        added = 0
+        months = set()
+        for shard_id, shard_no, day_patients in queue.done_shards(run_id):
+            for batch in queue.iter_records(shard_id, PIPELINE_BATCH_SIZE):
+                saved = save_data(batch, export=False)
+                added += len(saved)
+                months.update(month_of(r['EncounterDate']) for r in saved)
+            for day, patients in day_patients.items():
+                reconcile_state.observe(day, patients)
+            queue.mark_merged(shard_id)
+        reconcile_state.commit()
+
+        if EXPORT_DATA_JSON and (added or not os.path.exists(DATA_FILE)):
+            with fetch_metrics.time('export_json'):
+                export_data_json()
+        export_snapshot(months)
+        if DB_SINK_ENABLED:
+            sync_to_database_logged()
+
+        counts = queue.counts(run_id)
+        unmerged = {status: n for status, n in counts.items() if status != 'merged'}
+        logger.info(f"Run {run_id}: merged, {added} new records; shards by status: {counts}")
+        if unmerged:
+            logger.warning(f"Run {run_id} is not complete: {unmerged}")
+        return not unmerged
+    finally:
+        reconcile_state.close()
+        queue.close()
 
-        try:
-            new_records = fetch_lims_data_optimized(s, start_date_for_fetch, is_comprehensive)
 
-            if new_records:
-                save_data(new_records)
+def run_sharded(workers, first_day=None, last_day=None):
+    """Queue a run, fetch it with ``workers`` local worker processes and merge it"""
+    lock = open_job_lock()
+    if not lock.acquire(coalesce=True, wait_seconds=LOCK_WAIT_SECONDS):
+        return
+    try:
+        current_run_timestamp = datetime.now()
+        run_id = enqueue_shards(first_day, last_day)
+        if getattr(sys, 'frozen', False):
+            command = [sys.executable]
+        else:
+            command = [sys.executable, os.path.abspath(__file__)]
+        command += ['--shard-worker', '--run-id', run_id]
+        logger.info(f"Starting {workers} shard workers for run {run_id}")
+        procs = [subprocess.Popen(command) for _ in range(workers)]
+        for proc in procs:
+            proc.wait()
+        complete = merge_shards(run_id)
+        if complete and first_day is None:
+            save_comprehensive_run_timestamp()
+            save_last_run_timestamp(current_run_timestamp)
+    finally:
+        lock.release()
+
+
+# --- Daemon ---
+class FetchDaemon:
+    """Runs fetch passes on a timer or on request, over one warm session.
+
+    Refresh requests that arrive while a pass is running are coalesced
+    into a single follow-up pass.
+    """
+
+    def __init__(self, session, interval, lock=None):
+        self.session = session
+        self.interval = interval
+        self.lock = lock
+        self.passes_started = 0
+        self.passes_completed = 0
+        self.last_pass_started = None
+        self.last_pass_seconds = None
+        self.last_report = None
+        self.stopping = False
+        self._wake = threading.Event()
+        self._state = threading.Condition()
+
+    def request_refresh(self, wait=False, timeout=None):
+        """Ask for a pass; with ``wait`` block until a pass started after this call finishes"""
+        with self._state:
+            target = self.passes_started + 1
+            self._wake.set()
+            if wait:
+                self._state.wait_for(lambda: self.passes_completed >= target or self.stopping, timeout)
+            return self.passes_completed >= target
+
+    def status(self):
+        with self._state:
+            return {
+                'passes_started': self.passes_started,
+                'passes_completed': self.passes_completed,
+                'running': self.passes_started > self.passes_completed,
+                'last_pass_started': self.last_pass_started.isoformat() if self.last_pass_started else None,
+                'last_pass_seconds': self.last_pass_seconds,
+                'interval_seconds': self.interval,
+            }
+
+    def stop(self):
+        with self._state:
+            self.stopping = True
+            self._wake.set()
+            self._state.notify_all()
+
+    def serve_forever(self):
+        self._wake.set()  # first pass straight away
+        while True:
+            self._wake.wait(self.interval)
+            with self._state:
+                if self.stopping:
+                    return
+                if self.lock is not None and self.lock.lost.is_set():
+                    logger.error("Job lock lost; stopping so that two fetchers never run at once.")
+                    self.stopping = True
+                    self._state.notify_all()
+                    return
+                self._wake.clear()
+                self.passes_started += 1
+                self.last_pass_started = datetime.now()
+            started = time.monotonic()
+            fetch_metrics.reset()
+            try:
+                self.last_report = run_pass(self.session)
+            except Exception:
+                logger.exception("Daemon pass failed")
+            with self._state:
+                self.passes_completed += 1
+                self.last_pass_seconds = round(time.monotonic() - started, 1)
+                self._state.notify_all()
+
+
+def make_trigger_handler(daemon):
+    class TriggerHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            logger.debug("trigger: " + format % args)
+
+        def _send_json(self, status, payload):
+            body = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            path = urlparse(self.path).path
+            if path == '/health':
+                self._send_json(200, daemon.status())
+            elif path == '/metrics':
+                report = daemon.last_report
+                body = (to_prometheus(report) if report else '').encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
             else:
-                logger.info("No new records found.")
+                self._send_json(404, {'error': 'not found'})
 
-            if is_comprehensive:
-                save_comprehensive_run_timestamp()
-                logger.info("Comprehensive run completed.")
-            elif is_first_run:
-                logger.info("First run completed successfully.")
+        def do_POST(self):
+            url = urlparse(self.path)
+            if url.path != '/refresh':
+                self._send_json(404, {'error': 'not found'})
+                return
+            wait = parse_qs(url.query).get('wait', ['0'])[0] == '1'
+            completed = daemon.request_refresh(wait=wait, timeout=3600)
+            self._send_json(200, {'queued': not wait, 'completed': completed, **daemon.status()})
 
-        except Exception as e:
-            logger.exception("Unexpected error during data fetch")
-        finally:
-            save_last_run_timestamp(current_run_timestamp)
-            logger.info("LIMS fetch complete.")
+    return TriggerHandler
 
+
+def run_daemon():
+    lock = open_job_lock()
+    if not lock.acquire():
+        return
+
+    server = None
+    try:
+        logger.info("Starting LIMS fetch daemon...")
+        s = create_session()
+        if not s.login():
+            logger.error("Failed to login to LIMS. Exiting.")
+            return
+
+        daemon = FetchDaemon(s, DAEMON_INTERVAL_SECONDS, lock)
+        server = ThreadingHTTPServer((DAEMON_HOST, DAEMON_PORT), make_trigger_handler(daemon))
+        threading.Thread(target=server.serve_forever, name='trigger-server', daemon=True).start()
+        logger.info(f"Trigger endpoint on http://{DAEMON_HOST}:{DAEMON_PORT} "
+                    f"(POST /refresh[?wait=1], GET /health, GET /metrics); passes every {DAEMON_INTERVAL_SECONDS}s")
+
+        def shutdown(signum, frame):
+            logger.info(f"Received signal {signum}; stopping after the current pass.")
+            daemon.stop()
+        signal.signal(signal.SIGTERM, shutdown)
+        signal.signal(signal.SIGINT, shutdown)
+
+        daemon.serve_forever()
     finally:
-        release_lock()
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+        lock.release()
+        logger.info("LIMS fetch daemon stopped.")
 
 
 if __name__ == '__main__':
-    run()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Fetch patient test records from the LIMS into data.json")
+    parser.add_argument('--compact-cache', action='store_true',
+                        help="evict stale patient detail cache entries and exit")
+    parser.add_argument('--max-age-days', type=int, default=None,
+                        help=f"with --compact-cache: evict entries older than this (default {DETAIL_CACHE_MAX_AGE_DAYS})")
+    parser.add_argument('--export-json', action='store_true',
+                        help="write data.json from the record store and exit")
+    parser.add_argument('--export-snapshot', action='store_true',
+                        help="rewrite every month of the columnar snapshot from the record store and exit")
+    parser.add_argument('--sync-db', action='store_true',
+                        help="push records not yet in PostgreSQL through the database sink and exit")
+    parser.add_argument('--daemon', action='store_true',
+                        help="stay running with a logged-in session and serve refresh triggers")
+    parser.add_argument('--enqueue-shards', action='store_true',
+                        help="queue tonight's comprehensive pass (or --from/--to) as shards in PostgreSQL and exit")
+    parser.add_argument('--shard-worker', action='store_true',
+                        help="fetch queued shards until none are left (any number of workers, on any host)")
+    parser.add_argument('--merge-shards', action='store_true',
+                        help="save the records of finished shards into the record store and exit")
+    parser.add_argument('--workers', type=int, default=0,
+                        help="queue, fetch with this many local shard workers, and merge; "
+                             "LIMS_MAX_REQUESTS_PER_SECOND applies per worker")
+    parser.add_argument('--run-id', help="sharded run to work on (default: any run / the latest run)")
+    parser.add_argument('--from', dest='first_day', type=lambda v: datetime.strptime(v, '%Y-%m-%d').date(),
+                        help="with --enqueue-shards/--workers: first day to fetch (YYYY-MM-DD)")
+    parser.add_argument('--to', dest='last_day', type=lambda v: datetime.strptime(v, '%Y-%m-%d').date(),
+                        help="with --from: last day to fetch (default today)")
+    args = parser.parse_args()
+
+    if args.compact_cache:
+        compact_detail_cache(args.max_age_days)
+    elif args.export_json:
+        export_data_json()
+    elif args.export_snapshot:
+        export_snapshot()
+    elif args.sync_db:
+        sync_to_database()
+    elif args.daemon:
+        run_daemon()
+    elif args.enqueue_shards:
+        enqueue_shards(args.first_day, args.last_day)
+    elif args.shard_worker:
+        run_shard_worker(args.run_id)
+    elif args.merge_shards:
+        lock = open_job_lock()
+        if lock.acquire(coalesce=True, wait_seconds=LOCK_WAIT_SECONDS):
+            try:
+                merge_shards(args.run_id)
+            finally:
+                lock.release()
+    elif args.workers:
+        run_sharded(args.workers, args.first_day, args.last_day)
+    else:
+        run()
\ No newline at end of file
@@ -0,0 +1,126 @@
+"""
+Per-pass instrumentation for fetch_lims_data.py.
+
+Stages (login, search, parse, detail fetch, save, ...) record one latency
+sample per call; counters track requests, bytes, retries and the like.
+A pass ends with a JSON run report and, optionally, the same numbers in
+Prometheus text exposition format.
+"""
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+def percentile(sorted_samples, q):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_samples:
+        return 0.0
+    rank = max(1, math.ceil(q * len(sorted_samples)))
+    return sorted_samples[rank - 1]
+
+
+class Metrics:
+    """Thread-safe stage timings and counters for one fetch pass"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started_at = time.time()
+            self._started = time.monotonic()
+            self._samples = {}
+            self._counters = {}
+            self._info = {}
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            self._samples.setdefault(stage, []).append(seconds)
+
+    @contextmanager
+    def time(self, stage):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - started)
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def set_info(self, **info):
+        """Attach descriptive values (mode, day count, ...) to the report"""
+        with self._lock:
+            self._info.update(info)
+
+    def report(self):
+        with self._lock:
+            samples = {stage: sorted(values) for stage, values in self._samples.items()}
+            counters = dict(self._counters)
+            info = dict(self._info)
+            wall = time.monotonic() - self._started
+        stages = {}
+        for stage, values in samples.items():
+            total = sum(values)
+            stages[stage] = {
+                'count': len(values),
+                'total_seconds': round(total, 4),
+                'mean_seconds': round(total / len(values), 4),
+                **{f'p{int(q * 100)}_seconds': round(percentile(values, q), 4) for q in QUANTILES},
+                'max_seconds': round(values[-1], 4),
+            }
+        return {
+            'started_at': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started_at)),
+            'wall_seconds': round(wall, 3),
+            **info,
+            'stages': stages,
+            'counters': counters,
+        }
+
+
+def to_prometheus(report, prefix='lims_fetch'):
+    """Render a run report in Prometheus text exposition format"""
+    lines = [
+        f'# HELP {prefix}_stage_seconds Latency of each pipeline stage during the last pass',
+        f'# TYPE {prefix}_stage_seconds summary',
+    ]
+    for stage, stats in sorted(report['stages'].items()):
+        for q in QUANTILES:
+            lines.append(f'{prefix}_stage_seconds{{stage="{stage}",quantile="{q}"}} '
+                         f'{stats[f"p{int(q * 100)}_seconds"]}')
+        lines.append(f'{prefix}_stage_seconds_sum{{stage="{stage}"}} {stats["total_seconds"]}')
+        lines.append(f'{prefix}_stage_seconds_count{{stage="{stage}"}} {stats["count"]}')
+    for name, value in sorted(report['counters'].items()):
+        lines.append(f'# TYPE {prefix}_{name} gauge')
+        lines.append(f'{prefix}_{name} {value}')
+    lines.append(f'# TYPE {prefix}_wall_seconds gauge')
+    lines.append(f'{prefix}_wall_seconds {report["wall_seconds"]}')
+    return '\n'.join(lines) + '\n'
+
+
+def write_atomic(path, text):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def write_report(report, json_path, prometheus_path=None):
+    write_atomic(json_path, json.dumps(report, indent=2) + '\n')
+    if prometheus_path:
+        write_atomic(prometheus_path, to_prometheus(report))
+
+
+def load_report(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
@@ -0,0 +1,480 @@
+"""
+Persistent state for fetch_lims_data.py, kept in a small SQLite file next to
+the other run markers (.last_run, .last_comprehensive_run).
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from datetime import date, timedelta
+
+
+def connect_state_db(path):
+    conn = sqlite3.connect(path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+# --- Patient Detail Cache ---
+class DetailCache:
+    """Test lists per (InvoiceNo, LabNo) so unchanged encounters are not re-fetched.
+
+    Freshness policy:
+      * encounters from the last ``recheck_days`` days are always re-fetched,
+        because tests are still being added to them;
+      * older encounters are served from the cache until the entry is
+        ``ttl_days`` old, after which they are fetched once more.
+    Empty detail lists are never cached since they are indistinguishable
+    from a failed fetch.
+    """
+
+    def __init__(self, path, ttl_days=30, recheck_days=3):
+        self.conn = connect_state_db(path)
+        self.ttl_seconds = ttl_days * 86400
+        self.recheck_days = recheck_days
+        self.hits = 0
+        self.misses = 0
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS detail_cache (
+                invoice_no TEXT NOT NULL,
+                lab_no TEXT NOT NULL,
+                encounter_date TEXT NOT NULL,
+                tests TEXT NOT NULL,
+                fetched_at REAL NOT NULL,
+                PRIMARY KEY (invoice_no, lab_no)
+            )
+        """)
+        self.conn.commit()
+
+    def _needs_recheck(self, patient, today):
+        try:
+            encounter_date = date.fromisoformat(patient['EncounterDate'])
+        except (KeyError, ValueError):
+            return True
+        return encounter_date >= today - timedelta(days=self.recheck_days)
+
+    def get(self, patient, today=None):
+        """Cached ``[{"TestName": ...}]`` for the patient, or None on a miss"""
+        today = today or date.today()
+        if self._needs_recheck(patient, today):
+            self.misses += 1
+            return None
+        row = self.conn.execute(
+            "SELECT tests, fetched_at FROM detail_cache WHERE invoice_no = ? AND lab_no = ?",
+            (patient['InvoiceNo'], patient['LabNo'])
+        ).fetchone()
+        if row is None or time.time() - row[1] > self.ttl_seconds:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return [{"TestName": name} for name in json.loads(row[0])]
+
+    def peek(self, patient):
+        """Cached tests regardless of freshness (no hit/miss accounting), or None"""
+        row = self.conn.execute(
+            "SELECT tests FROM detail_cache WHERE invoice_no = ? AND lab_no = ?",
+            (patient['InvoiceNo'], patient['LabNo'])
+        ).fetchone()
+        return [{"TestName": name} for name in json.loads(row[0])] if row else None
+
+    def put_many(self, fetched):
+        """Store ``(patient, tests)`` pairs from a fetch round"""
+        now = time.time()
+        rows = [
+            (p['InvoiceNo'], p['LabNo'], p['EncounterDate'],
+             json.dumps([t['TestName'] for t in tests]), now)
+            for p, tests in fetched if tests
+        ]
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO detail_cache "
+                "(invoice_no, lab_no, encounter_date, tests, fetched_at) VALUES (?, ?, ?, ?, ?)",
+                rows
+            )
+
+    def compact(self, max_age_days):
+        """Evict entries not refreshed within ``max_age_days`` and reclaim space"""
+        cutoff = time.time() - max_age_days * 86400
+        with self.conn:
+            removed = self.conn.execute(
+                "DELETE FROM detail_cache WHERE fetched_at < ?", (cutoff,)
+            ).rowcount
+        self.conn.execute("VACUUM")
+        return removed
+
+    def close(self):
+        self.conn.close()
+
+
+# --- Page Content Hashes ---
+class PageHashes:
+    """Content hash (plus ETag/Last-Modified when the LIMS sends them) per page.
+
+    Keys are ``search:date:<YYYY-MM-DD>`` for per-day search pages and
+    ``detail:<InvoiceNo>:<LabNo>`` for patient detail pages. ``load()`` and
+    ``commit()`` run on the main thread; ``observe()`` is safe to call from
+    worker threads. What a pass observes is only written by ``commit()``,
+    after its records have been saved, so a failed pass never leaves a page
+    marked as already handled. With ``ignore_stored`` every page counts as
+    new, but what is seen is still recorded for the next pass.
+    """
+
+    def __init__(self, path, ignore_stored=False):
+        self.conn = connect_state_db(path)
+        self.ignore_stored = ignore_stored
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS page_hashes (
+                page_key TEXT PRIMARY KEY,
+                content_hash TEXT NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                checked_at REAL NOT NULL,
+                changed_at REAL NOT NULL
+            )
+        """)
+        self.conn.commit()
+        self._known = {}
+        self._observed = {}
+        self._lock = threading.Lock()
+
+    def load(self, keys, chunk_size=500):
+        """Pull the stored hashes for ``keys`` into memory before a fetch round"""
+        if self.ignore_stored:
+            return
+        keys = [k for k in keys if k not in self._known]
+        for start in range(0, len(keys), chunk_size):
+            chunk = keys[start:start + chunk_size]
+            rows = self.conn.execute(
+                f"SELECT page_key, content_hash, etag, last_modified FROM page_hashes "
+                f"WHERE page_key IN ({','.join('?' * len(chunk))})",
+                chunk
+            ).fetchall()
+            for key, content_hash, etag, last_modified in rows:
+                self._known[key] = (content_hash, etag, last_modified)
+
+    def is_known(self, key):
+        return key in self._known
+
+    def conditional_headers(self, key):
+        known = self._known.get(key)
+        headers = {}
+        if known:
+            if known[1]:
+                headers['If-None-Match'] = known[1]
+            if known[2]:
+                headers['If-Modified-Since'] = known[2]
+        return headers
+
+    def observe(self, key, response, body=None):
+        """Record what was served for ``key``; True if it matches the stored page.
+
+        ``body`` narrows the hash to the relevant part of the page; by
+        default the whole response body is hashed.
+        """
+        known = self._known.get(key)
+        if response.status_code == 304 and known:
+            content_hash, unchanged = known[0], True
+        else:
+            data = response.content if body is None else body.encode('utf-8')
+            content_hash = hashlib.sha256(data).hexdigest()
+            unchanged = known is not None and known[0] == content_hash
+        with self._lock:
+            self._observed[key] = (
+                content_hash,
+                response.headers.get('ETag') or (known[1] if unchanged else None),
+                response.headers.get('Last-Modified') or (known[2] if unchanged else None),
+                unchanged,
+            )
+        return unchanged
+
+    def changes(self, prefix):
+        """``(changed, unchanged)`` keys observed this pass that start with ``prefix``"""
+        with self._lock:
+            observed = [(k, v[3]) for k, v in self._observed.items() if k.startswith(prefix)]
+        changed = sorted(k for k, unchanged in observed if not unchanged)
+        unchanged = sorted(k for k, unchanged in observed if unchanged)
+        return changed, unchanged
+
+    def commit(self):
+        """Persist everything observed this pass; call only after the pass has saved"""
+        now = time.time()
+        with self._lock:
+            observed, self._observed = self._observed, {}
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO page_hashes "
+                "(page_key, content_hash, etag, last_modified, checked_at, changed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (page_key) DO UPDATE SET "
+                "  content_hash = excluded.content_hash, etag = excluded.etag, "
+                "  last_modified = excluded.last_modified, checked_at = excluded.checked_at, "
+                "  changed_at = CASE WHEN page_hashes.content_hash = excluded.content_hash "
+                "                    THEN page_hashes.changed_at ELSE excluded.changed_at END",
+                [(key, h, etag, lm, now, now) for key, (h, etag, lm, _) in observed.items()]
+            )
+        for key, (h, etag, lm, _) in observed.items():
+            self._known[key] = (h, etag, lm)
+        return len(observed)
+
+    def close(self):
+        self.conn.close()
+
+
+# --- Reconciliation State ---
+class ReconcileState:
+    """When each LIMS day was last reconciled by a comprehensive pass.
+
+    Drives the rotating slice of older history: every night the days that
+    have gone longest without a check are picked, enough of them to cover
+    the whole range once per cycle. Like PageHashes, observations are only
+    written by ``commit()`` after the pass has saved its records.
+    """
+
+    def __init__(self, path):
+        self.conn = connect_state_db(path)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS reconcile_days (
+                day TEXT PRIMARY KEY,
+                checked_at REAL NOT NULL,
+                patients INTEGER NOT NULL
+            )
+        """)
+        self.conn.commit()
+        self._observed = {}
+
+    def rotation(self, first_day, last_day, cycle_nights):
+        """The least recently checked days in ``[first_day, last_day]``, ~1/cycle of the range"""
+        if last_day < first_day:
+            return []
+        checked = dict(self.conn.execute(
+            "SELECT day, checked_at FROM reconcile_days WHERE day BETWEEN ? AND ?",
+            (first_day.isoformat(), last_day.isoformat())
+        ).fetchall())
+        total = (last_day - first_day).days + 1
+        days = [first_day + timedelta(days=n) for n in range(total)]
+        days.sort(key=lambda d: (checked.get(d.isoformat(), 0.0), d))
+        return sorted(days[:-(-total // max(1, cycle_nights))])
+
+    def observe(self, day, patients):
+        self._observed[day.isoformat()] = patients
+
+    def commit(self):
+        now = time.time()
+        observed, self._observed = self._observed, {}
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO reconcile_days (day, checked_at, patients) VALUES (?, ?, ?)",
+                [(day, now, patients) for day, patients in observed.items()]
+            )
+        return len(observed)
+
+    def close(self):
+        self.conn.close()
+
+
+# --- Run Checkpoints ---
+class RunCheckpoint:
+    """Progress of an unfinished pass, so that a restart can resume it.
+
+    A day is recorded once every patient on its search page has had its
+    details fetched and its records saved, a patient once its records are
+    saved. The fetcher stages marks as it goes and calls ``save()`` after
+    each batch it has written; ``clear()`` drops the checkpoint when the
+    pass completes. Checkpoints older than ``max_age_hours`` are discarded
+    rather than resumed.
+    """
+
+    def __init__(self, path, name, max_age_hours=48):
+        self.conn = connect_state_db(path)
+        self.name = name
+        self.max_age_seconds = max_age_hours * 3600
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS run_checkpoints (
+                name TEXT PRIMARY KEY,
+                plan TEXT NOT NULL,
+                started_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS checkpoint_days (
+                name TEXT NOT NULL,
+                day TEXT NOT NULL,
+                patients INTEGER NOT NULL,
+                PRIMARY KEY (name, day)
+            );
+            CREATE TABLE IF NOT EXISTS checkpoint_patients (
+                name TEXT NOT NULL,
+                patient_key TEXT NOT NULL,
+                PRIMARY KEY (name, patient_key)
+            );
+        """)
+        self.conn.commit()
+        self.started_at = None
+        self.plan = []
+        self.days_done = {}
+        self.patients_done = set()
+        self._days = {}
+        self._patients = []
+
+    def resume(self):
+        """Load an unfinished checkpoint; returns True if there is one to resume"""
+        row = self.conn.execute(
+            "SELECT plan, started_at, updated_at FROM run_checkpoints WHERE name = ?", (self.name,)
+        ).fetchone()
+        if row is None:
+            return False
+        plan, started_at, updated_at = row
+        if time.time() - updated_at > self.max_age_seconds:
+            self.clear()
+            return False
+        self.started_at = started_at
+        self.plan = [date.fromisoformat(day) for day in json.loads(plan)]
+        self.days_done = {
+            date.fromisoformat(day): patients
+            for day, patients in self.conn.execute(
+                "SELECT day, patients FROM checkpoint_days WHERE name = ?", (self.name,))
+        }
+        self.patients_done = {
+            key for (key,) in self.conn.execute(
+                "SELECT patient_key FROM checkpoint_patients WHERE name = ?", (self.name,))
+        }
+        return True
+
+    def begin(self, plan):
+        """Record the days this pass will search (kept from a resumed checkpoint)"""
+        now = time.time()
+        self.started_at = self.started_at or now
+        self.plan = sorted(plan)
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO run_checkpoints (name, plan, started_at, updated_at) VALUES (?, ?, ?, ?)",
+                (self.name, json.dumps([day.isoformat() for day in self.plan]), self.started_at, now)
+            )
+
+    def day_done(self, day, patients):
+        self._days[day.isoformat()] = patients
+
+    def patient_done(self, key):
+        self._patients.append(key)
+
+    def save(self):
+        """Write the marks staged since the last save; returns how many there were"""
+        days, self._days = self._days, {}
+        patients, self._patients = self._patients, []
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO checkpoint_days (name, day, patients) VALUES (?, ?, ?)",
+                [(self.name, day, count) for day, count in days.items()]
+            )
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO checkpoint_patients (name, patient_key) VALUES (?, ?)",
+                [(self.name, key) for key in patients]
+            )
+            self.conn.execute(
+                "UPDATE run_checkpoints SET updated_at = ? WHERE name = ?", (time.time(), self.name)
+            )
+        return len(days) + len(patients)
+
+    def clear(self):
+        with self.conn:
+            for table in ('run_checkpoints', 'checkpoint_days', 'checkpoint_patients'):
+                self.conn.execute(f"DELETE FROM {table} WHERE name = ?", (self.name,))
+        self.started_at = None
+        self.plan = []
+        self.days_done = {}
+        self.patients_done = set()
+        self._days = {}
+        self._patients = []
+
+    def close(self):
+        self.conn.close()
+
+
+# --- Dead Letters ---
+class DeadLetters:
+    """Days and patients whose fetch failed, queued for retry on later passes.
+
+    ``kind`` is ``'day'`` (key: ISO date) or ``'patient'`` (key:
+    ``InvoiceNo:LabNo``, payload: the patient row from the search page).
+    Entries that have failed ``max_attempts`` times are kept for
+    inspection but no longer retried. ``fail()`` and ``resolve()`` may be
+    called from worker threads; nothing is written before ``commit()``.
+    """
+
+    def __init__(self, path, max_attempts=10):
+        self.conn = connect_state_db(path)
+        self.max_attempts = max_attempts
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS dead_letters (
+                kind TEXT NOT NULL,
+                key TEXT NOT NULL,
+                payload TEXT,
+                attempts INTEGER NOT NULL,
+                last_error TEXT,
+                first_failed_at REAL NOT NULL,
+                last_failed_at REAL NOT NULL,
+                PRIMARY KEY (kind, key)
+            )
+        """)
+        self.conn.commit()
+        self._pending = set()
+        self._failed = {}
+        self._resolved = set()
+        self._lock = threading.Lock()
+        self.total_failed = 0
+        self.total_resolved = 0
+
+    def pending(self, kind):
+        """``(key, payload)`` for entries of ``kind`` that are still due for a retry"""
+        rows = self.conn.execute(
+            "SELECT key, payload FROM dead_letters WHERE kind = ? AND attempts < ? ORDER BY key",
+            (kind, self.max_attempts)
+        ).fetchall()
+        self._pending.update((kind, key) for key, _ in rows)
+        return [(key, json.loads(payload) if payload else None) for key, payload in rows]
+
+    def fail(self, kind, key, payload=None, error=None):
+        with self._lock:
+            self._failed[(kind, key)] = (payload, error)
+            self._resolved.discard((kind, key))
+
+    def resolve(self, kind, key):
+        with self._lock:
+            if (kind, key) in self._pending and (kind, key) not in self._failed:
+                self._resolved.add((kind, key))
+
+    def counts(self):
+        with self._lock:
+            return len(self._failed), len(self._resolved)
+
+    def commit(self):
+        """Write staged failures and recoveries; may be called several times per pass"""
+        now = time.time()
+        with self._lock:
+            failed, self._failed = self._failed, {}
+            resolved, self._resolved = self._resolved, set()
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO dead_letters "
+                "(kind, key, payload, attempts, last_error, first_failed_at, last_failed_at) "
+                "VALUES (?, ?, ?, 1, ?, ?, ?) "
+                "ON CONFLICT (kind, key) DO UPDATE SET "
+                "  attempts = dead_letters.attempts + 1, last_error = excluded.last_error, "
+                "  last_failed_at = excluded.last_failed_at",
+                [(kind, key, json.dumps(payload) if payload is not None else None, error, now, now)
+                 for (kind, key), (payload, error) in failed.items()]
+            )
+            self.conn.executemany(
+                "DELETE FROM dead_letters WHERE kind = ? AND key = ?", list(resolved)
+            )
+        with self._lock:
+            # A failure written mid-pass can still be resolved later in the same pass
+            self._pending -= resolved
+            self._pending.update(failed)
+        self.total_failed += len(failed)
+        self.total_resolved += len(resolved)
+        return len(failed), len(resolved)
+
+    def close(self):
+        self.conn.close()
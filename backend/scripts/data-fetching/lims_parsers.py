@@ -0,0 +1,184 @@
+"""
+Table extraction backends for LIMS pages.
+
+Every backend answers the same question: "give me the rows of the first
+<table> matching this id/class, as lists of stripped <td> texts". The
+first row (the header) is included, exactly as ``table.find_all('tr')``
+returns it, so callers keep their ``rows[1:]`` logic. ``None`` means the
+table was not found.
+
+Backends:
+  * ``lxml``   - libxml2 pull parser; only <tr> elements are materialised
+                 and they are cleared as soon as they have been read.
+  * ``stream`` - stdlib html.parser tokenizer that only keeps the text of
+                 the target table's cells; no tree is built at all.
+  * ``bs4``    - the original BeautifulSoup/html.parser path, also used as
+                 the fallback when a fast backend raises.
+Nested tables inside the target table are not expected on LIMS pages and
+are not given special treatment.
+"""
+import logging
+from html.parser import HTMLParser
+
+from bs4 import BeautifulSoup
+
+try:
+    from lxml import etree
+except ImportError:  # lxml is optional
+    etree = None
+
+logger = logging.getLogger('fetch_lims_data')
+
+
+def _table_matches(attrs, table_id, table_class):
+    if table_id is not None and attrs.get('id') != table_id:
+        return False
+    if table_class is not None and table_class not in (attrs.get('class') or '').split():
+        return False
+    return True
+
+
+# --- BeautifulSoup ---
+def bs4_table_rows(html, table_id=None, table_class=None):
+    soup = BeautifulSoup(html, 'html.parser')
+    kwargs = {}
+    if table_id is not None:
+        kwargs['id'] = table_id
+    if table_class is not None:
+        kwargs['class_'] = table_class
+    table = soup.find('table', **kwargs)
+    if not table:
+        return None
+    return [[td.text.strip() for td in tr.find_all('td')] for tr in table.find_all('tr')]
+
+
+# --- lxml ---
+def lxml_table_rows(html, table_id=None, table_class=None, chunk_size=65536):
+    if etree is None:
+        raise RuntimeError("lxml is not installed")
+    parser = etree.HTMLPullParser(events=('end',), tag='tr')
+    target = None
+    rows = []
+
+    def drain():
+        nonlocal target
+        for _, tr in parser.read_events():
+            table = next(tr.iterancestors('table'), None)
+            if table is None:
+                continue
+            if target is None and _table_matches(table.attrib, table_id, table_class):
+                target = table
+            if table is target:
+                rows.append([''.join(td.itertext()).strip() for td in tr.iter('td')])
+            tr.clear()
+
+    for start in range(0, len(html), chunk_size):
+        parser.feed(html[start:start + chunk_size])
+        drain()
+    parser.close()
+    drain()
+    return rows if target is not None else None
+
+
+# --- Streaming (stdlib) ---
+class _StopParsing(Exception):
+    pass
+
+
+class _TableRowCollector(HTMLParser):
+    def __init__(self, table_id, table_class):
+        super().__init__(convert_charrefs=True)
+        self.table_id = table_id
+        self.table_class = table_class
+        self.found = False
+        self.depth = 0
+        self.rows = []
+        self.row = None
+        self.cell = None
+
+    def _close_cell(self):
+        if self.cell is not None:
+            self.row.append(''.join(self.cell).strip())
+            self.cell = None
+
+    def _close_row(self):
+        self._close_cell()
+        if self.row is not None:
+            self.rows.append(self.row)
+            self.row = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'table':
+            if self.depth:
+                self.depth += 1
+            elif _table_matches(dict(attrs), self.table_id, self.table_class):
+                self.found = True
+                self.depth = 1
+            return
+        if not self.depth:
+            return
+        if tag == 'tr':
+            self._close_row()
+            self.row = []
+        elif tag == 'td' and self.row is not None:
+            self._close_cell()
+            self.cell = []
+
+    def handle_endtag(self, tag):
+        if not self.depth:
+            return
+        if tag == 'table':
+            self.depth -= 1
+            if not self.depth:
+                self._close_row()
+                raise _StopParsing()
+        elif tag == 'tr':
+            self._close_row()
+        elif tag == 'td':
+            self._close_cell()
+
+    def handle_data(self, data):
+        if self.cell is not None:
+            self.cell.append(data)
+
+
+def stream_table_rows(html, table_id=None, table_class=None, chunk_size=65536):
+    collector = _TableRowCollector(table_id, table_class)
+    try:
+        for start in range(0, len(html), chunk_size):
+            collector.feed(html[start:start + chunk_size])
+        collector.close()
+        collector._close_row()
+    except _StopParsing:
+        pass
+    return collector.rows if collector.found else None
+
+
+BACKENDS = {
+    'lxml': lxml_table_rows,
+    'stream': stream_table_rows,
+    'bs4': bs4_table_rows,
+}
+
+
+def resolve_backend(name):
+    """Map a configured backend name (or 'auto') to an available backend"""
+    name = (name or 'auto').lower()
+    if name == 'auto':
+        return 'lxml' if etree is not None else 'stream'
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown HTML parser backend '{name}' (expected one of {', '.join(BACKENDS)} or auto)")
+    if name == 'lxml' and etree is None:
+        logger.warning("lxml is not installed; using the stream parser instead")
+        return 'stream'
+    return name
+
+
+def extract_table_rows(html, backend, table_id=None, table_class=None):
+    """Rows of the first matching table using ``backend``, falling back to BeautifulSoup"""
+    if backend != 'bs4':
+        try:
+            return BACKENDS[backend](html, table_id=table_id, table_class=table_class)
+        except Exception as e:
+            logger.warning(f"{backend} parser failed ({e}); falling back to BeautifulSoup")
+    return bs4_table_rows(html, table_id=table_id, table_class=table_class)
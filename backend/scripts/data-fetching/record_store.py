@@ -0,0 +1,267 @@
+"""
+Append-only store for fetched test records.
+
+Replaces the load-everything / rewrite-everything cycle on data.json:
+  * appends cost O(new records) and are deduplicated against a persistent
+    (LabNo, TestName) primary key;
+  * the latest EncounterDate and the record count are kept in meta rows,
+    so looking them up does not scan the history;
+  * data.json is still produced by export_json() for ingest.ts and other
+    consumers of the old format;
+  * bulk reads (sink batches, the legacy import) use the compact Record
+    type instead of one dict per record;
+  * records can be read a month at a time, for the columnar snapshots.
+"""
+import json
+import os
+import sqlite3
+import sys
+import threading
+from datetime import date
+from functools import lru_cache
+
+RECORD_FIELDS = ("EncounterDate", "InvoiceNo", "LabNo", "Src", "TestName")
+
+
+@lru_cache(maxsize=4096)
+def day_ordinal(iso_date):
+    """Ordinal of a YYYY-MM-DD date; histories repeat each date thousands of times"""
+    return date.fromisoformat(iso_date).toordinal()
+
+
+class Record:
+    """Compact test record.
+
+    The encounter date is kept as a date ordinal and the heavily repeated
+    Src / TestName values are interned, so a large history costs a fraction
+    of the equivalent dicts. ``record['LabNo']`` style access still works,
+    so code written against data.json-shaped dicts accepts Records too.
+    """
+    __slots__ = ('day', 'invoice_no', 'lab_no', 'src', 'test_name')
+
+    _ATTRS = {'InvoiceNo': 'invoice_no', 'LabNo': 'lab_no', 'Src': 'src', 'TestName': 'test_name'}
+
+    def __init__(self, day, invoice_no, lab_no, src, test_name):
+        self.day = day
+        self.invoice_no = invoice_no
+        self.lab_no = lab_no
+        self.src = sys.intern(src)
+        self.test_name = sys.intern(test_name)
+
+    @classmethod
+    def from_dict(cls, record):
+        return cls(day_ordinal(record['EncounterDate']), record['InvoiceNo'],
+                   record['LabNo'], record['Src'], record['TestName'])
+
+    @property
+    def encounter_date(self):
+        return date.fromordinal(self.day).isoformat()
+
+    @property
+    def key(self):
+        return record_key(self.lab_no, self.test_name)
+
+    def __getitem__(self, field):
+        if field == 'EncounterDate':
+            return self.encounter_date
+        return getattr(self, self._ATTRS[field])
+
+    def __eq__(self, other):
+        if not isinstance(other, Record):
+            return NotImplemented
+        return (self.day, self.invoice_no, self.lab_no, self.src, self.test_name) == \
+            (other.day, other.invoice_no, other.lab_no, other.src, other.test_name)
+
+    __hash__ = None
+
+    def to_dict(self):
+        return {
+            "EncounterDate": self.encounter_date,
+            "InvoiceNo": self.invoice_no,
+            "LabNo": self.lab_no,
+            "Src": self.src,
+            "TestName": self.test_name,
+        }
+
+    def __repr__(self):
+        return f"Record({self.to_dict()!r})"
+
+
+TEST_ID_BITS = 20
+TEST_ID_LIMIT = 1 << TEST_ID_BITS
+
+_test_ids = {}
+_test_ids_lock = threading.Lock()
+
+
+def record_key(lab_no, test_name):
+    """Compact (LabNo, TestName) dedup key.
+
+    Test names map to small per-process integers. A LabNo in the normal
+    numeric form (DDMMYYHHMM+sequence: ASCII digits, no leading zero) is
+    packed with a test id below 2**20 into a single int, which is then
+    exact; anything else falls back to a (LabNo, test id) tuple, and an int
+    never equals a tuple, so keys do not collide.
+    """
+    test_id = _test_ids.get(test_name)
+    if test_id is None:
+        with _test_ids_lock:
+            test_id = _test_ids.setdefault(test_name, len(_test_ids))
+    if test_id < TEST_ID_LIMIT and lab_no.isascii() and lab_no.isdigit() and lab_no[0] != '0':
+        return (int(lab_no) << TEST_ID_BITS) | test_id
+    return (lab_no, test_id)
+
+
+class RecordStore:
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS records (
+                lab_no TEXT NOT NULL,
+                test_name TEXT NOT NULL,
+                encounter_date TEXT NOT NULL,
+                invoice_no TEXT NOT NULL,
+                src TEXT NOT NULL,
+                PRIMARY KEY (lab_no, test_name)
+            );
+            CREATE INDEX IF NOT EXISTS idx_records_encounter_date ON records (encounter_date);
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+        """)
+        self.conn.commit()
+
+    def is_empty(self):
+        return self.conn.execute("SELECT 1 FROM records LIMIT 1").fetchone() is None
+
+    def count(self):
+        value = self._get_meta('record_count')
+        if value is None:
+            return self.conn.execute("SELECT COUNT(*) FROM records").fetchone()[0]
+        return int(value)
+
+    def _get_meta(self, key):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def latest_encounter_date(self):
+        value = self._get_meta('latest_encounter_date')
+        return date.fromisoformat(value) if value else None
+
+    def sync_watermark(self, name):
+        """Highest rowid already delivered to the named downstream sink"""
+        return int(self._get_meta(f'sync:{name}') or 0)
+
+    def set_sync_watermark(self, name, rowid):
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (f'sync:{name}', str(rowid))
+            )
+
+    def records_after(self, rowid, limit):
+        """Up to ``limit`` records stored after ``rowid``, as (last rowid, Records)"""
+        rows = self.conn.execute(
+            "SELECT rowid, encounter_date, invoice_no, lab_no, src, test_name FROM records "
+            "WHERE rowid > ? ORDER BY rowid LIMIT ?",
+            (rowid, limit)
+        ).fetchall()
+        if not rows:
+            return rowid, []
+        return rows[-1][0], [
+            Record(day_ordinal(encounter_date), invoice_no, lab_no, src, test_name)
+            for _, encounter_date, invoice_no, lab_no, src, test_name in rows
+        ]
+
+    def append(self, records):
+        """Insert records not already stored; returns the ones that were added"""
+        added = []
+        latest = self._get_meta('latest_encounter_date') or ''
+        total = self.count()
+        with self.conn:
+            for record in records:
+                cursor = self.conn.execute(
+                    "INSERT OR IGNORE INTO records (lab_no, test_name, encounter_date, invoice_no, src) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (record['LabNo'], record['TestName'], record['EncounterDate'],
+                     record['InvoiceNo'], record['Src'])
+                )
+                if cursor.rowcount:
+                    added.append(record)
+                    latest = max(latest, record['EncounterDate'])
+            meta = [('record_count', str(total + len(added)))]
+            if latest:
+                meta.append(('latest_encounter_date', latest))
+            self.conn.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", meta)
+        return added
+
+    def iter_records(self):
+        """Stored records in insertion order, as data.json-shaped dicts"""
+        cursor = self.conn.execute(
+            "SELECT encounter_date, invoice_no, lab_no, src, test_name FROM records ORDER BY rowid"
+        )
+        for row in cursor:
+            yield dict(zip(RECORD_FIELDS, row))
+
+    def iter_compact(self):
+        """Stored records in insertion order, as Records"""
+        cursor = self.conn.execute(
+            "SELECT encounter_date, invoice_no, lab_no, src, test_name FROM records ORDER BY rowid"
+        )
+        for encounter_date, invoice_no, lab_no, src, test_name in cursor:
+            yield Record(day_ordinal(encounter_date), invoice_no, lab_no, src, test_name)
+
+    def months(self):
+        """'YYYY-MM' of every stored EncounterDate, in order"""
+        return [row[0] for row in self.conn.execute(
+            "SELECT DISTINCT substr(encounter_date, 1, 7) FROM records ORDER BY 1"
+        )]
+
+    def month_columns(self, month):
+        """Records of ``month`` ('YYYY-MM') in insertion order, as field name -> list of values"""
+        rows = self.conn.execute(
+            "SELECT encounter_date, invoice_no, lab_no, src, test_name FROM records "
+            "WHERE encounter_date BETWEEN ? AND ? ORDER BY rowid",
+            (f"{month}-01", f"{month}-31")
+        ).fetchall()
+        return dict(zip(RECORD_FIELDS, map(list, zip(*rows)))) if rows else {field: [] for field in RECORD_FIELDS}
+
+    def import_json(self, path):
+        """One-time migration of an existing data.json into the store"""
+        with open(path, 'r', encoding='utf-8') as f:
+            records = json.load(f)
+        compact, seen = [], set()
+        # Pop in file order so each dict is released as soon as it is converted
+        records.reverse()
+        while records:
+            record = records.pop()
+            if not all(record.get(field) for field in RECORD_FIELDS):
+                continue
+            try:
+                record = Record.from_dict(record)
+            except ValueError:
+                continue
+            key = record.key
+            if key not in seen:
+                seen.add(key)
+                compact.append(record)
+        return len(self.append(compact))
+
+    def export_json(self, path):
+        """Stream every record into ``path`` (atomically replaced), returns the count"""
+        tmp_path = f"{path}.tmp"
+        written = 0
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write('[')
+            for record in self.iter_records():
+                f.write(',\n  ' if written else '\n  ')
+                f.write(json.dumps(record, ensure_ascii=False))
+                written += 1
+            f.write('\n]\n' if written else ']\n')
+        os.replace(tmp_path, path)
+        return written
+
+    def close(self):
+        self.conn.close()
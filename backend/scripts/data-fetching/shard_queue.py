@@ -0,0 +1,193 @@
+"""
+PostgreSQL work queue for sharded LIMS fetches (migration 004).
+
+A run's days are split into shards of consecutive days. Worker processes,
+on any host that can reach the database, claim shards with
+``FOR UPDATE SKIP LOCKED``, stage the records they fetch and mark the
+shard done; a shard whose worker stops heart-beating is handed to the
+next claimant. Every later write of a worker is guarded by its claim
+(claimant and attempt number), so a worker that lost its shard that way
+cannot stage into, complete or requeue the new claimant's attempt; it
+gets ShardLostError (or False from fail()) instead. Merging reads done shards back in shard order, so the
+merged result is the same however the work was spread.
+"""
+import csv
+import io
+import json
+import os
+import socket
+from collections import namedtuple
+from datetime import date
+
+try:
+    import psycopg2
+except ImportError:  # only needed for sharded runs
+    psycopg2 = None
+
+from record_store import Record, day_ordinal
+
+
+# A claimed shard; ``claimed_by`` and ``attempt`` identify the claim
+Shard = namedtuple('Shard', 'id run_id days attempt claimed_by')
+
+# The shard is still held by the claim it was given out under
+OWNED = "id = %(id)s AND status = 'running' AND claimed_by = %(claimed_by)s AND attempts = %(attempt)s"
+
+
+class ShardLostError(RuntimeError):
+    """The shard went stale and another worker claimed it"""
+
+
+def claim_params(shard, **params):
+    return dict(params, id=shard.id, claimed_by=shard.claimed_by, attempt=shard.attempt)
+
+
+def worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def split_days(days, shard_days):
+    """Consecutive runs of sorted ``days``, at most ``shard_days`` long each"""
+    days = sorted(set(days))
+    return [days[start:start + shard_days] for start in range(0, len(days), shard_days)]
+
+
+class ShardQueue:
+    def __init__(self, database_url):
+        if psycopg2 is None:
+            raise RuntimeError("psycopg2 is required for sharded fetches (pip install psycopg2-binary)")
+        if not database_url:
+            raise RuntimeError("DATABASE_URL is required for sharded fetches")
+        self.conn = psycopg2.connect(database_url)
+
+    def enqueue(self, run_id, shards):
+        """Queue ``shards`` (lists of dates) under ``run_id``; returns how many were added"""
+        with self.conn, self.conn.cursor() as cur:
+            cur.executemany(
+                "INSERT INTO lims_fetch_shards (run_id, shard_no, days) VALUES (%s, %s, %s::date[]) "
+                "ON CONFLICT (run_id, shard_no) DO NOTHING",
+                [(run_id, n, [d.isoformat() for d in days]) for n, days in enumerate(shards)]
+            )
+        return len(shards)
+
+    def latest_run(self):
+        with self.conn, self.conn.cursor() as cur:
+            cur.execute("SELECT run_id FROM lims_fetch_shards ORDER BY created_at DESC, id DESC LIMIT 1")
+            row = cur.fetchone()
+        return row[0] if row else None
+
+    def claim(self, run_id=None, stale_seconds=600):
+        """Take the next pending (or abandoned) shard; returns a Shard or None.
+
+        Records staged by an earlier attempt at the shard are discarded.
+        """
+        with self.conn, self.conn.cursor() as cur:
+            cur.execute("""
+                UPDATE lims_fetch_shards s
+                SET status = 'running', attempts = s.attempts + 1, claimed_by = %s,
+                    claimed_at = NOW(), heartbeat_at = NOW(), last_error = NULL
+                WHERE s.id = (
+                    SELECT id FROM lims_fetch_shards
+                    WHERE (%s::text IS NULL OR run_id = %s)
+                      AND (status = 'pending'
+                           OR (status = 'running' AND heartbeat_at < NOW() - %s * INTERVAL '1 second'))
+                    ORDER BY run_id, shard_no
+                    FOR UPDATE SKIP LOCKED
+                    LIMIT 1
+                )
+                RETURNING s.id, s.run_id, s.days, s.attempts, s.claimed_by
+            """, (worker_name(), run_id, run_id, stale_seconds))
+            row = cur.fetchone()
+            if row is None:
+                return None
+            cur.execute("DELETE FROM lims_fetch_shard_records WHERE shard_id = %s", (row[0],))
+        return Shard(*row)
+
+    def heartbeat(self, shard):
+        """Refresh the shard's heartbeat; False once the claim has been lost"""
+        with self.conn, self.conn.cursor() as cur:
+            cur.execute(f"UPDATE lims_fetch_shards SET heartbeat_at = NOW() WHERE {OWNED}", claim_params(shard))
+            return cur.rowcount == 1
+
+    def stage(self, shard, records, first_ord):
+        """COPY one batch of a shard's records into the staging table"""
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        for n, r in enumerate(records, first_ord):
+            writer.writerow((shard.id, n, r['EncounterDate'], r['InvoiceNo'], r['LabNo'], r['Src'], r['TestName']))
+        buf.seek(0)
+        with self.conn, self.conn.cursor() as cur:
+            # Locks the shard row, so it cannot be re-claimed while the batch goes in
+            cur.execute(f"UPDATE lims_fetch_shards SET heartbeat_at = NOW() WHERE {OWNED}", claim_params(shard))
+            if cur.rowcount != 1:
+                raise ShardLostError(f"shard {shard.id} was claimed by another worker")
+            cur.copy_expert(
+                "COPY lims_fetch_shard_records (shard_id, ord, encounter_date, invoice_no, lab_no, source, "
+                "test_name) FROM STDIN WITH (FORMAT csv)",
+                buf
+            )
+
+    def complete(self, shard, records, day_patients):
+        with self.conn, self.conn.cursor() as cur:
+            cur.execute(
+                f"UPDATE lims_fetch_shards SET status = 'done', finished_at = NOW(), records = %(records)s, "
+                f"day_patients = %(day_patients)s WHERE {OWNED}",
+                claim_params(shard, records=records,
+                             day_patients=json.dumps({d.isoformat(): n for d, n in day_patients.items()}))
+            )
+            if cur.rowcount != 1:
+                raise ShardLostError(f"shard {shard.id} was claimed by another worker")
+
+    def fail(self, shard, error, max_attempts):
+        """Put the shard back in the queue, or give up on it after ``max_attempts``.
+
+        Returns False, leaving the shard alone, if the claim has been lost.
+        """
+        with self.conn, self.conn.cursor() as cur:
+            cur.execute(
+                "UPDATE lims_fetch_shards "
+                "SET status = CASE WHEN attempts >= %(max_attempts)s THEN 'failed' ELSE 'pending' END, "
+                f"last_error = %(error)s, finished_at = NOW() WHERE {OWNED}",
+                claim_params(shard, max_attempts=max_attempts, error=str(error)[:1000])
+            )
+            return cur.rowcount == 1
+
+    def counts(self, run_id):
+        with self.conn, self.conn.cursor() as cur:
+            cur.execute("SELECT status, COUNT(*) FROM lims_fetch_shards WHERE run_id = %s GROUP BY status",
+                        (run_id,))
+            return dict(cur.fetchall())
+
+    def done_shards(self, run_id):
+        """(shard id, shard no, day -> patients) for done shards of the run, in shard order"""
+        with self.conn, self.conn.cursor() as cur:
+            cur.execute("SELECT id, shard_no, day_patients FROM lims_fetch_shards "
+                        "WHERE run_id = %s AND status = 'done' ORDER BY shard_no", (run_id,))
+            return [
+                (shard_id, shard_no, {date.fromisoformat(d): n for d, n in (day_patients or {}).items()})
+                for shard_id, shard_no, day_patients in cur.fetchall()
+            ]
+
+    def iter_records(self, shard_id, batch_size):
+        """A done shard's staged records in fetch order, as lists of Records"""
+        with self.conn:
+            with self.conn.cursor(name=f'shard_{shard_id}') as cur:
+                cur.itersize = batch_size
+                cur.execute(
+                    "SELECT encounter_date::text, invoice_no, lab_no, source, test_name "
+                    "FROM lims_fetch_shard_records WHERE shard_id = %s ORDER BY ord", (shard_id,)
+                )
+                while True:
+                    rows = cur.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    yield [Record(day_ordinal(d), invoice_no, lab_no, src, test_name)
+                           for d, invoice_no, lab_no, src, test_name in rows]
+
+    def mark_merged(self, shard_id):
+        with self.conn, self.conn.cursor() as cur:
+            cur.execute("UPDATE lims_fetch_shards SET status = 'merged' WHERE id = %s", (shard_id,))
+            cur.execute("DELETE FROM lims_fetch_shard_records WHERE shard_id = %s", (shard_id,))
+
+    def close(self):
+        self.conn.close()
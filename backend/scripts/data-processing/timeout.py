@@ -1,10 +1,34 @@
 import os
+import io
+import sys
 import csv
+import json
+import stat
+import time
+import queue
+import signal
+import argparse
+import threading
+import contextlib
 import datetime
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from pathlib import Path
 from dotenv import load_dotenv
 import psycopg2
-from psycopg2.extras import execute_values
+from psycopg2.pool import ThreadedConnectionPool
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:  # optional: --watch falls back to polling
+    Observer = None
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "common"))
+from job_lock import JobLock
+from rollups import refresh_rollups
+from snapshots import TIMEOUTS_SCHEMA, MonthlySnapshots, pyarrow_available
+import timeout_join
 
 load_dotenv()
 
@@ -13,6 +37,57 @@ PUBLIC_DIR = Path(os.getenv("PUBLIC_DIR", "../frontend/public"))
 OUTPUT_TIMEOUT_CSV_PATH = PUBLIC_DIR / "TimeOut.csv"
 DATABASE_URL = os.getenv("DATABASE_URL")
 
+BACKEND_ROOT = Path(__file__).resolve().parents[2]
+SCAN_INDEX_PATH = Path(os.getenv("SCAN_INDEX_PATH", BACKEND_ROOT / ".timeout_scan_index.json"))
+# Month-partitioned Arrow snapshot of the scanned files, next to TimeOut.csv (needs pyarrow)
+SNAPSHOT_ENABLED = os.getenv("TIMEOUT_SNAPSHOT", "true").lower() == "true"
+SNAPSHOT_DIR = Path(os.getenv("SNAPSHOT_DIR", BACKEND_ROOT / "snapshots")) / "timeouts"
+# Re-stat every file this often, to catch in-place changes that leave the
+# directory mtime untouched
+SCAN_FULL_EVERY_HOURS = float(os.getenv("SCAN_FULL_EVERY_HOURS", "24"))
+SCAN_INDEX_VERSION = 1
+
+# Parallel walk: directories down to SCAN_PARALLEL_DEPTH are listed on the
+# pool, deeper subtrees are walked serially by the worker that reached them
+SCAN_WORKERS = max(1, int(os.getenv("SCAN_WORKERS", "8")))
+SCAN_PARALLEL_DEPTH = max(1, int(os.getenv("SCAN_PARALLEL_DEPTH", "3")))
+SCAN_PROGRESS_SECONDS = float(os.getenv("SCAN_PROGRESS_SECONDS", "10"))
+
+# Database writes: records are COPYed and merged in chunks, each chunk
+# committed on its own, over connections from a shared pool
+DB_CHUNK_SIZE = max(1, int(os.getenv("TIMEOUT_DB_CHUNK_SIZE", "5000")))
+DB_POOL_MAX = max(1, int(os.getenv("TIMEOUT_DB_POOL_MAX", "4")))
+# Match files to encounters with the join index (migration 006) and stamp
+# time_out / actual_tat on their tests; set false to leave it to transform.ts
+MATCH_ENABLED = os.getenv("TIMEOUT_MATCH", "true").lower() == "true"
+FILENAME_PREFIXES = tuple(
+    p.strip().upper() for p in os.getenv("TIMEOUT_FILENAME_PREFIXES", ",".join(timeout_join.DEFAULT_PREFIXES)).split(",")
+    if p.strip()
+)
+UNMATCHED_AFTER_HOURS = float(os.getenv("TIMEOUT_UNMATCHED_AFTER_HOURS", "24"))
+UNMATCHED_REPORT_PATH = BACKEND_ROOT / "logs" / "timeout_unmatched.csv"
+# Recompute the dashboard rollups (migration 005) of the dates time-outs were stamped on
+ROLLUPS_ENABLED = os.getenv("TIMEOUT_ROLLUPS", "true").lower() == "true"
+
+# Single-instance lock shared with other scans ('file' flock or 'postgres'
+# advisory lock); an overlapping run waits as the one queued follow-up
+JOB_LOCK_BACKEND = os.getenv("JOB_LOCK_BACKEND", "file")
+TIMEOUT_LOCK_PATH = Path(os.getenv("TIMEOUT_LOCK_PATH", BACKEND_ROOT / ".timeout_scan.lock"))
+TIMEOUT_LOCK_WAIT_SECONDS = float(os.getenv("TIMEOUT_LOCK_WAIT_SECONDS", "3600"))
+
+# Watch mode (--watch): filesystem events (watchdog) on local folders, cheap
+# incremental polling on network mounts. Event bursts are debounced into
+# micro-batches; a regular incremental scan reconciles whatever events missed.
+WATCH_MODE = os.getenv("TIMEOUT_WATCH_MODE", "auto")  # auto | events | poll
+WATCH_DEBOUNCE_SECONDS = float(os.getenv("TIMEOUT_WATCH_DEBOUNCE_SECONDS", "2"))
+WATCH_MAX_DELAY_SECONDS = float(os.getenv("TIMEOUT_WATCH_MAX_DELAY_SECONDS", "10"))
+WATCH_POLL_SECONDS = float(os.getenv("TIMEOUT_WATCH_POLL_SECONDS", "15"))
+WATCH_RECONCILE_MINUTES = float(os.getenv("TIMEOUT_WATCH_RECONCILE_MINUTES", "60"))
+WATCH_INDEX_SAVE_SECONDS = float(os.getenv("TIMEOUT_WATCH_INDEX_SAVE_SECONDS", "60"))
+NETWORK_FILESYSTEMS = {'nfs', 'nfs4', 'cifs', 'smb3', 'smbfs', 'fuse.sshfs', '9p', 'afs', 'davfs'}
+
+_db_pool = None
+
 def format_creation_time(time_string):
     """Parse various date formats and return standardized string."""
     date_formats = [
@@ -31,74 +106,413 @@ def format_creation_time(time_string):
             continue
     return None
 
+def get_db_pool():
+    """Shared connection pool, created on first use."""
+    global _db_pool
+    if _db_pool is None:
+        _db_pool = ThreadedConnectionPool(1, DB_POOL_MAX, DATABASE_URL)
+    return _db_pool
+
+def close_db_pool():
+    global _db_pool
+    if _db_pool is not None:
+        _db_pool.closeall()
+        _db_pool = None
+
+@contextlib.contextmanager
+def db_connection():
+    """Borrow a pooled connection; it is rolled back if the caller raised."""
+    pool = get_db_pool()
+    conn = pool.getconn()
+    try:
+        yield conn
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        pool.putconn(conn)
+
+def to_timestamp(creation_time):
+    """CreationTime ('MM/DD/YYYY hh:mm AM') as an ISO timestamp for COPY."""
+    return datetime.datetime.strptime(creation_time, '%m/%d/%Y %I:%M %p').isoformat(sep=' ')
+
+def copy_chunk(cur, chunk):
+    """Stream one chunk of records into the session's staging table."""
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    for r in chunk:
+        writer.writerow((r['FileName'], to_timestamp(r['CreationTime'])))
+    buf.seek(0)
+    cur.copy_expert(
+        "COPY timeout_staging (file_name, creation_time) FROM STDIN WITH (FORMAT csv)",
+        buf
+    )
+
 def save_to_database(records):
-    """Save timeout records to PostgreSQL."""
+    """Save timeout records to PostgreSQL.
+
+    Each chunk is COPYed into a temp staging table and merged with a single
+    upsert that leaves rows alone when creation_time is unchanged.
+    """
+    written = skipped = 0
+    try:
+        with db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    CREATE TEMP TABLE IF NOT EXISTS timeout_staging (
+                        file_name VARCHAR(100) NOT NULL,
+                        creation_time TIMESTAMP NOT NULL
+                    ) ON COMMIT DELETE ROWS
+                """)
+                for start in range(0, len(records), DB_CHUNK_SIZE):
+                    copy_chunk(cur, records[start:start + DB_CHUNK_SIZE])
+                    cur.execute("SELECT COUNT(DISTINCT file_name) FROM timeout_staging")
+                    staged = cur.fetchone()[0]
+                    cur.execute("""
+                        INSERT INTO timeout_records (file_name, creation_time)
+                        SELECT DISTINCT ON (file_name) file_name, creation_time
+                        FROM timeout_staging
+                        ORDER BY file_name, creation_time DESC
+                        ON CONFLICT (file_name)
+                        DO UPDATE SET creation_time = EXCLUDED.creation_time
+                        WHERE timeout_records.creation_time IS DISTINCT FROM EXCLUDED.creation_time
+                    """)
+                    written += cur.rowcount
+                    skipped += staged - cur.rowcount
+                    conn.commit()
+        print(f"✅ Database: {written} rows written, {skipped} unchanged rows skipped")
+    except Exception as e:
+        print(f"❌ Database error: {e} ({written} rows written before the failure)")
+        return False
+    if written and ROLLUPS_ENABLED and not MATCH_ENABLED:
+        update_rollups()
+    return True
+
+def match_time_outs(file_names=None):
+    """Stamp time-outs on the tests of encounters matching the saved files.
+
+    ``file_names`` limits matching to just-saved files (watch batches). A
+    full match also tries tests whose encounter was fetched after its file
+    appeared, and reports files that stay unmatched. A failure is only
+    reported: the next full match covers the same tests.
+    """
+    if not MATCH_ENABLED:
+        return
+    try:
+        with db_connection() as conn:
+            indexed, matched, dates = timeout_join.stamp_time_outs(conn, file_names, FILENAME_PREFIXES)
+            if matched or dates:
+                print(f"🔗 Matched {matched} files, stamped time-outs on {len(dates)} encounter dates "
+                      f"({indexed} files indexed)")
+            if file_names is None:
+                write_unmatched_report(timeout_join.unmatched_files(conn, UNMATCHED_AFTER_HOURS))
+    except psycopg2.errors.UndefinedTable:
+        print("⚠️ Time-out matching needs migration 006 (npm run migrate:006); transform.ts matches meanwhile")
+        return
+    except Exception as e:
+        print(f"⚠️ Time-out matching failed: {e}")
+        return
+    if dates and ROLLUPS_ENABLED:
+        update_rollups(dates)
+
+def write_unmatched_report(rows):
+    """Rewrite the report of files no encounter matched within UNMATCHED_AFTER_HOURS."""
+    UNMATCHED_REPORT_PATH.parent.mkdir(parents=True, exist_ok=True)
+    with open(UNMATCHED_REPORT_PATH, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['FileName', 'CreationTime', 'FirstSeen', 'TriedKeys'])
+        writer.writerows(rows)
+    if rows:
+        print(f"⚠️ {len(rows)} time-out files unmatched for over {UNMATCHED_AFTER_HOURS:g}h, "
+              f"listed in {UNMATCHED_REPORT_PATH}")
+
+def update_rollups(dates=()):
+    """Recompute the dashboard rollups of ``dates`` and of test_records changed since the last refresh.
+
+    A failure is only reported: the records are saved, and the next
+    refresh picks the same dates up.
+    """
     try:
-        conn = psycopg2.connect(DATABASE_URL)
-        cur = conn.cursor()
-        
-        execute_values(
-            cur,
-            """
-            INSERT INTO timeout_records (file_name, creation_time)
-            VALUES %s
-            ON CONFLICT (file_name) 
-            DO UPDATE SET creation_time = EXCLUDED.creation_time
-            """,
-            [(r['FileName'], r['CreationTime']) for r in records]
-        )
-        
-        conn.commit()
-        cur.close()
-        conn.close()
-        print(f"✅ Saved {len(records)} records to database")
+        with db_connection() as conn:
+            refreshed = refresh_rollups(conn, dates)
+        if refreshed:
+            print(f"📈 Rollups: {refreshed} dates recomputed")
     except Exception as e:
-        print(f"❌ Database error: {e}")
+        print(f"⚠️ Rollup refresh failed: {e}")
 
-def export_to_csv(records):
-    """Export records to CSV file."""
+def export_to_csv(records, append=False):
+    """Export records to CSV file, or append them to the existing one."""
     try:
         OUTPUT_TIMEOUT_CSV_PATH.parent.mkdir(parents=True, exist_ok=True)
-        with open(OUTPUT_TIMEOUT_CSV_PATH, 'w', newline='', encoding='utf-8') as f:
+        append = append and OUTPUT_TIMEOUT_CSV_PATH.exists()
+        with open(OUTPUT_TIMEOUT_CSV_PATH, 'a' if append else 'w', newline='', encoding='utf-8') as f:
             writer = csv.DictWriter(f, fieldnames=['FileName', 'CreationTime'])
-            writer.writeheader()
+            if not append:
+                writer.writeheader()
             writer.writerows(records)
-        print(f"✅ Exported to {OUTPUT_TIMEOUT_CSV_PATH}")
+        print(f"✅ {'Appended' if append else 'Exported'} {len(records)} records to {OUTPUT_TIMEOUT_CSV_PATH}")
+        return True
     except Exception as e:
         print(f"❌ CSV export error: {e}")
+        return False
+
+def snapshot_columns(dirs, months):
+    """Yield (month, columns) for each of ``months`` from the index, in one pass over it."""
+    columns = {month: {'FileName': [], 'CreationTime': []} for month in months}
+    for entry in dirs.values():
+        for name, state in entry['files'].items():
+            # Minute precision, like TimeOut.csv and timeout_records
+            created = datetime.datetime.fromtimestamp(state[0]).replace(second=0, microsecond=0)
+            month = columns.get(f"{created:%Y-%m}")
+            if month is not None:
+                month['FileName'].append(os.path.splitext(name)[0])
+                month['CreationTime'].append(created)
+    yield from columns.items()
+
+def all_months(dirs):
+    return {
+        datetime.datetime.fromtimestamp(state[0]).strftime('%Y-%m')
+        for entry in dirs.values()
+        for state in entry['files'].values()
+    }
+
+def export_snapshot(dirs, records=None):
+    """Rewrite the snapshot months of ``records`` (every month when None) from the index.
+
+    Like TimeOut.csv it is derived from the index, so a failure is only
+    reported; the next full rewrite repairs it.
+    """
+    if not SNAPSHOT_ENABLED or not pyarrow_available():
+        return
+    try:
+        snapshot = MonthlySnapshots(SNAPSHOT_DIR, TIMEOUTS_SCHEMA)
+        if records is None or not snapshot.months():
+            months = all_months(dirs)
+            snapshot.prune(months)
+        else:
+            months = {to_timestamp(r['CreationTime'])[:7] for r in records}
+        rows, failed = snapshot.update(months, lambda ms: snapshot_columns(dirs, ms))
+        if failed:
+            print(f"⚠️ Snapshot months in use, rewritten next time: {', '.join(sorted(failed))}")
+    except Exception as e:
+        print(f"⚠️ Snapshot export error: {e}")
+
+def make_record(file_name, ctime):
+    """Build a FileName/CreationTime record from a file name and its creation timestamp."""
+    return {
+        'FileName': os.path.splitext(os.path.basename(file_name))[0],
+        'CreationTime': datetime.datetime.fromtimestamp(ctime).strftime('%m/%d/%Y %I:%M %p'),
+    }
+
+def load_scan_index():
+    """Load the persisted directory/file state index, or an empty one."""
+    try:
+        with open(SCAN_INDEX_PATH, 'r', encoding='utf-8') as f:
+            index = json.load(f)
+        if index.get('version') == SCAN_INDEX_VERSION and index.get('source') == str(SOURCE_FOLDER):
+            return index
+        print("⚠️ Scan index is for another source or version, rebuilding")
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print(f"⚠️ Could not read scan index {SCAN_INDEX_PATH}: {e}")
+    return {'version': SCAN_INDEX_VERSION, 'source': str(SOURCE_FOLDER), 'last_full_scan': 0, 'dirs': {}}
+
+def save_scan_index(index):
+    """Atomically write the scan index."""
+    tmp_path = SCAN_INDEX_PATH.with_name(SCAN_INDEX_PATH.name + '.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(index, f, separators=(',', ':'))
+    os.replace(tmp_path, SCAN_INDEX_PATH)
+
+def scan_directory(path, cached, full):
+    """List one directory, reusing the cached listing when its mtime is unchanged.
+
+    Returns (entry, changed) where entry is the new index entry
+    {mtime_ns, subdirs, files: {name: [ctime, mtime_ns, size]}} and changed
+    lists (name, ctime) for files that are new or whose state differs.
+    """
+    dir_mtime = os.stat(path).st_mtime_ns
+    if cached and not full and cached['mtime_ns'] == dir_mtime:
+        return cached, []
+
+    old_files = cached['files'] if cached else {}
+    files, subdirs, changed = {}, [], []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.name)
+                elif entry.is_file(follow_symlinks=False):
+                    st = entry.stat(follow_symlinks=False)
+                    state = [st.st_ctime, st.st_mtime_ns, st.st_size]
+                    files[entry.name] = state
+                    if old_files.get(entry.name) != state:
+                        changed.append((entry.name, st.st_ctime))
+            except OSError as e:
+                print(f"⚠️ Could not process {entry.path}: {e}")
+    return {'mtime_ns': dir_mtime, 'subdirs': subdirs, 'files': files}, changed
+
+def scan_tree(rel, old_dirs, full, serial):
+    """Scan one directory, and with serial=True its whole subtree.
+
+    Returns (results, pending) where results holds (rel, cached, entry,
+    changed) per scanned directory (entry is None when it could not be
+    read) and pending lists subdirectories left for the pool.
+    """
+    results, pending = [], []
+    stack = [rel]
+    while stack:
+        current = stack.pop()
+        path = SOURCE_FOLDER / current if current else SOURCE_FOLDER
+        cached = old_dirs.get(current)
+        try:
+            entry, changed = scan_directory(path, cached, full)
+        except OSError as e:
+            print(f"⚠️ Could not scan {path}: {e}")
+            results.append((current, cached, None, []))
+            continue
+        results.append((current, cached, entry, changed))
+        children = [f"{current}/{sub}" if current else sub for sub in entry['subdirs']]
+        (stack if serial else pending).extend(children)
+    return results, pending
+
+def scan_source_folder(index, full=False, quiet=False):
+    """Walk SOURCE_FOLDER on a thread pool, skipping directories whose mtime has not changed.
+
+    Workers only list directories; this thread is the single consumer that
+    builds the new index and the FileName/CreationTime records.
+    Returns (new_dirs, changed_records, modified) where modified is True when
+    a previously indexed file changed rather than only new files appearing.
+    With quiet=True the summary line is only printed when something changed.
+    """
+    old_dirs = index['dirs']
+    new_dirs = {}
+    changed_records = []
+    modified = False
+    dirs_seen = files_seen = 0
+    started = last_report = time.monotonic()
+
+    def depth(rel):
+        return rel.count('/') + 1 if rel else 0
+
+    with ThreadPoolExecutor(max_workers=SCAN_WORKERS, thread_name_prefix='scan') as executor:
+        waiting = deque([''])
+        running = set()
+        while waiting or running:
+            while waiting and len(running) < SCAN_WORKERS * 2:
+                rel = waiting.popleft()
+                running.add(executor.submit(scan_tree, rel, old_dirs, full, depth(rel) >= SCAN_PARALLEL_DEPTH))
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                results, pending = future.result()
+                waiting.extend(pending)
+                for rel, cached, entry, changed in results:
+                    if entry is None:
+                        if cached:
+                            new_dirs[rel] = cached
+                        continue
+                    new_dirs[rel] = entry
+                    dirs_seen += 1
+                    files_seen += len(entry['files'])
+                    for name, ctime in changed:
+                        if cached and name in cached['files']:
+                            modified = True
+                        changed_records.append(make_record(name, ctime))
 
-def run_timeout_update():
-    """Main function to scan Z: drive and update records."""
+            now = time.monotonic()
+            if now - last_report >= SCAN_PROGRESS_SECONDS:
+                elapsed = now - started
+                print(f"⏳ {dirs_seen} dirs, {files_seen} files "
+                      f"({dirs_seen / elapsed:.0f} dirs/s, {files_seen / elapsed:.0f} files/s)")
+                last_report = now
+
+    elapsed = max(time.monotonic() - started, 1e-9)
+    if quiet and not changed_records:
+        return new_dirs, changed_records, modified
+    print(f"📁 Walked {dirs_seen} dirs, {files_seen} files in {elapsed:.1f}s "
+          f"({dirs_seen / elapsed:.0f} dirs/s, {files_seen / elapsed:.0f} files/s, {SCAN_WORKERS} workers)")
+    return new_dirs, changed_records, modified
+
+def records_from_index(dirs):
+    """All FileName/CreationTime records described by the index."""
+    return [
+        make_record(name, state[0])
+        for entry in dirs.values()
+        for name, state in entry['files'].items()
+    ]
+
+def scan_and_save(index, full=False, quiet=False):
+    """Scan the share, send new or changed files and update ``index`` in place.
+
+    A full re-stat happens when asked for or when the last one is older
+    than SCAN_FULL_EVERY_HOURS. ``quiet`` scans (watch polling) only match
+    the files they send to encounters and only write the index when
+    something changed. Returns the number of new or changed files.
+    """
+    started = time.monotonic()
+    first_scan = not index['dirs']
+    full = full or time.time() - index.get('last_full_scan', 0) > SCAN_FULL_EVERY_HOURS * 3600
+    if full:
+        print("🔁 Full scan: re-checking every file")
+
+    new_dirs, changed_records, modified = scan_source_folder(index, full, quiet)
+    if changed_records or not quiet:
+        total_files = sum(len(entry['files']) for entry in new_dirs.values())
+        print(f"📊 Found {total_files} files, {len(changed_records)} new or changed "
+              f"({time.monotonic() - started:.1f}s)")
+
+    saved = db_saved = True
+    if changed_records:
+        saved = db_saved = save_to_database(changed_records)
+        if first_scan or modified:
+            saved = export_to_csv(records_from_index(new_dirs)) and saved
+            export_snapshot(new_dirs)
+        else:
+            saved = export_to_csv(changed_records, append=True) and saved
+            export_snapshot(new_dirs, changed_records)
+    else:
+        if not OUTPUT_TIMEOUT_CSV_PATH.exists():
+            saved = export_to_csv(records_from_index(new_dirs))
+        # Builds a missing snapshot and retries months left pending
+        export_snapshot(new_dirs, [])
+    if db_saved:
+        if not quiet:
+            # One-off runs and watch reconciles also try older files against
+            # encounters fetched since, and refresh the unmatched report
+            match_time_outs()
+        elif changed_records:
+            match_time_outs([r['FileName'] for r in changed_records])
+
+    # Keep the old index when a write failed so the same files are sent again next run
+    if saved:
+        # Unchanged directories keep their cached entries, so comparing is cheap
+        index_changed = full or changed_records or new_dirs != index['dirs']
+        index['dirs'] = new_dirs
+        if full:
+            index['last_full_scan'] = time.time()
+        if index_changed or not quiet:
+            try:
+                save_scan_index(index)
+            except Exception as e:
+                print(f"⚠️ Could not save scan index: {e}")
+    else:
+        print("⚠️ Scan index not updated because saving failed")
+    return len(changed_records)
+
+def run_timeout_update(full=False):
+    """Main function to scan Z: drive and update records.
+
+    Only new or changed files are sent to the database. TimeOut.csv is
+    appended to when files were only added and rewritten from the index
+    otherwise, so it always lists every file on the share.
+    """
     print("=" * 70)
     print("Starting Z: Drive Scan...")
     print("=" * 70)
 
-    all_records = []
-
     if SOURCE_FOLDER.is_dir():
-        for root, dirs, files in os.walk(SOURCE_FOLDER):
-            for file_name in files:
-                base_name = os.path.splitext(os.path.basename(file_name))[0]
-                file_path = Path(root) / file_name
-
-                try:
-                    creation_time_timestamp = os.path.getctime(file_path)
-                    creation_time = datetime.datetime.fromtimestamp(creation_time_timestamp)
-                    formatted_time = creation_time.strftime('%m/%d/%Y %I:%M %p')
-                    
-                    all_records.append({
-                        'FileName': base_name,
-                        'CreationTime': formatted_time
-                    })
-                except Exception as e:
-                    print(f"⚠️ Could not process {file_path}: {e}")
-
-        print(f"📊 Found {len(all_records)} files")
-
-        # Save to database
-        if all_records:
-            save_to_database(all_records)
-            export_to_csv(all_records)
+        scan_and_save(load_scan_index(), full)
     else:
         print(f"❌ Source folder '{SOURCE_FOLDER}' does not exist")
 
@@ -106,5 +520,242 @@ def run_timeout_update():
     print("Scan complete")
     print("=" * 70)
 
+def is_network_path(path):
+    """Best guess whether ``path`` is on a network mount, where change events are unreliable."""
+    path = os.path.abspath(path)
+    if path.startswith(('\\\\', '//')):
+        return True
+    if os.name == 'nt':
+        import ctypes
+        drive = os.path.splitdrive(path)[0] + '\\'
+        return ctypes.windll.kernel32.GetDriveTypeW(drive) == 4  # DRIVE_REMOTE
+    try:
+        with open('/proc/mounts', 'r', encoding='utf-8') as f:
+            mounts = [line.split()[1:3] for line in f]
+    except OSError:
+        return False
+    real = os.path.realpath(path)
+    best, fstype = '', ''
+    for mount_point, mount_type in mounts:
+        prefix = mount_point.rstrip('/') + '/'
+        if (real == mount_point or real.startswith(prefix)) and len(mount_point) > len(best):
+            best, fstype = mount_point, mount_type
+    return fstype in NETWORK_FILESYSTEMS
+
+def start_observer(changes):
+    """Watch SOURCE_FOLDER recursively, putting changed paths on the ``changes`` queue."""
+    class ChangeHandler(FileSystemEventHandler):
+        def on_any_event(self, event):
+            # A directory's own "modified" just echoes changes to the files in it
+            if event.is_directory and event.event_type == 'modified':
+                return
+            if event.event_type in ('created', 'modified', 'closed'):
+                changes.put(event.src_path)
+            elif event.event_type == 'moved':
+                changes.put(event.dest_path)
+
+    observer = Observer()
+    observer.schedule(ChangeHandler(), str(SOURCE_FOLDER), recursive=True)
+    observer.daemon = True
+    observer.start()
+    return observer
+
+def apply_changes(index, paths):
+    """Send the files behind changed ``paths`` and record them in the index.
+
+    Directories (e.g. moved in whole) are expanded to their files. Files
+    whose state the index already holds are skipped. Directory mtimes in
+    the index are left alone, so the next reconcile scan still lists the
+    directories and finds anything the events missed. Returns the number
+    of files sent, or None when saving failed.
+    """
+    files = set()
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        if stat.S_ISDIR(st.st_mode):
+            for root, _, names in os.walk(path):
+                files.update(os.path.join(root, name) for name in names)
+        elif stat.S_ISREG(st.st_mode):
+            files.add(path)
+
+    records, touched, modified = [], [], False
+    for path in sorted(files):
+        try:
+            st = os.stat(path)
+            rel_dir = os.path.relpath(os.path.dirname(path), SOURCE_FOLDER)
+        except (OSError, ValueError):
+            continue
+        rel_dir = '' if rel_dir == '.' else rel_dir.replace(os.sep, '/')
+        if rel_dir.startswith('..'):
+            continue
+        name = os.path.basename(path)
+        state = [st.st_ctime, st.st_mtime_ns, st.st_size]
+        entry = index['dirs'].get(rel_dir)
+        known = entry['files'].get(name) if entry else None
+        if known == state:
+            continue
+        modified = modified or known is not None
+        records.append(make_record(name, st.st_ctime))
+        touched.append((rel_dir, name, state, known))
+    if not records:
+        return 0
+
+    for rel_dir, name, state, _ in touched:
+        # mtime_ns 0: a directory first seen through events is listed by the next scan
+        entry = index['dirs'].setdefault(rel_dir, {'mtime_ns': 0, 'subdirs': [], 'files': {}})
+        entry['files'][name] = state
+    saved = save_to_database(records)
+    if saved:
+        match_time_outs([r['FileName'] for r in records])
+    if modified:
+        saved = export_to_csv(records_from_index(index['dirs'])) and saved
+        export_snapshot(index['dirs'])
+    else:
+        saved = export_to_csv(records, append=True) and saved
+        export_snapshot(index['dirs'], records)
+    if not saved:
+        # Put back what the index held before, and have the reconcile scan
+        # list these directories again so it sends the files
+        for rel_dir, name, _, known in touched:
+            entry = index['dirs'][rel_dir]
+            entry['mtime_ns'] = 0
+            if known is None:
+                entry['files'].pop(name, None)
+            else:
+                entry['files'][name] = known
+        return None
+    return len(records)
+
+def run_watch():
+    """Keep timeout_records current until interrupted.
+
+    Changes arrive as filesystem events where the share is local (and
+    watchdog is installed) and from an incremental scan every
+    WATCH_POLL_SECONDS otherwise. Every WATCH_RECONCILE_MINUTES an
+    incremental scan reconciles whatever the events missed.
+    """
+    if not SOURCE_FOLDER.is_dir():
+        print(f"❌ Source folder '{SOURCE_FOLDER}' does not exist")
+        return
+
+    use_events = WATCH_MODE == 'events' or (WATCH_MODE == 'auto' and not is_network_path(SOURCE_FOLDER))
+    if use_events and Observer is None:
+        print("⚠️ watchdog is not installed (pip install watchdog); polling instead")
+        use_events = False
+
+    stop = threading.Event()
+    def shutdown(signum, frame):
+        print(f"Received signal {signum}; stopping.")
+        stop.set()
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    print("=" * 70)
+    print(f"Watching {SOURCE_FOLDER} "
+          + (f"for filesystem events (debounce {WATCH_DEBOUNCE_SECONDS:g}s)" if use_events
+             else f"by polling every {WATCH_POLL_SECONDS:g}s")
+          + f", reconciling every {WATCH_RECONCILE_MINUTES:g} min")
+    print("=" * 70)
+
+    index = load_scan_index()
+    changes = queue.Queue()
+    # Start watching before the catch-up scan so nothing falls between the two
+    observer = start_observer(changes) if use_events else None
+    scan_and_save(index)
+    next_reconcile = time.monotonic() + WATCH_RECONCILE_MINUTES * 60
+    pending, first_change, last_change = set(), 0.0, 0.0
+    index_dirty_since = None
+    try:
+        while not stop.is_set():
+            if use_events:
+                now = time.monotonic()
+                deadline = (min(last_change + WATCH_DEBOUNCE_SECONDS, first_change + WATCH_MAX_DELAY_SECONDS)
+                            if pending else next_reconcile)
+                try:
+                    path = changes.get(timeout=min(max(deadline - now, 0.05), 1.0))
+                except queue.Empty:
+                    path = None
+                if path is not None:
+                    now = time.monotonic()
+                    if not pending:
+                        first_change = now
+                    last_change = now
+                    pending.add(path)
+                    while True:
+                        try:
+                            pending.add(changes.get_nowait())
+                        except queue.Empty:
+                            break
+
+                # Flush once the burst has settled, or when it has gone on for too long
+                now = time.monotonic()
+                if pending and (now - last_change >= WATCH_DEBOUNCE_SECONDS
+                                or now - first_change >= WATCH_MAX_DELAY_SECONDS
+                                or len(pending) >= DB_CHUNK_SIZE):
+                    batch, pending = pending, set()
+                    sent = apply_changes(index, batch)
+                    if sent:
+                        print(f"⚡ {sent} new or changed files sent ({len(batch)} paths changed)")
+                        index_dirty_since = index_dirty_since or now
+            elif not stop.wait(WATCH_POLL_SECONDS):
+                scan_and_save(index, quiet=True)
+
+            # The index can be large; write it out at most every WATCH_INDEX_SAVE_SECONDS
+            now = time.monotonic()
+            if index_dirty_since is not None and now - index_dirty_since >= WATCH_INDEX_SAVE_SECONDS:
+                save_scan_index(index)
+                index_dirty_since = None
+            if now >= next_reconcile and not stop.is_set():
+                print("🔄 Reconciling with an incremental scan")
+                scan_and_save(index)
+                index_dirty_since = None
+                next_reconcile = time.monotonic() + WATCH_RECONCILE_MINUTES * 60
+    finally:
+        if observer is not None:
+            observer.stop()
+            observer.join()
+        if pending:
+            apply_changes(index, pending)
+            index_dirty_since = index_dirty_since or time.monotonic()
+        if index_dirty_since is not None:
+            try:
+                save_scan_index(index)
+            except Exception as e:
+                print(f"⚠️ Could not save scan index: {e}")
+        print("Watch stopped")
+
 if __name__ == "__main__":
-    run_timeout_update()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Scan the result share and update timeout records")
+    parser.add_argument('--full', action='store_true', help="re-check every file instead of only changed directories")
+    parser.add_argument('--watch', action='store_true',
+                        help="keep running and send new files within seconds (filesystem events or polling)")
+    parser.add_argument('--match', action='store_true',
+                        help="only match saved files to encounters and stamp time-outs, e.g. after a LIMS fetch")
+    parser.add_argument('--rebuild-join-index', action='store_true',
+                        help="with --match: re-derive every file's keys first, e.g. after changing the prefixes")
+    args = parser.parse_args()
+    if args.match:
+        if not MATCH_ENABLED:
+            print("⏭️ TIMEOUT_MATCH is false; time-outs are matched by transform.ts")
+        # No job lock: matching is one transaction per run and safe next to a running scan or watch
+        try:
+            if args.rebuild_join_index:
+                with db_connection() as conn:
+                    timeout_join.reset_index(conn)
+            match_time_outs()
+        finally:
+            close_db_pool()
+        sys.exit(0)
+    lock = JobLock(TIMEOUT_LOCK_PATH, JOB_LOCK_BACKEND, DATABASE_URL)
+    if lock.acquire(coalesce=True, wait_seconds=TIMEOUT_LOCK_WAIT_SECONDS):
+        try:
+            if args.watch:
+                run_watch()
+            else:
+                run_timeout_update(full=args.full)
+        finally:
+            close_db_pool()
+            lock.release()
\ No newline at end of file
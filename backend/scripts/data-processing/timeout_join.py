@@ -0,0 +1,181 @@
+"""
+Join index between time-out files and encounters (migration 006).
+
+Result files are named after the invoice (sometimes the lab number) of the
+encounter, but not always literally: "12345 (1)", "12345 - Copy",
+"INV-12345", "12345_REV2", "12345.pdf.pdf", "12345 JOHN DOE". Each file
+name is turned once into candidate keys and stored in timeout_file_keys.
+A key's rank is the normalization step that first produced it, the same
+for every file, so "12345" (rank 0) wins over "12345 - Copy" (rank 3) for
+the same invoice. A wrong stamp is never undone, so the steps stay strict:
+only explicit revision markers are dropped, and a leading number is only
+taken when a name follows it.
+Matching is then a single statement: keys join encounters on invoice_no
+and lab_no, each encounter takes the time-out of its most literal match
+(invoice before lab number, earliest file on a tie), and every test of
+the encounter still waiting for a time-out gets it together with its
+actual TAT.
+"""
+import csv
+import io
+import re
+
+DEFAULT_PREFIXES = ('INVOICE', 'INV', 'LABNO', 'LAB')
+
+_EXTENSIONS = re.compile(r'(?:\.(?:PDF|DOCX?|RTF|TXT|HTML?|XPS|TIFF?|JPE?G|PNG))+$')
+_COPY_OF = re.compile(r'^COPY\s+(?:\(\d+\)\s+)?OF\s+')
+_COPY_SUFFIX = re.compile(r'(?:\s*[-_]?\s*COPY)?(?:\s*\(\d+\))?$')
+_REVISION = re.compile(r'[-_ ](?:REV|R|V)\d{1,2}$')
+_NAMED_ID = re.compile(r'^(\d{5,})\s+[A-Z][A-Z .\'-]*$')
+_SPACES = re.compile(r'\s+')
+
+# Rank of each normalization step; lower ranks win
+RANK_LITERAL, RANK_UPPER, RANK_EXTENSION, RANK_COPY, RANK_PREFIX, RANK_REVISION, RANK_NAMED_ID = range(7)
+
+
+def candidate_keys(file_name, prefixes=DEFAULT_PREFIXES):
+    """(rank, key) pairs ``file_name`` may match an invoice or lab number on, most literal first"""
+    keys = {}
+
+    def add(rank, key):
+        key = key.strip()
+        if key and key not in keys:
+            keys[key] = rank
+
+    add(RANK_LITERAL, file_name)
+    name = _SPACES.sub(' ', file_name.strip().upper())
+    add(RANK_UPPER, name)
+    name = _EXTENSIONS.sub('', name)
+    add(RANK_EXTENSION, name)
+    name = _COPY_SUFFIX.sub('', _COPY_OF.sub('', name)).strip()
+    add(RANK_COPY, name)
+    for prefix in sorted(prefixes, key=len, reverse=True):
+        stripped = re.sub(rf'^{re.escape(prefix)}[\s_#:.\-]*(?=\d)', '', name)
+        if stripped != name:
+            name = stripped
+            add(RANK_PREFIX, name)
+            break
+    add(RANK_REVISION, _REVISION.sub('', name))
+    named = _NAMED_ID.match(name)
+    if named:
+        add(RANK_NAMED_ID, named.group(1))
+    return [(rank, key) for key, rank in keys.items()]
+
+
+UNINDEXED_FILES = """
+    SELECT t.file_name FROM timeout_records t
+    WHERE NOT EXISTS (SELECT 1 FROM timeout_file_keys k WHERE k.file_name = t.file_name)
+"""
+
+# Candidate (encounter, file) pairs; %(files)s limits them to some files
+CANDIDATES = """
+    keys AS (
+      SELECT file_name, rank, match_key FROM timeout_file_keys
+      WHERE (%(files)s::text[] IS NULL OR file_name = ANY(%(files)s::text[])) {and_keys}
+    ), candidates AS (
+      SELECT e.lab_no, e.time_in, k.file_name, k.rank, 0 AS kind
+      FROM keys k JOIN encounters e ON e.invoice_no = k.match_key
+      UNION ALL
+      SELECT e.lab_no, e.time_in, k.file_name, k.rank, 1 AS kind
+      FROM keys k JOIN encounters e ON e.lab_no = k.match_key
+    )
+"""
+
+# Same TAT as calculateTAT() in src/utils/dateUtils.ts: whole minutes, floored
+STAMP_TIME_OUTS = f"""
+    WITH awaiting AS (
+      SELECT DISTINCT encounter_id FROM test_records WHERE time_out IS NULL
+    ), {CANDIDATES.format(and_keys='')}, best AS (
+      SELECT DISTINCT ON (c.lab_no) c.lab_no, c.time_in, t.creation_time
+      FROM candidates c
+      JOIN awaiting a ON a.encounter_id = c.lab_no
+      JOIN timeout_records t ON t.file_name = c.file_name
+      ORDER BY c.lab_no, c.rank, c.kind, t.creation_time
+    )
+    UPDATE test_records tr
+    SET time_out = b.creation_time,
+        actual_tat = FLOOR(EXTRACT(EPOCH FROM b.creation_time - b.time_in) / 60),
+        updated_at = CURRENT_TIMESTAMP
+    FROM best b
+    WHERE tr.encounter_id = b.lab_no AND tr.time_out IS NULL
+    RETURNING tr.encounter_date
+"""
+
+MARK_MATCHED_FILES = f"""
+    WITH {CANDIDATES.format(and_keys='AND file_name IN (SELECT file_name FROM timeout_records WHERE matched_lab_no IS NULL)')}
+    UPDATE timeout_records t
+    SET matched_lab_no = m.lab_no, matched_at = CURRENT_TIMESTAMP
+    FROM (
+      SELECT DISTINCT ON (file_name) file_name, lab_no
+      FROM candidates
+      ORDER BY file_name, rank, kind, lab_no
+    ) m
+    WHERE t.file_name = m.file_name AND t.matched_lab_no IS NULL
+"""
+
+UNMATCHED_FILES = """
+    SELECT t.file_name, t.creation_time, t.imported_at,
+           (SELECT string_agg(k.match_key, ' | ' ORDER BY k.rank)
+            FROM timeout_file_keys k WHERE k.file_name = t.file_name)
+    FROM timeout_records t
+    WHERE t.matched_lab_no IS NULL AND t.imported_at < NOW() - %s * INTERVAL '1 hour'
+    ORDER BY t.creation_time DESC
+"""
+
+
+def index_files(cur, prefixes=DEFAULT_PREFIXES):
+    """Add the candidate keys of timeout_records rows not indexed yet; returns how many files"""
+    cur.execute(UNINDEXED_FILES)
+    names = [row[0] for row in cur.fetchall()]
+    if not names:
+        return 0
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    for name in names:
+        for rank, key in candidate_keys(name, prefixes):
+            writer.writerow((name, rank, key[:100]))
+    buf.seek(0)
+    # Staged, so a concurrent match indexing the same files does not conflict
+    cur.execute("""
+        CREATE TEMP TABLE timeout_keys_staging (
+            file_name VARCHAR(100) NOT NULL,
+            rank SMALLINT NOT NULL,
+            match_key VARCHAR(100) NOT NULL
+        ) ON COMMIT DROP
+    """)
+    cur.copy_expert("COPY timeout_keys_staging (file_name, rank, match_key) FROM STDIN WITH (FORMAT csv)", buf)
+    cur.execute("INSERT INTO timeout_file_keys SELECT * FROM timeout_keys_staging ON CONFLICT DO NOTHING")
+    return len(names)
+
+
+def stamp_time_outs(conn, file_names=None, prefixes=DEFAULT_PREFIXES):
+    """Index new files, then match and stamp time-outs in one transaction.
+
+    With ``file_names`` only those files are matched; otherwise every test
+    still waiting for a time-out is tried, which also catches encounters
+    fetched after their file was saved. Returns (files indexed, files
+    newly matched, encounter dates of the stamped tests).
+    """
+    params = {'files': list(file_names) if file_names is not None else None}
+    with conn, conn.cursor() as cur:
+        indexed = index_files(cur, prefixes)
+        cur.execute(STAMP_TIME_OUTS, params)
+        dates = {row[0] for row in cur.fetchall()}
+        cur.execute(MARK_MATCHED_FILES, params)
+        matched = cur.rowcount
+    return indexed, matched, dates
+
+
+def unmatched_files(conn, older_than_hours):
+    """(file name, creation time, first seen, tried keys) of files unmatched for longer than ``older_than_hours``"""
+    with conn, conn.cursor() as cur:
+        cur.execute(UNMATCHED_FILES, (older_than_hours,))
+        return cur.fetchall()
+
+
+def reset_index(conn):
+    """Forget every file's keys and match, e.g. after changing the prefixes; the next match rebuilds them"""
+    with conn, conn.cursor() as cur:
+        cur.execute("DELETE FROM timeout_file_keys")
+        cur.execute("UPDATE timeout_records SET matched_lab_no = NULL, matched_at = NULL "
+                    "WHERE matched_lab_no IS NOT NULL")
@@ -57,6 +57,18 @@ async function transformData() {
 
     console.log('✅ Timeout records inserted');
 
+    // timeout.py matches files through its join index (migration 006) in one
+    // statement; without the migration, keep matching here
+    if (process.env.TIMEOUT_MATCH !== 'false') {
+      const joinIndex = await query(`SELECT to_regclass('timeout_file_keys') IS NOT NULL AS present`);
+      if (joinIndex.rows[0].present) {
+        console.log('⏭️  Time-outs are matched by timeout.py (TIMEOUT_MATCH); skipping per-record matching');
+        console.log('✅ Data transformation completed');
+        return;
+      }
+      console.warn('⚠️  Migration 006 not applied (npm run migrate:006); matching time-outs per record');
+    }
+
     // Match timeout records with test records and calculate TAT
     // Now using normalized schema: join test_records with encounters
     const startTime = Date.now();
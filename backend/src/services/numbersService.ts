@@ -4,6 +4,10 @@ import { getPeriodDates } from '../utils/dateUtils';
 import { getNumbersTargetForPeriod } from './numbersTargetService';
 import moment from 'moment';
 
+// Read rollup_daily and rollup_hourly (migration 005: requests per day,
+// laboratory and shift, and per hour of time-in) instead of test_records
+const DASHBOARD_ROLLUPS = process.env.DASHBOARD_ROLLUPS === 'true';
+
 export const getNumbersData = async (filters: FilterParams) => {
   let startDate: Date;
   let endDate: Date;
@@ -18,8 +22,16 @@ export const getNumbersData = async (filters: FilterParams) => {
     endDate = filters.endDate ? new Date(filters.endDate) : new Date();
   }
 
-  // Build WHERE clause
-  const conditions = ['encounter_date BETWEEN $1 AND $2', 'is_cancelled = false'];
+  const source = DASHBOARD_ROLLUPS ? 'rollup_daily' : 'test_records';
+  const hourlySource = DASHBOARD_ROLLUPS ? 'rollup_hourly' : 'test_records';
+  const requests = DASHBOARD_ROLLUPS ? 'COALESCE(SUM(requests), 0)' : 'COUNT(*)';
+  // numeric like EXTRACT's, so that hour 0 is a non-empty string below
+  const hour = DASHBOARD_ROLLUPS ? 'hour::numeric' : 'EXTRACT(HOUR FROM time_in)';
+
+  // Build WHERE clause (rollups leave cancelled tests out already)
+  const conditions = DASHBOARD_ROLLUPS
+    ? ['encounter_date BETWEEN $1 AND $2']
+    : ['encounter_date BETWEEN $1 AND $2', 'is_cancelled = false'];
   const params: any[] = [startDate, endDate];
   let paramCount = 3;
 
@@ -37,7 +49,7 @@ export const getNumbersData = async (filters: FilterParams) => {
 
   // Get total requests
   const totalResult = await query(
-    `SELECT COUNT(*) as total FROM test_records WHERE ${whereClause}`,
+    `SELECT ${requests} as total FROM ${source} WHERE ${whereClause}`,
     params
   );
   const totalRequests = parseInt(totalResult.rows[0].total);
@@ -56,8 +68,8 @@ export const getNumbersData = async (filters: FilterParams) => {
 
   // Get daily volume
   const dailyVolumeResult = await query(
-    `SELECT encounter_date::date as date, COUNT(*) as count
-     FROM test_records 
+    `SELECT encounter_date::date as date, ${requests} as count
+     FROM ${source} 
      WHERE ${whereClause}
      GROUP BY encounter_date::date 
      ORDER BY encounter_date::date`,
@@ -71,10 +83,10 @@ export const getNumbersData = async (filters: FilterParams) => {
 
   // Get hourly volume
   const hourlyVolumeResult = await query(
-    `SELECT EXTRACT(HOUR FROM time_in) as hour, COUNT(*) as count
-     FROM test_records 
+    `SELECT ${hour} as hour, ${requests} as count
+     FROM ${hourlySource} 
      WHERE ${whereClause}
-     GROUP BY EXTRACT(HOUR FROM time_in)
+     GROUP BY ${hour}
      ORDER BY hour`,
     params
   );
@@ -3,6 +3,10 @@ import { FilterParams } from '../types';
 import { getPeriodDates } from '../utils/dateUtils';
 import moment from 'moment';
 
+// Read rollup_tests (migration 005: revenue per day, test, lab section,
+// laboratory and shift) instead of test_records
+const DASHBOARD_ROLLUPS = process.env.DASHBOARD_ROLLUPS === 'true';
+
 export const getRevenueData = async (filters: FilterParams) => {
   let startDate: Date;
   let endDate: Date;
@@ -17,13 +21,20 @@ export const getRevenueData = async (filters: FilterParams) => {
     endDate = filters.endDate ? new Date(filters.endDate) : new Date();
   }
 
-  // Build WHERE clause
-  const conditions = ['encounter_date BETWEEN $1 AND $2', 'is_cancelled = false'];
+  const source = DASHBOARD_ROLLUPS ? 'rollup_tests' : 'test_records';
+  const revenue = DASHBOARD_ROLLUPS ? 'revenue' : 'price_at_test';
+  const labSection = DASHBOARD_ROLLUPS ? "NULLIF(lab_section, '')" : 'lab_section_at_test';
+  const laboratory = DASHBOARD_ROLLUPS ? "NULLIF(laboratory, '')" : 'laboratory';
+
+  // Build WHERE clause (rollups leave cancelled tests out already)
+  const conditions = DASHBOARD_ROLLUPS
+    ? ['encounter_date BETWEEN $1 AND $2']
+    : ['encounter_date BETWEEN $1 AND $2', 'is_cancelled = false'];
   const params: any[] = [startDate, endDate];
   let paramCount = 3;
 
   if (filters.labSection && filters.labSection !== 'all') {
-    conditions.push(`LOWER(lab_section_at_test) = LOWER($${paramCount++})`);
+    conditions.push(`LOWER(${labSection}) = LOWER($${paramCount++})`);
     params.push(filters.labSection);
   }
 
@@ -41,8 +52,8 @@ export const getRevenueData = async (filters: FilterParams) => {
 
   // Get total revenue
   const totalResult = await query(
-    `SELECT COALESCE(SUM(price_at_test), 0) as total_revenue 
-     FROM test_records 
+    `SELECT COALESCE(SUM(${revenue}), 0) as total_revenue 
+     FROM ${source} 
      WHERE ${whereClause}`,
     params
   );
@@ -70,8 +81,8 @@ export const getRevenueData = async (filters: FilterParams) => {
   // Get daily revenue
   const dailyResult = await query(
     `SELECT encounter_date::date as date, 
-            COALESCE(SUM(price_at_test), 0) as revenue 
-     FROM test_records 
+            COALESCE(SUM(${revenue}), 0) as revenue 
+     FROM ${source} 
      WHERE ${whereClause}
      GROUP BY encounter_date::date 
      ORDER BY encounter_date::date`,
@@ -89,11 +100,11 @@ export const getRevenueData = async (filters: FilterParams) => {
 
   // Get revenue by lab section
   const sectionResult = await query(
-    `SELECT lab_section_at_test as section, 
-            COALESCE(SUM(price_at_test), 0) as revenue 
-     FROM test_records 
+    `SELECT ${labSection} as section, 
+            COALESCE(SUM(${revenue}), 0) as revenue 
+     FROM ${source} 
      WHERE ${whereClause}
-     GROUP BY lab_section_at_test 
+     GROUP BY 1 
      ORDER BY revenue DESC`,
     params
   );
@@ -106,8 +117,8 @@ export const getRevenueData = async (filters: FilterParams) => {
   // Get top 50 tests by revenue
   const testResult = await query(
     `SELECT test_name, 
-            COALESCE(SUM(price_at_test), 0) as revenue 
-     FROM test_records 
+            COALESCE(SUM(${revenue}), 0) as revenue 
+     FROM ${source} 
      WHERE ${whereClause}
      GROUP BY test_name 
      ORDER BY revenue DESC 
@@ -122,11 +133,11 @@ export const getRevenueData = async (filters: FilterParams) => {
 
   // Get revenue by hospital unit
   const unitResult = await query(
-    `SELECT laboratory as unit, 
-            COALESCE(SUM(price_at_test), 0) as revenue 
-     FROM test_records 
+    `SELECT ${laboratory} as unit, 
+            COALESCE(SUM(${revenue}), 0) as revenue 
+     FROM ${source} 
      WHERE ${whereClause}
-     GROUP BY laboratory 
+     GROUP BY 1 
      ORDER BY revenue DESC`,
     params
   );
@@ -144,11 +155,9 @@ export const getRevenueData = async (filters: FilterParams) => {
   const previousParams = [previousStartDate, previousEndDate, ...params.slice(2)];
 
   const previousResult = await query(
-    `SELECT COALESCE(SUM(price_at_test), 0) as total_revenue 
-     FROM test_records 
-     WHERE encounter_date BETWEEN $1 AND $2 AND is_cancelled = false ${
-       params.length > 2 ? `AND ${conditions.slice(1).join(' AND ')}` : ''
-     }`,
+    `SELECT COALESCE(SUM(${revenue}), 0) as total_revenue 
+     FROM ${source} 
+     WHERE ${whereClause}`,
     previousParams
   );
 
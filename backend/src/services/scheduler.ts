@@ -1,11 +1,28 @@
 import cron from 'node-cron';
 import { exec } from 'child_process';
+import http from 'http';
 import { promisify } from 'util';
 import { emitToAll } from '../config/socket';
 import { exportMetadataToCSV } from './metadataService';
 
 const execAsync = promisify(exec);
 
+// Ask the LIMS fetch daemon (fetch_lims_data.py --daemon) for a pass and
+// wait until it has finished
+const requestLimsRefresh = (baseUrl: string): Promise<void> =>
+  new Promise((resolve, reject) => {
+    const req = http.request(`${baseUrl}/refresh?wait=1`, { method: 'POST' }, (res) => {
+      res.resume();
+      res.on('end', () =>
+        res.statusCode === 200
+          ? resolve()
+          : reject(new Error(`LIMS daemon responded with ${res.statusCode}`))
+      );
+    });
+    req.on('error', reject);
+    req.end();
+  });
+
 export const initializeScheduler = () => {
   console.log('📅 Initializing task scheduler...');
 
@@ -13,13 +30,43 @@ export const initializeScheduler = () => {
   cron.schedule('*/5 * * * *', async () => {
     console.log('Running data ingestion...');
     try {
-      // Run Python timeout script
-      await execAsync('python scripts/data-processing/timeout.py');
+      if (process.env.LIMS_DAEMON_URL) {
+        try {
+          await requestLimsRefresh(process.env.LIMS_DAEMON_URL);
+        } catch (error) {
+          console.error('⚠️  LIMS daemon refresh failed:', error);
+        }
+      }
+
+      // Run Python timeout script, unless timeout.py --watch keeps the
+      // timeout records current on its own
+      if (process.env.TIMEOUT_WATCH !== 'true') {
+        await execAsync('python scripts/data-processing/timeout.py');
+      }
       
-      // Run TypeScript ingest and transform
-      await execAsync('npm run ingest');
+      // Run TypeScript ingest and transform. With LIMS_DB_SINK enabled the
+      // Python fetcher already upserts encounters/test_records directly.
+      if (process.env.LIMS_DB_SINK !== 'true') {
+        await execAsync('npm run ingest');
+      }
       await execAsync('npm run transform');
 
+      // Stamp time-outs on the encounters just ingested (no-op with TIMEOUT_MATCH=false).
+      // Not fatal, like the rollup refresh below
+      try {
+        await execAsync('python scripts/data-processing/timeout.py --match');
+      } catch (error) {
+        console.error('⚠️  Time-out matching failed:', error);
+      }
+
+      // Recompute the dashboard rollups of the dates ingest/transform changed.
+      // Not fatal: without migration 005 clients are still told about new data
+      try {
+        await execAsync('python scripts/common/rollups.py');
+      } catch (error) {
+        console.error('⚠️  Rollup refresh failed:', error);
+      }
+
       // Notify connected clients
       emitToAll('data-updated', { timestamp: new Date() });
       
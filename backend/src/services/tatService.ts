@@ -2,6 +2,11 @@ import { query } from '../config/database';
 import { FilterParams } from '../types';
 import { getPeriodDates } from '../utils/dateUtils';
 
+// Read the per-day rollup tables (migration 005) instead of test_records.
+// They have no lab section per hour, so a lab section filter still reads
+// test_records.
+const DASHBOARD_ROLLUPS = process.env.DASHBOARD_ROLLUPS === 'true';
+
 export const getTATData = async (filters: FilterParams) => {
   let startDate: Date;
   let endDate: Date;
@@ -15,7 +20,11 @@ export const getTATData = async (filters: FilterParams) => {
     endDate = filters.endDate ? new Date(filters.endDate) : new Date();
   }
 
-  const conditions = ['encounter_date BETWEEN $1 AND $2', 'is_cancelled = false'];
+  const fromRollups = DASHBOARD_ROLLUPS && !(filters.labSection && filters.labSection !== 'all');
+  // Rollups leave cancelled tests out already
+  const conditions = fromRollups
+    ? ['encounter_date BETWEEN $1 AND $2']
+    : ['encounter_date BETWEEN $1 AND $2', 'is_cancelled = false'];
   const params: any[] = [startDate, endDate];
   let paramCount = 3;
 
@@ -36,30 +45,99 @@ export const getTATData = async (filters: FilterParams) => {
 
   const whereClause = conditions.join(' AND ');
 
-  // Get total tests
-  const totalResult = await query(
-    `SELECT COUNT(*) as total FROM test_records WHERE ${whereClause}`,
-    params
-  );
-  const totalTests = parseInt(totalResult.rows[0].total);
-
-  // Get delayed tests (actual_tat > tat_at_test)
-  const delayedResult = await query(
-    `SELECT COUNT(*) as delayed 
-     FROM test_records 
-     WHERE ${whereClause} AND actual_tat > tat_at_test AND time_out IS NOT NULL`,
-    params
-  );
-  const delayedTests = parseInt(delayedResult.rows[0].delayed);
-
-  // Get on-time tests
-  const onTimeResult = await query(
-    `SELECT COUNT(*) as ontime 
-     FROM test_records 
-     WHERE ${whereClause} AND actual_tat <= tat_at_test AND time_out IS NOT NULL`,
-    params
-  );
-  const onTimeTests = parseInt(onTimeResult.rows[0].ontime);
+  let totalTests: number;
+  let delayedTests: number;
+  let onTimeTests: number;
+  let dailyTrendResult;
+  let hourlyTrendResult;
+
+  if (fromRollups) {
+    const totalsResult = await query(
+      `SELECT COALESCE(SUM(requests), 0) as total,
+              COALESCE(SUM(delayed), 0) as delayed,
+              COALESCE(SUM(on_time), 0) as ontime
+       FROM rollup_daily
+       WHERE ${whereClause}`,
+      params
+    );
+    totalTests = parseInt(totalsResult.rows[0].total);
+    delayedTests = parseInt(totalsResult.rows[0].delayed);
+    onTimeTests = parseInt(totalsResult.rows[0].ontime);
+
+    dailyTrendResult = await query(
+      `SELECT encounter_date as date,
+              SUM(delayed) as delayed,
+              SUM(on_time) as on_time,
+              SUM(not_uploaded) as not_uploaded
+       FROM rollup_daily
+       WHERE ${whereClause}
+       GROUP BY encounter_date
+       ORDER BY encounter_date`,
+      params
+    );
+
+    hourlyTrendResult = await query(
+      `SELECT hour, SUM(delayed) as delayed, SUM(on_time) as ontime
+       FROM rollup_hourly
+       WHERE ${whereClause}
+       GROUP BY hour
+       ORDER BY hour`,
+      params
+    );
+  } else {
+    // Get total tests
+    const totalResult = await query(
+      `SELECT COUNT(*) as total FROM test_records WHERE ${whereClause}`,
+      params
+    );
+    totalTests = parseInt(totalResult.rows[0].total);
+
+    // Get delayed tests (actual_tat > tat_at_test)
+    const delayedResult = await query(
+      `SELECT COUNT(*) as delayed 
+       FROM test_records 
+       WHERE ${whereClause} AND actual_tat > tat_at_test AND time_out IS NOT NULL`,
+      params
+    );
+    delayedTests = parseInt(delayedResult.rows[0].delayed);
+
+    // Get on-time tests
+    const onTimeResult = await query(
+      `SELECT COUNT(*) as ontime 
+       FROM test_records 
+       WHERE ${whereClause} AND actual_tat <= tat_at_test AND time_out IS NOT NULL`,
+      params
+    );
+    onTimeTests = parseInt(onTimeResult.rows[0].ontime);
+
+    // Get daily trend. Unquoted aliases come back lower-cased, so they are
+    // snake_case to match the row.on_time / row.not_uploaded reads below
+    dailyTrendResult = await query(
+      `SELECT 
+        encounter_date::date as date,
+        COUNT(CASE WHEN actual_tat > tat_at_test AND time_out IS NOT NULL THEN 1 END) as delayed,
+        COUNT(CASE WHEN actual_tat <= tat_at_test AND time_out IS NOT NULL THEN 1 END) as on_time,
+        COUNT(CASE WHEN time_out IS NULL THEN 1 END) as not_uploaded
+       FROM test_records 
+       WHERE ${whereClause}
+       GROUP BY encounter_date::date 
+       ORDER BY encounter_date::date`,
+      params
+    );
+
+    // Get hourly trend (from time_in)
+    hourlyTrendResult = await query(
+      `SELECT 
+        EXTRACT(HOUR FROM time_in) as hour,
+        COUNT(CASE WHEN actual_tat > tat_at_test AND time_out IS NOT NULL THEN 1 END) as delayed,
+        COUNT(CASE WHEN actual_tat <= tat_at_test AND time_out IS NOT NULL THEN 1 END) as onTime
+       FROM test_records 
+       WHERE ${whereClause}
+       GROUP BY EXTRACT(HOUR FROM time_in)
+       ORDER BY hour`,
+      params
+    );
+  }
 
   // Get not uploaded tests
   const notUploadedTests = totalTests - (delayedTests + onTimeTests);
@@ -74,33 +152,6 @@ export const getTATData = async (filters: FilterParams) => {
   const avgDailyOnTime = onTimeTests / daysInPeriod;
   const avgDailyNotUploaded = notUploadedTests / daysInPeriod;
 
-  // Get daily trend
-  const dailyTrendResult = await query(
-    `SELECT 
-      encounter_date::date as date,
-      COUNT(CASE WHEN actual_tat > tat_at_test AND time_out IS NOT NULL THEN 1 END) as delayed,
-      COUNT(CASE WHEN actual_tat <= tat_at_test AND time_out IS NOT NULL THEN 1 END) as onTime,
-      COUNT(CASE WHEN time_out IS NULL THEN 1 END) as notUploaded
-     FROM test_records 
-     WHERE ${whereClause}
-     GROUP BY encounter_date::date 
-     ORDER BY encounter_date::date`,
-    params
-  );
-
-  // Get hourly trend (from time_in)
-  const hourlyTrendResult = await query(
-    `SELECT 
-      EXTRACT(HOUR FROM time_in) as hour,
-      COUNT(CASE WHEN actual_tat > tat_at_test AND time_out IS NOT NULL THEN 1 END) as delayed,
-      COUNT(CASE WHEN actual_tat <= tat_at_test AND time_out IS NOT NULL THEN 1 END) as onTime
-     FROM test_records 
-     WHERE ${whereClause}
-     GROUP BY EXTRACT(HOUR FROM time_in)
-     ORDER BY hour`,
-    params
-  );
-
   // Find most delayed hour and day
   const mostDelayedHour = hourlyTrendResult.rows.reduce((max, row) => 
     parseInt(row.delayed) > parseInt(max.delayed || 0) ? row : max, {});
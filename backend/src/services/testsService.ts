@@ -4,6 +4,10 @@ import { getPeriodDates } from '../utils/dateUtils';
 import { getTestsTargetForPeriod } from './testsTargetService';
 import moment from 'moment';
 
+// Read rollup_tests (migration 005: requests per day, test, lab section,
+// laboratory and shift) instead of test_records
+const DASHBOARD_ROLLUPS = process.env.DASHBOARD_ROLLUPS === 'true';
+
 export const getTestsData = async (filters: FilterParams) => {
   let startDate: Date;
   let endDate: Date;
@@ -17,12 +21,20 @@ export const getTestsData = async (filters: FilterParams) => {
     endDate = filters.endDate ? new Date(filters.endDate) : new Date();
   }
 
-  const conditions = ['encounter_date BETWEEN $1 AND $2', 'is_cancelled = false'];
+  const source = DASHBOARD_ROLLUPS ? 'rollup_tests' : 'test_records';
+  const requests = DASHBOARD_ROLLUPS ? 'COALESCE(SUM(requests), 0)' : 'COUNT(*)';
+  const labSection = DASHBOARD_ROLLUPS ? "NULLIF(lab_section, '')" : 'lab_section_at_test';
+  const laboratory = DASHBOARD_ROLLUPS ? "NULLIF(laboratory, '')" : 'laboratory';
+
+  // Rollups leave cancelled tests out already
+  const conditions = DASHBOARD_ROLLUPS
+    ? ['encounter_date BETWEEN $1 AND $2']
+    : ['encounter_date BETWEEN $1 AND $2', 'is_cancelled = false'];
   const params: any[] = [startDate, endDate];
   let paramCount = 3;
 
   if (filters.labSection && filters.labSection !== 'all') {
-    conditions.push(`LOWER(lab_section_at_test) = LOWER($${paramCount++})`);
+    conditions.push(`LOWER(${labSection}) = LOWER($${paramCount++})`);
     params.push(filters.labSection);
   }
 
@@ -40,7 +52,7 @@ export const getTestsData = async (filters: FilterParams) => {
 
   // Get total tests performed
   const totalResult = await query(
-    `SELECT COUNT(*) as total FROM test_records WHERE ${whereClause}`,
+    `SELECT ${requests} as total FROM ${source} WHERE ${whereClause}`,
     params
   );
   const totalTestsPerformed = parseInt(totalResult.rows[0].total);
@@ -59,8 +71,8 @@ export const getTestsData = async (filters: FilterParams) => {
 
   // Get test volume trend - FIX: Return proper format
   const volumeTrendResult = await query(
-    `SELECT encounter_date::date as date, COUNT(*) as count
-     FROM test_records 
+    `SELECT encounter_date::date as date, ${requests} as count
+     FROM ${source} 
      WHERE ${whereClause}
      GROUP BY encounter_date::date 
      ORDER BY encounter_date::date`,
@@ -74,11 +86,11 @@ export const getTestsData = async (filters: FilterParams) => {
 
   // Get top tests by hospital unit
   const topTestsResult = await query(
-    `SELECT laboratory as unit, test_name, COUNT(*) as count
-     FROM test_records 
+    `SELECT ${laboratory} as unit, test_name, ${requests} as count
+     FROM ${source} 
      WHERE ${whereClause}
-     GROUP BY laboratory, test_name
-     ORDER BY laboratory, count DESC`,
+     GROUP BY ${laboratory}, test_name
+     ORDER BY ${laboratory}, count DESC`,
     params
   );
 
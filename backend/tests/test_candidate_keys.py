@@ -0,0 +1,63 @@
+"""
+Tests of timeout_join.candidate_keys, the filename variants the timeout
+matcher looks up and the ranks that decide which match wins.
+"""
+import sys
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'scripts' / 'data-processing'))
+from timeout_join import (  # noqa: E402
+    RANK_COPY, RANK_EXTENSION, RANK_LITERAL, RANK_NAMED_ID, RANK_PREFIX, RANK_REVISION, RANK_UPPER,
+    candidate_keys,
+)
+
+
+class CandidateKeysTest(unittest.TestCase):
+
+    def test_plain_lab_numbers_are_only_literal(self):
+        for name in ('12345', '12345_2', '12345-10', '2025-04-01'):
+            with self.subTest(name=name):
+                self.assertEqual(candidate_keys(name), [(RANK_LITERAL, name)])
+
+    def test_surrounding_whitespace_is_trimmed(self):
+        self.assertEqual(candidate_keys('  12345  '), [(RANK_LITERAL, '12345')])
+
+    def test_extension(self):
+        self.assertEqual(candidate_keys('12345.pdf'),
+                         [(RANK_LITERAL, '12345.pdf'), (RANK_UPPER, '12345.PDF'), (RANK_EXTENSION, '12345')])
+
+    def test_copy_suffix(self):
+        self.assertEqual(candidate_keys('12345 - Copy'),
+                         [(RANK_LITERAL, '12345 - Copy'), (RANK_UPPER, '12345 - COPY'), (RANK_COPY, '12345')])
+
+    def test_prefix(self):
+        self.assertEqual(candidate_keys('INV-12345'), [(RANK_LITERAL, 'INV-12345'), (RANK_PREFIX, '12345')])
+
+    def test_revision(self):
+        self.assertEqual(candidate_keys('12345_REV2'), [(RANK_LITERAL, '12345_REV2'), (RANK_REVISION, '12345')])
+        self.assertEqual(candidate_keys('12345-r1'),
+                         [(RANK_LITERAL, '12345-r1'), (RANK_UPPER, '12345-R1'), (RANK_REVISION, '12345')])
+
+    def test_named_id(self):
+        self.assertEqual(candidate_keys('12345 JOHN DOE'),
+                         [(RANK_LITERAL, '12345 JOHN DOE'), (RANK_NAMED_ID, '12345')])
+
+    def test_each_key_keeps_its_best_rank(self):
+        keys = candidate_keys('copy of 12345 (2).pdf')
+        self.assertEqual([rank for rank, _ in keys], [RANK_LITERAL, RANK_UPPER, RANK_EXTENSION, RANK_COPY])
+        self.assertEqual(keys[-1], (RANK_COPY, '12345'))
+        self.assertEqual(len({key for _, key in keys}), len(keys))
+
+    def test_variants_combine(self):
+        self.assertEqual(candidate_keys('LAB 12345 v3'),
+                         [(RANK_LITERAL, 'LAB 12345 v3'), (RANK_UPPER, 'LAB 12345 V3'),
+                          (RANK_PREFIX, '12345 V3'), (RANK_REVISION, '12345')])
+
+    def test_rank_order(self):
+        self.assertEqual([RANK_LITERAL, RANK_UPPER, RANK_EXTENSION, RANK_COPY, RANK_PREFIX, RANK_REVISION,
+                          RANK_NAMED_ID], list(range(7)))
+
+
+if __name__ == '__main__':
+    unittest.main()
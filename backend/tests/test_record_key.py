@@ -0,0 +1,70 @@
+"""
+Tests of record_store.record_key, the (LabNo, TestName) dedup key of the
+record store and the legacy data.json import.
+"""
+import sys
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'scripts' / 'data-fetching'))
+import record_store  # noqa: E402
+from record_store import TEST_ID_LIMIT, record_key  # noqa: E402
+
+
+class RecordKeyTest(unittest.TestCase):
+
+    def test_numeric_lab_no_is_packed(self):
+        key = record_key('1310260000', 'FBC')
+        self.assertIsInstance(key, int)
+        self.assertEqual(key, record_key('1310260000', 'FBC'))
+        self.assertNotEqual(key, record_key('1310260000', 'Malaria'))
+        self.assertNotEqual(key, record_key('1310260001', 'FBC'))
+
+    def test_leading_zero_does_not_collide(self):
+        self.assertIsInstance(record_key('0105', 'FBC'), tuple)
+        self.assertNotEqual(record_key('0105', 'FBC'), record_key('105', 'FBC'))
+        self.assertNotEqual(record_key('0', 'FBC'), record_key('00', 'FBC'))
+
+    def test_non_numeric_lab_no_falls_back_to_a_tuple(self):
+        for lab_no in ('LAB-105', '105A', '', '١٠٥', '１０５'):
+            with self.subTest(lab_no=lab_no):
+                key = record_key(lab_no, 'FBC')
+                self.assertIsInstance(key, tuple)
+                self.assertEqual(key[0], lab_no)
+        self.assertNotEqual(record_key('١٠٥', 'FBC'), record_key('105', 'FBC'))
+
+    def test_large_test_id_does_not_spill_into_the_lab_no(self):
+        saved = dict(record_store._test_ids)
+        try:
+            record_store._test_ids.clear()
+            record_store._test_ids['FBC'] = 1
+            record_store._test_ids['Late test'] = TEST_ID_LIMIT + 1
+            # Packed, TEST_ID_LIMIT + 1 would equal LabNo 1 with test id 1
+            self.assertEqual(record_key('1', 'Late test'), ('1', TEST_ID_LIMIT + 1))
+            self.assertNotEqual(record_key('1', 'Late test'), record_key('2', 'FBC'))
+            self.assertNotEqual(record_key('0', 'Late test'), record_key('1', 'FBC'))
+        finally:
+            record_store._test_ids.clear()
+            record_store._test_ids.update(saved)
+
+    def test_import_json_skips_nothing_for_unusual_lab_nos(self):
+        import json
+        import os
+        import tempfile
+        records = [
+            {'EncounterDate': '2025-01-02', 'InvoiceNo': '1', 'LabNo': lab_no, 'Src': 'OPD', 'TestName': 'FBC'}
+            for lab_no in ('105', '0105', '١٠٥', '105')
+        ]
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'data.json')
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(records, f)
+            store = record_store.RecordStore(os.path.join(tmp, 'records.sqlite3'))
+            try:
+                self.assertEqual(store.import_json(path), 3)
+            finally:
+                store.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+"""
+Integration test of timeout.py's save_to_database against PostgreSQL.
+
+Runs in a throwaway schema of the DATABASE_URL database and is skipped
+when DATABASE_URL is not set:
+    DATABASE_URL=postgresql://... py -3.11 -m unittest discover -s tests
+"""
+import contextlib
+import io
+import os
+import sys
+import unittest
+from pathlib import Path
+
+DATABASE_URL = os.getenv('DATABASE_URL')
+
+if DATABASE_URL:
+    import psycopg2
+    from psycopg2.extensions import make_dsn
+
+    sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'scripts' / 'data-processing'))
+    import timeout
+
+SCHEMA = f"timeout_save_test_{os.getpid()}"
+
+
+def record(file_name, creation_time):
+    return {'FileName': file_name, 'CreationTime': creation_time}
+
+
+@unittest.skipUnless(DATABASE_URL, "DATABASE_URL is not set")
+class SaveToDatabaseTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.conn = psycopg2.connect(DATABASE_URL)
+        with cls.conn, cls.conn.cursor() as cur:
+            cur.execute(f"CREATE SCHEMA {SCHEMA}")
+            # As in migration 001
+            cur.execute(f"""
+                CREATE TABLE {SCHEMA}.timeout_records (
+                  id SERIAL PRIMARY KEY,
+                  file_name VARCHAR(100) UNIQUE NOT NULL,
+                  creation_time TIMESTAMP NOT NULL,
+                  imported_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+        cls.saved = (timeout.DATABASE_URL, timeout.DB_CHUNK_SIZE, timeout.ROLLUPS_ENABLED)
+        timeout.close_db_pool()
+        timeout.DATABASE_URL = make_dsn(DATABASE_URL, options=f"-csearch_path={SCHEMA}")
+        # Small chunks so a batch spans several COPY + upsert rounds
+        timeout.DB_CHUNK_SIZE = 2
+        timeout.ROLLUPS_ENABLED = False
+
+    @classmethod
+    def tearDownClass(cls):
+        timeout.close_db_pool()
+        timeout.DATABASE_URL, timeout.DB_CHUNK_SIZE, timeout.ROLLUPS_ENABLED = cls.saved
+        with cls.conn, cls.conn.cursor() as cur:
+            cur.execute(f"DROP SCHEMA {SCHEMA} CASCADE")
+        cls.conn.close()
+
+    def setUp(self):
+        with self.conn, self.conn.cursor() as cur:
+            cur.execute(f"TRUNCATE {SCHEMA}.timeout_records")
+
+    def rows(self):
+        with self.conn, self.conn.cursor() as cur:
+            cur.execute(f"SELECT file_name, to_char(creation_time, 'MM/DD/YYYY HH:MI AM'), imported_at "
+                        f"FROM {SCHEMA}.timeout_records ORDER BY file_name")
+            return cur.fetchall()
+
+    def save(self, records):
+        """save_to_database's result and its last line of output"""
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            ok = timeout.save_to_database(records)
+        return ok, out.getvalue().strip().splitlines()[-1]
+
+    def test_inserts_new_records(self):
+        ok, message = self.save([record('A1', '01/02/2025 09:15 AM'), record('A2', '01/02/2025 10:00 AM'),
+                                 record('A3', '01/03/2025 01:30 PM')])
+        self.assertTrue(ok)
+        self.assertIn("3 rows written, 0 unchanged rows skipped", message)
+        self.assertEqual([(name, time) for name, time, _ in self.rows()],
+                         [('A1', '01/02/2025 09:15 AM'), ('A2', '01/02/2025 10:00 AM'),
+                          ('A3', '01/03/2025 01:30 PM')])
+
+    def test_unchanged_rows_are_skipped_and_changed_ones_updated(self):
+        self.save([record('A1', '01/02/2025 09:15 AM'), record('A2', '01/02/2025 10:00 AM')])
+        before = {name: imported for name, _, imported in self.rows()}
+
+        ok, message = self.save([record('A1', '01/02/2025 09:15 AM'), record('A2', '01/05/2025 11:45 AM'),
+                                 record('A3', '01/03/2025 01:30 PM')])
+        self.assertTrue(ok)
+        self.assertIn("2 rows written, 1 unchanged rows skipped", message)
+        rows = {name: (time, imported) for name, time, imported in self.rows()}
+        self.assertEqual(rows['A1'], ('01/02/2025 09:15 AM', before['A1']))
+        self.assertEqual(rows['A2'][0], '01/05/2025 11:45 AM')
+        self.assertEqual(rows['A3'][0], '01/03/2025 01:30 PM')
+
+    def test_duplicates_within_a_chunk_keep_the_latest_time(self):
+        ok, message = self.save([record('A1', '01/02/2025 09:15 AM'), record('A1', '01/04/2025 08:00 AM')])
+        self.assertTrue(ok)
+        self.assertIn("1 rows written, 0 unchanged rows skipped", message)
+        self.assertEqual([(name, time) for name, time, _ in self.rows()], [('A1', '01/04/2025 08:00 AM')])
+
+    def test_failure_reports_false(self):
+        ok, message = self.save([record('A1', '01/02/2025 09:15 AM'), record('A2', '01/02/2025 10:00 AM'),
+                                 record('X' * 101, '01/02/2025 10:00 AM')])
+        self.assertFalse(ok)
+        self.assertIn("2 rows written before the failure", message)
+        self.assertEqual(len(self.rows()), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()